@@ -0,0 +1,82 @@
+"""
+Generates synthetic inventory databases for the benchmarks. Run from the
+repository root:
+
+    python -m benchmarks.generate DATABASE_FILE ROWS [--borrowed 0.3] [--seed 0]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import datetime
+import os
+import random
+import sys
+
+from database import Database
+
+ITEMS = ['Laptop', 'Microphone', 'Pen', 'Monitor', 'Keyboard', 'Strapped Bag',
+         'Mouse', 'Notebook', 'CD', 'USB Stick', 'Desk', 'Key']
+STATES = ['Requested', 'Borrowed']
+ROOMS = ['Room {}'.format(100 + number) for number in range(50)]
+BORROWERS = 500  # distinct borrowers the borrowed assets are shared between
+
+
+def populate(db, rows, borrowed=0.3, seed=0):
+    """
+    Fills an empty database with rows assets, numbered from 0, a fraction of them borrowed
+    or requested. The same seed always gives the same database.
+    """
+
+    generator = random.Random(seed)
+    today = datetime.date.today()
+
+    db.executemany('INSERT INTO assets VALUES (?,?,?,?,?)',
+                   ([asset_id, generator.choice(ITEMS), 'Asset {}'.format(asset_id),
+                     None, generator.choice(ROOMS)]
+                    for asset_id in range(rows)))
+
+    def borrow_rows():
+        for asset_id in range(rows):
+            if generator.random() < borrowed:
+                due = today + datetime.timedelta(days=generator.randint(-60, 60))
+                yield [asset_id, 'Borrower {}'.format(asset_id % BORROWERS),
+                       'borrower{}@example.com'.format(asset_id % BORROWERS),
+                       generator.choice(STATES), str(today), str(due), None]
+
+    db.executemany('INSERT INTO borrow_list VALUES (?,?,?,?,?,?,?)', borrow_rows())
+    db.commit()
+
+
+def generate(path, rows, borrowed=0.3, seed=0):
+    """
+    Creates an inventory database file at path, replacing any file there, filled by populate
+    """
+
+    for name in [path, path + '-wal', path + '-shm']:
+        if os.path.exists(name):
+            os.remove(name)
+
+    db = Database(path)
+    try:
+        db.create_schema()
+        populate(db, rows, borrowed, seed)
+    finally:
+        db.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Generates a synthetic inventory database.')
+    parser.add_argument('database', help='file to create, replaced if it exists')
+    parser.add_argument('rows', type=int, help='number of assets')
+    parser.add_argument('--borrowed', type=float, default=0.3, help='fraction of assets borrowed or requested')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    generate(args.database, args.rows, args.borrowed, args.seed)
+    print('{}: {} assets'.format(args.database, args.rows))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+Compares the memory taken by the rows of the admin asset list stored as plain
+lists against AssetRecords. Run from the repository root:
+
+    python -m benchmarks.memory [ROWS]
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import gc
+import sys
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from benchmarks.generate import populate
+from database import Database
+from manager import ASSET_QUERY, AssetRecord
+
+
+def measure(db, make_row):
+    """
+    Returns the bytes allocated to hold every asset as make_row(database row)
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    items = [make_row(row) for row in db.execute(ASSET_QUERY)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    del items
+    return size
+
+
+def main(rows):
+    if tracemalloc is None:
+        print('tracemalloc is needed to measure memory (Python 3.4+)')
+        return 1
+
+    db = Database(':memory:')
+    db.create_schema()
+    populate(db, rows)
+
+    list_size = measure(db, list)
+    record_size = measure(db, AssetRecord.from_row)
+
+    print('{} assets'.format(rows))
+    for name, size in [('list', list_size), ('AssetRecord', record_size)]:
+        print('{:<12} {:>10.1f} MiB {:>8.1f} bytes/asset'.format(name, size / 2 ** 20, size / rows))
+    print('AssetRecords use {:.0%} of the memory of lists'.format(record_size / list_size))
+
+    db.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
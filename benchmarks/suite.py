@@ -0,0 +1,476 @@
+"""
+Times the main operations of the applications on generated databases and
+prints the timings as JSON, so runs of different versions can be compared.
+Run from the repository root:
+
+    python -m benchmarks.suite [--sizes 10000 100000 1000000] [--borrowed 0.3] [--output FILE]
+    python -m benchmarks.suite --compare OLD_FILE NEW_FILE
+
+Loading, searching, sorting, adding items and checking out are timed through
+the manager and kiosk applications themselves, which need Tk and a display.
+Without a DISPLAY the suite runs them on Xvfb if it is installed, otherwise
+only the timings of the database and the store are taken.
+"""
+
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from timeit import default_timer
+
+from benchmarks.generate import generate
+import inventory
+from listbox import tk
+import manager
+from store import ASSET_COLUMNS, AssetSearch, InventoryStore
+
+SIZES = [10000, 100000]
+REPEAT = 3  # runs of each timing, the fastest is kept
+TYPED_QUERY = 'laptop'  # searched a keystroke at a time
+CHECKOUT_SIZE = 100  # assets per checkout
+PAGE_SIZE = 200  # rows per page of the paged list
+BULK_ADD_SIZE = 10000  # assets per bulk insert
+XVFB_DISPLAY = ':99'
+POLL_DELAY = 0.001  # s between checks for a finished database job, leaves the worker the CPU
+SLOWER = 1.2  # compare flags timings that took this many times longer
+
+
+def best_time(function, setup=None, repeat=REPEAT):
+    """
+    Returns the shortest time in seconds of repeat calls of function, setup is called untimed before each
+    """
+
+    best = None
+
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+
+        start = default_timer()
+        function()
+        elapsed = default_timer() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+
+def wait(root, done, worker=None):
+    """
+    Runs the Tk event loop, and the callbacks of the worker's finished jobs, until done() is true
+    """
+
+    while not done():
+        if worker is not None:
+            worker.poll()
+            time.sleep(POLL_DELAY)
+        root.update()
+
+
+def start_application(module, root, directory, path):
+    """
+    Starts the Application of the manager or kiosk module on the database at path in a window
+    of its own, and waits for its first load to finish
+    """
+
+    settings_path = os.path.join(directory, 'settings.json')
+    with open(settings_path, 'w') as settings:
+        json.dump({'database_path': path, 'first_name': 'Benchmark', 'last_name': 'Run',
+                   'email': 'benchmark@example.com'}, settings)
+    module.SETTINGS_PATH = settings_path
+
+    app = module.Application(tk.Toplevel(root))
+    app.master.geometry('1200x800')
+
+    # Other applications' changes are not being timed
+    app.master.after_cancel(app.sync_job)
+    wait(root, lambda: app.load_job is None)
+
+    return app
+
+
+def time_load(root, app):
+    def load():
+        app.load_assets()
+        wait(root, lambda: app.load_job is None)
+
+    return best_time(load)
+
+
+def time_store(store):
+    """
+    Times the full text search of the database
+    """
+
+    timings = {}
+
+    for query in ['laptop', 'lap', '"asset 42"']:
+        timings['search_text {}'.format(query)] = best_time(lambda: store.search_text(query))
+
+    return timings
+
+
+def time_paging(store, rows):
+    """
+    Times the database reading pages of a sorted search, as the paged asset list does
+    """
+
+    timings = {}
+    search = AssetSearch(ASSET_COLUMNS)
+    item_column = [(ASSET_COLUMNS.index('name'), False)]
+    middle = rows // 2
+
+    timings['page count'] = best_time(lambda: search.count(store.db))
+    timings['page first'] = best_time(lambda: search.page(store.db, 0, PAGE_SIZE, item_column))
+    timings['page offset middle'] = best_time(lambda: search.page(store.db, middle, PAGE_SIZE, item_column))
+
+    before, key = search.page(store.db, middle - PAGE_SIZE, PAGE_SIZE, item_column)
+    timings['page keyset middle'] = best_time(lambda: search.page(store.db, middle, PAGE_SIZE, item_column, key))
+
+    laptops = AssetSearch(ASSET_COLUMNS, 'laptop', [(ASSET_COLUMNS.index('state'), 'available')])
+    timings['page search'] = best_time(lambda: (laptops.count(store.db),
+                                                laptops.page(store.db, 0, PAGE_SIZE, item_column)))
+
+    return timings
+
+
+def time_list(root, listbox):
+    """
+    Times sorting, filtering and sizing an application's asset list
+    """
+
+    timings = {}
+
+    def sortby(column):
+        listbox.sortby(column)
+        root.update()
+
+    timings['sortby'] = best_time(lambda: sortby('Item'))
+    timings['sortby 3 columns'] = best_time(lambda: [sortby(column) for column in ['Asset Number', 'Item', 'Due Date']])
+
+    laptops = [ix for ix, item in enumerate(listbox.items) if item.item == 'Laptop']
+
+    def filter_and_clear():
+        listbox.set_filter(None, laptops)
+        root.update()
+        listbox.set_filter(None)
+        root.update()
+
+    timings['repopulate_list'] = best_time(filter_and_clear)
+
+    def fit_columns():
+        listbox.reset_widths()
+        listbox.fit_columns()
+        root.update()
+
+    timings['fit_columns'] = best_time(fit_columns)
+
+    return timings
+
+
+def time_manager(root, directory, path, rows):
+    """
+    Times the manager loading, searching, sorting and bulk adding assets. Adding changes the database.
+    """
+
+    timings = {}
+    app = start_application(manager, root, directory, path)
+
+    try:
+        timings['retrieve_assets'] = time_load(root, app)
+
+        today = datetime.date.today()
+        for query in ['laptop', 'room 12', 'borrower 42', 'state:overdue', 'laptop state:borrowed',
+                      'due:..{}'.format(today), 'no such asset']:
+            timings['filter_assets {}'.format(query)] = best_time(lambda: app.filter_assets(query),
+                                                                  app.incremental_search.cache.clear)
+
+        def search(query):
+            # As if typed: the search bar schedules a search, run it straight away
+            app.search_query.set(query)
+            app.master.after_cancel(app.search_job)
+            app.run_search()
+            root.update()
+
+        def type_query():
+            for length in range(1, len(TYPED_QUERY) + 1):
+                search(TYPED_QUERY[:length])
+
+        def clear_search():
+            search('')
+            app.incremental_search.cache.clear()
+
+        timings['search typed'] = best_time(type_query, clear_search)
+        clear_search()
+
+        timings.update(time_list(root, app.asset_list))
+
+        # New asset numbers after the generated ones, entered in the add window
+        first_ids = iter(range(rows, rows + BULK_ADD_SIZE * REPEAT, BULK_ADD_SIZE))
+        windows = []
+
+        def open_window():
+            first = next(first_ids)
+            window = manager.AddItemWindow(app)
+            window.asset_num_entry.set_text('{}-{}'.format(first, first + BULK_ADD_SIZE - 1))
+            window.name_entry.set_text('Laptop')
+            window.storage_entry.set_text('Room 100')
+            windows.append(window)
+
+        def add_items():
+            window = windows.pop()
+            window.add_items(False)
+            wait(root, lambda: not window.root.winfo_exists(), app.worker)
+
+        timings['add_items bulk insert'] = best_time(add_items, open_window)
+    finally:
+        app.close()
+
+    return timings
+
+
+def time_kiosk(root, directory, path):
+    """
+    Times the kiosk loading and checking out carts. Checking out changes the database.
+    """
+
+    timings = {}
+    app = start_application(inventory, root, directory, path)
+
+    try:
+        timings['kiosk load_assets'] = time_load(root, app)
+
+        def fill_cart():
+            # What double clicking available assets does
+            shown = app.asset_list.filtered_items_ix
+            cart = 0
+
+            for position in range(len(shown)):
+                ix = shown[position]
+                item = app.asset_list_items[ix]
+
+                if item.state == 'Available':
+                    app.asset_list_items[ix] = item.replace(state='Shopping Cart')
+                    app.index_item(ix)
+                    app.asset_list.refresh_item(ix, item)
+                    app.shopping_cart.add_item(ix)
+                    cart += 1
+
+                    if cart == CHECKOUT_SIZE:
+                        break
+
+            app.update_cart_count()
+            root.update()
+
+        def checkout():
+            app.checkout_cart()
+            root.update()
+
+        timings['checkout_cart'] = best_time(checkout, fill_cart)
+    finally:
+        app.close()
+
+    return timings
+
+
+def time_store_writes(store, rows):
+    """
+    Times the store's checkout and bulk insert on their own, without an application. Run last.
+    """
+
+    timings = {}
+    available = []
+
+    for page in store.find_assets(state='Available'):
+        available.extend(row[0] for row in page)
+        if len(available) >= CHECKOUT_SIZE * REPEAT:
+            break
+
+    carts = iter([available[start:start + CHECKOUT_SIZE]
+                  for start in range(0, CHECKOUT_SIZE * REPEAT, CHECKOUT_SIZE)])
+    timings['store checkout'] = best_time(lambda: store.checkout(next(carts), 'Benchmark', 'benchmark@example.com',
+                                                                 'Benchmark'))
+
+    # After the numbers the manager's add window took
+    first_ids = iter(range(rows + BULK_ADD_SIZE * REPEAT, rows + BULK_ADD_SIZE * REPEAT * 2, BULK_ADD_SIZE))
+
+    def bulk_add():
+        first = next(first_ids)
+        store.add_assets(list(range(first, first + BULK_ADD_SIZE)), ['Laptop', None, None, 'Room 100'])
+
+    timings['store add_assets'] = best_time(bulk_add)
+
+    return timings
+
+
+def run_size(directory, rows, borrowed, seed, root):
+    path = os.path.join(directory, 'inventory-{}.db'.format(rows))
+
+    start = default_timer()
+    generate(path, rows, borrowed, seed)
+    timings = {'generate': default_timer() - start}
+
+    store = InventoryStore.open(path)
+
+    try:
+        timings.update(time_store(store))
+        timings.update(time_paging(store, rows))
+
+        if root is not None:
+            timings.update(time_manager(root, directory, path, rows))
+            timings.update(time_kiosk(root, directory, path))
+
+        timings.update(time_store_writes(store, rows))
+    finally:
+        store.close()
+
+    return {'assets': rows, 'timings': timings}
+
+
+def virtual_display():
+    """
+    Starts Xvfb and points DISPLAY at it, returns the process or None if Xvfb is not installed
+    """
+
+    try:
+        with open(os.devnull, 'w') as devnull:
+            process = subprocess.Popen(['Xvfb', XVFB_DISPLAY, '-screen', '0', '1280x1024x24'],
+                                       stdout=devnull, stderr=devnull)
+    except OSError:
+        return None
+
+    os.environ['DISPLAY'] = XVFB_DISPLAY
+    time.sleep(1)  # let the server start listening
+    return process
+
+
+def git_commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                           stderr=devnull).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, borrowed, seed, gui=True, directory=None):
+    """
+    Runs the benchmarks at every size, returns the results ready to be saved as JSON
+    """
+
+    results = {'commit': git_commit(),
+               'date': datetime.datetime.now().isoformat(),
+               'python': platform.python_version(),
+               'sqlite': sqlite3.sqlite_version,
+               'platform': platform.platform(),
+               'borrowed': borrowed,
+               'seed': seed,
+               'repeat': REPEAT,
+               'application_timings': None,
+               'sizes': []}
+
+    display = None
+    root = None
+
+    if gui:
+        if not os.environ.get('DISPLAY'):
+            display = virtual_display()
+
+        try:
+            root = tk.Tk()
+            root.withdraw()
+            results['application_timings'] = 'timed'
+        except tk.TclError as ex:
+            results['application_timings'] = 'skipped: {}'.format(ex)
+    else:
+        results['application_timings'] = 'skipped'
+
+    temporary = directory is None
+    if temporary:
+        directory = tempfile.mkdtemp(prefix='inventory-benchmark-')
+
+    try:
+        for rows in sizes:
+            print('{} assets...'.format(rows), file=sys.stderr)
+            results['sizes'].append(run_size(directory, rows, borrowed, seed, root))
+    finally:
+        if root is not None:
+            root.destroy()
+        if display is not None:
+            display.terminate()
+        if temporary:
+            shutil.rmtree(directory)
+
+    return results
+
+
+def compare(old, new):
+    """
+    Prints how the timings of two result files differ at the sizes they share
+    """
+
+    old_sizes = dict((size['assets'], size['timings']) for size in old['sizes'])
+
+    print('{} ({}) -> {} ({})'.format(old.get('commit'), old.get('date'), new.get('commit'), new.get('date')))
+
+    for size in new['sizes']:
+        if size['assets'] not in old_sizes:
+            continue
+
+        print('\n{} assets'.format(size['assets']))
+        old_timings = old_sizes[size['assets']]
+
+        for name in sorted(size['timings']):
+            if name not in old_timings:
+                continue
+
+            before = old_timings[name]
+            after = size['timings'][name]
+            ratio = after / before if before else float('inf')
+            print('{:<28} {:>10.4f} s {:>10.4f} s {:>7.2f}x{}'.format(name, before, after, ratio,
+                                                                     '  slower' if ratio > SLOWER else ''))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Times the inventory applications on generated databases.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES, help='numbers of assets, e.g. 10000 1000000')
+    parser.add_argument('--borrowed', type=float, default=0.3, help='fraction of assets borrowed or requested')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-gui', action='store_true', help='leave out the application timings')
+    parser.add_argument('--keep', metavar='DIRECTORY', help='generate the databases in DIRECTORY and keep them')
+    parser.add_argument('--output', help='JSON file for the results, printed if not given')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as old, open(args.compare[1]) as new:
+            compare(json.load(old), json.load(new))
+        return 0
+
+    if args.keep and not os.path.isdir(args.keep):
+        os.makedirs(args.keep)
+
+    results = json.dumps(run(args.sizes, args.borrowed, args.seed, not args.no_gui, args.keep),
+                         indent=2, sort_keys=True)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(results + '\n')
+    else:
+        print(results)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
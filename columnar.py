@@ -0,0 +1,241 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from array import array
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from database import NO_VALUE
+
+FIELD_TERM = re.compile(r'(?:^|\s)(\w+):(\S*)')  # state:overdue, due:2017-01-01..2017-02-01
+RANGE = '..'
+ROW_MATCH_RATIO = 8  # rows are checked one by one when the store holds this many times more
+
+
+def split_fields(query, fields):
+    """
+    Separates the field:value terms of a search query from its free text. fields maps the
+    field names accepted to column positions. Returns the text and a list of (position, value).
+    """
+
+    terms = []
+
+    def take(match):
+        name = match.group(1).lower()
+        if name not in fields:
+            return match.group(0)
+
+        terms.append((fields[name], match.group(2)))
+        return ' '
+
+    text = FIELD_TERM.sub(take, query)
+    return ' '.join(text.split()), terms
+
+
+class ColumnStore(object):
+    """
+    Column-wise copy of the asset list for filtering whole columns at once.
+
+    Every column is kept as a list of strings next to asset_list_items, except
+    categorical columns (few distinct values, such as the state) which keep
+    small integer codes. With NumPy the columns are turned into arrays the
+    first time they are filtered after a change, so repeated filters run
+    vectorized. Without it the same operations run over the lists in pure
+    Python. Sorting is left to SortEngine.
+
+    Masks are indexed by row index. Filtering takes and returns row indexes,
+    ready for filtered_items_ix.
+    """
+
+    def __init__(self, positions, categorical=(), use_numpy=True):
+        self.positions = list(positions)  # columns kept, by position in a row
+        self.categorical = set(categorical)
+        self.numpy = numpy if use_numpy else None
+        self.build([])
+
+    def build(self, items):
+        """
+        Rebuilds the columns from scratch for the given rows
+        """
+
+        self.columns = dict((position, []) for position in self.positions
+                            if position not in self.categorical)
+        self.codes = dict((position, array(str('i'))) for position in self.categorical)
+        self.categories = dict((position, []) for position in self.categorical)
+        self.category_codes = dict((position, {}) for position in self.categorical)
+        self.live = bytearray()  # 1 for the rows that were not removed
+        self.arrays = {}  # cached NumPy arrays, dropped on every change
+
+        for ix, values in enumerate(items):
+            self.add(ix, values)
+
+    def add(self, ix, values):
+        """
+        Stores a new row, or replaces the values of an existing one
+        """
+
+        while len(self.live) <= ix:
+            self.live.append(0)
+            for column in self.columns.values():
+                column.append(NO_VALUE)
+            for codes in self.codes.values():
+                codes.append(-1)
+
+        for position, column in self.columns.items():
+            column[ix] = str(values[position])
+
+        for position, codes in self.codes.items():
+            codes[ix] = self._code(position, str(values[position]))
+
+        self.live[ix] = 1
+        self.arrays = {}
+
+    def update(self, ix, values):
+        self.add(ix, values)
+
+    def remove(self, ix):
+        """
+        Drops a row, it will no longer match any filter
+        """
+
+        if ix < len(self.live):
+            self.live[ix] = 0
+            self.arrays = {}
+
+    def match(self, position, value):
+        """
+        Returns the mask of the live rows whose column matches value, case insensitively.
+        Categorical columns match whole values, 'low..high' matches a range (either end
+        may be left out) and anything else matches a substring.
+        """
+
+        value = value.lower()
+
+        if position in self.categorical:
+            codes = [code for code, category in enumerate(self.categories[position])
+                     if category.lower() == value]
+            return self._isin(position, codes)
+        elif RANGE in value:
+            low, high = value.split(RANGE, 1)
+            return self._between(position, low, high)
+        else:
+            return self._contains(position, value)
+
+    def matches(self, ix, position, value):
+        """
+        Returns True if the column of a single live row matches value, the same way match does
+        """
+
+        if ix >= len(self.live) or not self.live[ix]:
+            return False
+
+        value = value.lower()
+
+        if position in self.categorical:
+            return self.categories[position][self.codes[position][ix]].lower() == value
+
+        text = self.columns[position][ix]
+        if RANGE in value:
+            low, high = value.split(RANGE, 1)
+            return (text != NO_VALUE and (not low or text.lower() >= low)
+                    and (not high or text.lower() <= high))
+
+        return value in text.lower()
+
+    def filter(self, ixs, terms):
+        """
+        Returns the row indexes of ixs, in order, matching every (position, value) term
+        """
+
+        ixs = list(ixs)
+        if not terms:
+            return ixs
+
+        if len(ixs) * ROW_MATCH_RATIO < len(self.live):
+            # A few rows, such as a page being loaded, cost less to check than whole columns
+            return [ix for ix in ixs if all(self.matches(ix, position, value) for position, value in terms)]
+
+        return self.select(ixs, [self.match(position, value) for position, value in terms])
+
+    def select(self, ixs, masks):
+        """
+        Returns the row indexes of ixs, in order, that are set in every mask
+        """
+
+        if not masks:
+            return list(ixs)
+
+        if self.numpy is not None:
+            mask = masks[0]
+            for other in masks[1:]:
+                mask = mask & other
+
+            ixs = self.numpy.asarray(ixs, dtype=self.numpy.intp)
+            return ixs[mask[ixs]].tolist()
+
+        return [ix for ix in ixs if all(mask[ix] for mask in masks)]
+
+    def _code(self, position, value):
+        codes = self.category_codes[position]
+        code = codes.get(value)
+
+        if code is None:
+            code = codes[value] = len(self.categories[position])
+            self.categories[position].append(value)
+
+        return code
+
+    def _array(self, position, kind):
+        key = (position, kind)
+
+        if key not in self.arrays:
+            np = self.numpy
+
+            if kind == 'live':
+                result = np.frombuffer(bytes(self.live), dtype=np.uint8).astype(bool)
+            elif kind == 'codes':
+                result = np.array(self.codes[position], dtype=np.int32)
+            elif kind == 'text':
+                result = np.array(self.columns[position], dtype=np.str_)
+            elif kind == 'lower':
+                result = np.char.lower(self._array(position, 'text'))
+
+            self.arrays[key] = result
+
+        return self.arrays[key]
+
+    def _isin(self, position, codes):
+        if self.numpy is not None:
+            return self.numpy.isin(self._array(position, 'codes'), codes) & self._array(None, 'live')
+
+        codes = set(codes)
+        column = self.codes[position]
+        return bytearray(live and column[ix] in codes for ix, live in enumerate(self.live))
+
+    def _contains(self, position, value):
+        if self.numpy is not None:
+            found = self.numpy.char.find(self._array(position, 'lower'), value) >= 0
+            return found & self._array(None, 'live')
+
+        column = self.columns[position]
+        return bytearray(live and value in column[ix].lower() for ix, live in enumerate(self.live))
+
+    def _between(self, position, low, high):
+        # Text ranges, which is what the YYYY-MM-DD dates are compared as
+        if self.numpy is not None:
+            column = self._array(position, 'lower')
+            mask = (column != NO_VALUE) & self._array(None, 'live')
+            if low:
+                mask &= column >= low
+            if high:
+                mask &= column <= high
+            return mask
+
+        column = self.columns[position]
+        return bytearray(live and column[ix] != NO_VALUE
+                         and (not low or column[ix].lower() >= low)
+                         and (not high or column[ix].lower() <= high)
+                         for ix, live in enumerate(self.live))
@@ -0,0 +1,570 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from contextlib import contextmanager
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+
+if sys.version_info.major == 2:
+    import Queue as queue
+else:
+    import queue
+
+from instrumentation import metrics
+
+# WAL lets the kiosks keep reading while an admin writes, and a writer waits
+# a moment for the lock instead of failing with "database is locked" straight away.
+# Longer waits are left to the retries of Database.transaction.
+DEFAULT_PRAGMAS = [('journal_mode', 'WAL'),
+                   ('synchronous', 'NORMAL'),  # safe with WAL, only a checkpoint syncs
+                   ('cache_size', -16000),  # KiB
+                   ('mmap_size', 256 * 1024 * 1024),
+                   ('busy_timeout', 250),  # ms
+                   ('temp_store', 'MEMORY')]
+LOCK_RETRIES = 5  # further attempts at the write lock of an immediate transaction
+LOCK_BACKOFF = 0.05  # s, pause before the first retry, doubled for each one after it
+MAX_LOCK_BACKOFF = 1.0  # s
+STATEMENT_CACHE_SIZE = 128  # prepared statements kept per connection
+MAX_QUERY_PARAMETERS = 500  # stay well under SQLite's limit on ? parameters per statement
+
+ASSET_SCHEMA = [
+    ('CREATE TABLE IF NOT EXISTS assets ('
+     'asset_id INTEGER PRIMARY KEY,'
+     'name TEXT NOT NULL,'
+     'description TEXT,'
+     'purchase_date TEXT,'
+     'storage_location TEXT)'),
+    ('CREATE TABLE IF NOT EXISTS borrow_list ('
+     'asset_id INTEGER PRIMARY KEY,'
+     'borrower_name TEXT NOT NULL,'
+     'borrower_email TEXT NOT NULL,'
+     'state TEXT NOT NULL,'
+     'date_requested TEXT NOT NULL,'
+     'return_date TEXT NOT NULL,'
+     'comments TEXT)'),
+]
+
+# Every write to assets or borrow_list stamps the asset with the next version, so
+# an application only has to re-read the assets changed since the version it last saw.
+# There is one row per asset, deleted assets keep theirs so the deletion is seen.
+CHANGE_LOG_SCHEMA = [
+    ('CREATE TABLE IF NOT EXISTS change_log ('
+     'asset_id INTEGER PRIMARY KEY,'
+     'version INTEGER NOT NULL)'),
+    'CREATE INDEX IF NOT EXISTS change_log_version ON change_log (version)',
+]
+LOG_CHANGE = ('INSERT OR REPLACE INTO change_log VALUES ({}, '
+              '(SELECT IFNULL(MAX(version), 0) + 1 FROM change_log)); ')
+for table in ['assets', 'borrow_list']:
+    CHANGE_LOG_SCHEMA += [
+        ('CREATE TRIGGER IF NOT EXISTS {0}_insert_log AFTER INSERT ON {0} '
+         'BEGIN ' + LOG_CHANGE.format('NEW.asset_id') + 'END').format(table),
+        ('CREATE TRIGGER IF NOT EXISTS {0}_update_log AFTER UPDATE ON {0} '
+         'BEGIN ' + LOG_CHANGE.format('OLD.asset_id') + LOG_CHANGE.format('NEW.asset_id') + 'END').format(table),
+        ('CREATE TRIGGER IF NOT EXISTS {0}_delete_log AFTER DELETE ON {0} '
+         'BEGIN ' + LOG_CHANGE.format('OLD.asset_id') + 'END').format(table),
+    ]
+
+INDEX_SCHEMA = [
+    'CREATE INDEX IF NOT EXISTS borrow_list_state ON borrow_list (state)',
+    'CREATE INDEX IF NOT EXISTS borrow_list_return_date ON borrow_list (return_date)',
+    'CREATE INDEX IF NOT EXISTS borrow_list_borrower_email ON borrow_list (borrower_email)',
+    'CREATE INDEX IF NOT EXISTS assets_storage_location ON assets (storage_location)',
+]
+
+# Full text index of the words in each asset's name, description and comments, the rowid
+# is the asset number. It keeps its own copy of the text since comments come from
+# borrow_list, and triggers keep it in step with both tables. An asset replaced with
+# INSERT OR REPLACE only fires the insert trigger, hence OR REPLACE there too.
+TEXT_SCHEMA = [
+    ("CREATE VIRTUAL TABLE IF NOT EXISTS asset_text USING fts5("
+     "name, description, comments, prefix='2 3')"),
+    ('INSERT INTO asset_text (rowid, name, description, comments) '
+     'SELECT assets.asset_id, name, description, comments '
+     'FROM assets LEFT JOIN borrow_list ON assets.asset_id=borrow_list.asset_id'),
+    ('CREATE TRIGGER IF NOT EXISTS assets_insert_text AFTER INSERT ON assets BEGIN '
+     'INSERT OR REPLACE INTO asset_text (rowid, name, description, comments) '
+     'VALUES (NEW.asset_id, NEW.name, NEW.description, '
+     '(SELECT comments FROM borrow_list WHERE asset_id=NEW.asset_id)); END'),
+    ('CREATE TRIGGER IF NOT EXISTS assets_update_text AFTER UPDATE ON assets BEGIN '
+     'DELETE FROM asset_text WHERE rowid=OLD.asset_id; '
+     'INSERT OR REPLACE INTO asset_text (rowid, name, description, comments) '
+     'VALUES (NEW.asset_id, NEW.name, NEW.description, '
+     '(SELECT comments FROM borrow_list WHERE asset_id=NEW.asset_id)); END'),
+    ('CREATE TRIGGER IF NOT EXISTS assets_delete_text AFTER DELETE ON assets BEGIN '
+     'DELETE FROM asset_text WHERE rowid=OLD.asset_id; END'),
+    ('CREATE TRIGGER IF NOT EXISTS borrow_list_insert_text AFTER INSERT ON borrow_list BEGIN '
+     'UPDATE asset_text SET comments=NEW.comments WHERE rowid=NEW.asset_id; END'),
+    ('CREATE TRIGGER IF NOT EXISTS borrow_list_update_text AFTER UPDATE ON borrow_list BEGIN '
+     'UPDATE asset_text SET comments=NULL WHERE rowid=OLD.asset_id; '
+     'UPDATE asset_text SET comments=NEW.comments WHERE rowid=NEW.asset_id; END'),
+    ('CREATE TRIGGER IF NOT EXISTS borrow_list_delete_text AFTER DELETE ON borrow_list BEGIN '
+     'UPDATE asset_text SET comments=NULL WHERE rowid=OLD.asset_id; END'),
+]
+
+# Lets the paged asset list read a page sorted by item name without sorting every asset
+PAGING_SCHEMA = [
+    'CREATE INDEX IF NOT EXISTS assets_name ON assets (name)',
+]
+
+# MIGRATIONS[n] upgrades a database from user_version n to n + 1. Files made before
+# the schema was versioned are at 0 and already have the tables, hence IF NOT EXISTS.
+MIGRATIONS = [
+    ASSET_SCHEMA,
+    CHANGE_LOG_SCHEMA,
+    INDEX_SCHEMA,
+    TEXT_SCHEMA,
+    PAGING_SCHEMA,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Column expressions for the values shown in the asset lists, so rows come out of
+# the query ready to display. Assets without a borrow_list row are available,
+# borrowed items past their return date are overdue and missing values show as ---.
+NO_VALUE = '---'
+STATE_COLUMN = ("CASE WHEN borrow_list.state IS NULL THEN 'Available' "
+                "WHEN borrow_list.state = 'Borrowed' "
+                "AND borrow_list.return_date < date('now', 'localtime') THEN 'Overdue' "
+                "ELSE borrow_list.state END")
+
+
+def fts5_available():
+    """
+    Returns True if this build of SQLite has the FTS5 module the full text index needs
+    """
+
+    conn = sqlite3.connect(':memory:')
+
+    try:
+        conn.execute('CREATE VIRTUAL TABLE probe USING fts5(text)')
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+
+
+# Without FTS5 databases go without the text index, and searches match in memory or with INSTR
+FTS5 = fts5_available()
+
+
+def display_column(column):
+    return "COALESCE({}, '{}')".format(column, NO_VALUE)
+
+
+def is_locked(error):
+    """
+    Returns True if a database error means another connection holds the lock
+    """
+
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+_statement_names = {}  # query -> name of its metrics
+TABLE_KEYWORDS = ['FROM', 'INTO', 'UPDATE', 'TABLE', 'ON']  # the word after one names a table
+
+
+def statement_name(query):
+    """
+    Returns the name the metrics of a statement are recorded under, its verb and first table
+    such as 'sql SELECT assets'
+    """
+
+    name = _statement_names.get(query)
+
+    if name is None:
+        words = [word for word in query.replace('(', ' ').split()
+                 if word.upper() not in ['IF', 'NOT', 'EXISTS']]
+        tables = [words[position + 1] for position, word in enumerate(words[:-1])
+                  if word.upper() in TABLE_KEYWORDS and words[position + 1].upper() not in TABLE_KEYWORDS]
+        name = ' '.join(['sql', words[0].upper()] + tables[:1])
+
+        if len(_statement_names) < STATEMENT_CACHE_SIZE:
+            _statement_names[query] = name
+
+    return name
+
+
+class FetchedRows(object):
+    """
+    Stands in for the cursor of a statement that was timed, with its rows already fetched
+    so the timing covers stepping through them
+    """
+
+    def __init__(self, rows, rowcount):
+        self.rows = iter(rows)
+        self.rowcount = rowcount
+
+    def __iter__(self):
+        return self.rows
+
+    def fetchone(self):
+        return next(self.rows, None)
+
+    def fetchmany(self, size=1):
+        return list(itertools.islice(self.rows, size))
+
+    def fetchall(self):
+        return list(self.rows)
+
+
+class Database(object):
+    """
+    Long-lived connection to an inventory database, shared by everything in an application.
+
+    Queries should be parameterized so the connection's prepared statement
+    cache can reuse them. open() switches to another database file and
+    close() must be called on exit.
+    """
+
+    def __init__(self, path=None, pragmas=None):
+        self.pragmas = list(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.path = None
+        self.conn = None
+        self.text_index = False  # True if the database has a full text index this SQLite can use
+
+        if path:
+            self.open(path)
+
+    def open(self, path, migrate=True):
+        """
+        Connects to the database at path, closing the current connection first.
+        An existing inventory database is upgraded to the current schema unless migrate is False.
+        Files holding other tables are left as they are, the pragmas are only set for empty files
+        and inventory databases since some, such as the journal mode, are kept in the file.
+        """
+
+        self.close()
+        self.conn = sqlite3.connect(path, cached_statements=STATEMENT_CACHE_SIZE)
+        self.path = path
+
+        try:
+            tables = [name for (name,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+
+            if not tables or 'assets' in tables:
+                for name, value in self.pragmas:
+                    self.conn.execute('PRAGMA {} = {}'.format(name, value))
+
+            if migrate and 'assets' in tables:
+                self.migrate()
+
+            self.text_index = FTS5 and self.has_table('asset_text')
+        except Exception:
+            # Not left half open
+            self.close()
+            raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+            self.path = None
+            self.text_index = False
+
+    def connection(self):
+        if self.conn is None:
+            raise sqlite3.ProgrammingError('No database is open')
+
+        return self.conn
+
+    def execute(self, query, parameters=()):
+        if not metrics.enabled:
+            return self.connection().execute(query, parameters)
+
+        # The rows are fetched inside the span, SQLite does most of a query's work while stepping through them
+        with metrics.span(statement_name(query)) as span:
+            cursor = self.connection().execute(query, parameters)
+            rows = cursor.fetchall()
+            span.rows = len(rows) if cursor.description is not None else max(cursor.rowcount, 0)
+
+        return FetchedRows(rows, cursor.rowcount)
+
+    def executemany(self, query, parameters):
+        if not metrics.enabled:
+            return self.connection().executemany(query, parameters)
+
+        with metrics.span(statement_name(query)) as span:
+            cursor = self.connection().executemany(query, parameters)
+            span.rows = cursor.rowcount
+
+        return cursor
+
+    def commit(self):
+        self.connection().commit()
+
+    def rollback(self):
+        self.connection().rollback()
+
+    def select_in(self, query, values, parameters=()):
+        """
+        Runs a query whose {} placeholder is filled with an IN list of values, in chunks
+        small enough for SQLite, and yields the rows of every chunk
+        """
+
+        values = list(values)
+
+        name = statement_name(query)
+
+        for start in range(0, len(values), MAX_QUERY_PARAMETERS):
+            chunk = values[start:start + MAX_QUERY_PARAMETERS]
+            chunk_query = query.format(','.join('?' * len(chunk)))
+
+            # Fetched before yielding so the timing does not include the caller's work
+            with metrics.span(name) as span:
+                rows = self.connection().execute(chunk_query, list(parameters) + chunk).fetchall()
+                span.rows = len(rows)
+
+            for row in rows:
+                yield row
+
+    def fetch_pages(self, query, parameters=(), size=1000):
+        """
+        Yields the rows of a query in lists of up to size rows, so a large result
+        never has to be held in memory at once
+        """
+
+        # Not through execute(), which would fetch every row at once while timing
+        name = statement_name(query)
+        with metrics.span(name):
+            cursor = self.connection().execute(query, parameters)
+
+        name += ' fetch'
+
+        while True:
+            with metrics.span(name) as span:
+                rows = cursor.fetchmany(size)
+                span.rows = len(rows)
+
+            if not rows:
+                break
+
+            yield rows
+
+    def has_table(self, name):
+        result = self.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", [name])
+        return result.fetchone() is not None
+
+    def schema_version(self):
+        return self.execute('PRAGMA user_version').fetchone()[0]
+
+    def migrate(self):
+        """
+        Upgrades the database in place to the current schema, returns the version it started at
+        """
+
+        start_version = self.schema_version()
+
+        if start_version > SCHEMA_VERSION:
+            raise sqlite3.DatabaseError('Database schema version {} is newer than this application ({})'.format(
+                                        start_version, SCHEMA_VERSION))
+
+        for version in range(start_version, SCHEMA_VERSION):
+            # Each step commits on its own so an interrupted upgrade resumes where it stopped
+            with self.transaction(immediate=True):
+                if FTS5 or MIGRATIONS[version] is not TEXT_SCHEMA:
+                    for statement in MIGRATIONS[version]:
+                        self.execute(statement)
+
+                self.execute('PRAGMA user_version = {}'.format(version + 1))
+
+        if FTS5 and not self.has_table('asset_text'):
+            # Upgraded by an application whose SQLite had no FTS5
+            with self.transaction(immediate=True):
+                for statement in TEXT_SCHEMA:
+                    self.execute(statement)
+
+        self.text_index = FTS5 and self.has_table('asset_text')
+        return start_version
+
+    def current_version(self):
+        """
+        Returns the version of the latest change to the database, 0 if nothing changed yet
+        """
+
+        return self.execute('SELECT IFNULL(MAX(version), 0) FROM change_log').fetchone()[0]
+
+    def changes_since(self, version):
+        """
+        Returns the current version and the asset numbers changed after the given version
+        """
+
+        result = self.execute('SELECT asset_id, version FROM change_log WHERE version > ?', [version])
+        asset_ids = []
+
+        for asset_id, changed_version in result:
+            asset_ids.append(asset_id)
+            version = max(version, changed_version)
+
+        return version, asset_ids
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """
+        Commits everything executed inside the with block at once, or rolls it all back on error.
+        An immediate transaction takes the write lock up front so nothing read inside it can
+        be changed by another writer before the commit. If another writer holds the lock, it
+        tries again a few times with growing pauses before giving up with the locked error.
+        """
+
+        conn = self.connection()
+
+        if immediate:
+            self._lock(conn)
+
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+    def _lock(self, conn):
+        with metrics.span('write lock'):
+            for attempt in range(LOCK_RETRIES + 1):
+                try:
+                    conn.execute('BEGIN IMMEDIATE')
+                    return
+                except sqlite3.OperationalError as ex:
+                    if not is_locked(ex):
+                        raise
+                    elif attempt == LOCK_RETRIES:
+                        metrics.count('write lock timeouts')
+                        raise
+
+                metrics.count('write lock retries')
+
+                # Random pauses keep writers that collided from colliding again
+                time.sleep(min(MAX_LOCK_BACKOFF, LOCK_BACKOFF * 2 ** attempt) * random.uniform(0.5, 1))
+
+    def create_schema(self):
+        """
+        Creates the tables of an empty inventory database
+        """
+
+        self.migrate()
+
+
+class DatabaseWorker(object):
+    """
+    Runs database jobs on a thread of its own, so a slow disk or a locked database
+    never freezes the window.
+
+    A job is a function taking the worker's Database, which no other thread touches.
+    Jobs run one at a time in the order they were submitted. Their callbacks are not
+    run by the worker, poll() runs them on the thread that calls it, which has to be
+    the Tk thread (see Application.poll_worker).
+    """
+
+    def __init__(self):
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.pending = 0  # jobs submitted whose callbacks have not run yet
+        self.thread = threading.Thread(target=self._run, name='database-worker')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, job, callback=None, errback=None):
+        """
+        Queues job(database), then callback(result) or errback(exception) is run by poll()
+        """
+
+        self.pending += 1
+        self.requests.put((job, callback, errback))
+
+    def open(self, path):
+        self.submit(lambda database: database.open(path, migrate=False))
+
+    def close(self):
+        """
+        Closes the worker's connection once the jobs already queued are done, and waits for it
+        """
+
+        self.submit(lambda database: database.close())
+        self.requests.join()
+
+    def stop(self):
+        """
+        Finishes the queued jobs, closes the connection and ends the thread
+        """
+
+        self.requests.put(None)
+        self.thread.join()
+
+    def poll(self):
+        """
+        Runs the callbacks of the jobs that finished since the last poll
+        """
+
+        while True:
+            try:
+                callback, result, error = self.results.get_nowait()
+            except queue.Empty:
+                return
+
+            self.pending -= 1
+
+            if error is None:
+                if callback is not None:
+                    callback(result)
+            elif callback is not None:
+                callback(error)
+            else:
+                print('ERROR:', str(error))
+
+    def _run(self):
+        database = Database()
+
+        while True:
+            request = self.requests.get()
+
+            if request is None:
+                database.close()
+                self.requests.task_done()
+                return
+
+            job, callback, errback = request
+
+            try:
+                self.results.put((callback, job(database), None))
+            except Exception as ex:
+                self.results.put((errback, None, ex))
+
+            self.requests.task_done()
+
+
+def main(paths):
+    """
+    Upgrades the given database files to the current schema
+    """
+
+    for path in paths:
+        if not os.path.isfile(path):
+            print('{}: file not found, skipped'.format(path))
+            continue
+
+        database = Database()
+        database.open(path, migrate=False)
+
+        try:
+            if not database.has_table('assets'):
+                print('{}: not an inventory database, skipped'.format(path))
+                continue
+
+            version = database.migrate()
+            print('{}: schema version {} -> {}'.format(path, version, SCHEMA_VERSION))
+        finally:
+            database.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python database.py DATABASE_FILE...')
+        sys.exit(1)
+
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sys
+
+if sys.version_info.major == 2:
+    import Tkinter as tk
+    import ttk
+    import tkFileDialog as filedialog
+else:
+    import tkinter as tk
+    import tkinter.ttk as ttk
+    from tkinter import filedialog
+
+from instrumentation import PERCENTILES, SLOW_THRESHOLD, metrics
+
+REFRESH_INTERVAL = 1000  # ms between updates of the table while it is shown
+COLUMNS = ['Operation', 'Count'] + ['p{} ms'.format(point) for point in PERCENTILES] + ['Max ms', 'Rows']
+
+
+class DiagnosticsPanel(tk.LabelFrame):
+    """
+    Settings tab panel that turns the timing of database statements and list refreshes
+    on and off, and shows their rolling percentiles.
+
+    enabled ('1' when on) and slow_log (a file path, '' for none) are the application
+    settings the panel controls, save is called whenever the user changes them.
+    """
+
+    def __init__(self, master, enabled, slow_log, save):
+        tk.LabelFrame.__init__(self, master, text='Diagnostics', labelanchor='n')
+        self.enabled = enabled
+        self.slow_log = slow_log
+        self.save = save
+        self.refresh_job = None
+        self.columnconfigure(1, weight=1)
+        self.rowconfigure(2, weight=1)
+
+        self.enabled_btn = tk.Checkbutton(self, text='Record timings', variable=self.enabled,
+                                          onvalue='1', offvalue='', command=self.changed)
+        self.enabled_btn.grid(row=0, column=0, sticky='w', padx=15, pady=(15, 0))
+        self.refresh_btn = tk.Button(self, text='Refresh', command=self.refresh)
+        self.refresh_btn.grid(row=0, column=1, sticky='e', pady=(15, 0))
+        self.reset_btn = tk.Button(self, text='Reset', command=self.reset)
+        self.reset_btn.grid(row=0, column=2, sticky='e', padx=15, pady=(15, 0))
+
+        self.slow_log_btn = tk.Button(self, text='Slow Log', command=self.choose_slow_log)
+        self.slow_log_btn.grid(row=1, column=0, sticky='w', padx=15, pady=5)
+        self.slow_log_msg = tk.Entry(self, textvariable=self.slow_log, state=tk.DISABLED,
+                                     disabledforeground='black', disabledbackground='white')
+        self.slow_log_msg.grid(row=1, column=1, sticky='ew', pady=5)
+        self.slow_log_lbl = tk.Label(self, text='over {:.0f} ms'.format(SLOW_THRESHOLD * 1000))
+        self.slow_log_lbl.grid(row=1, column=2, sticky='e', padx=15, pady=5)
+
+        self.table = ttk.Treeview(self, columns=COLUMNS, show='headings', height=8)
+        for column in COLUMNS:
+            self.table.heading(column, text=column)
+            self.table.column(column, width=200 if column == 'Operation' else 70,
+                              anchor=tk.W if column == 'Operation' else tk.E)
+        self.table.grid(row=2, column=0, columnspan=3, sticky='nesw', padx=15, pady=(0, 15))
+
+        self.apply()
+
+    def apply(self):
+        """
+        Applies the settings to the shared metrics
+        """
+
+        metrics.configure(self.enabled.get() == '1', self.slow_log.get())
+        self.refresh()
+
+    def changed(self):
+        self.apply()
+        self.save()
+
+    def choose_slow_log(self):
+        path = filedialog.asksaveasfilename(defaultextension='.log',
+                                            filetypes=(('Log File', '*.log'),),
+                                            title='Write slow operations to')
+
+        # Cancelling turns the log off
+        self.slow_log.set(path or '')
+        self.changed()
+
+    def reset(self):
+        metrics.reset()
+        self.refresh()
+
+    def refresh(self):
+        """
+        Shows the latest percentiles, and keeps doing so while recording
+        """
+
+        if self.refresh_job is not None:
+            self.after_cancel(self.refresh_job)
+            self.refresh_job = None
+
+        # Only worth redrawing while the Settings tab is up
+        if self.winfo_ismapped() or not self.table.get_children(''):
+            self.table.delete(*self.table.get_children(''))
+
+            for name, count, percentiles, longest, rows in metrics.summary():
+                values = ([name, count] + ['{:.2f}'.format(seconds * 1000) for seconds in percentiles]
+                          + ['{:.2f}'.format(longest * 1000), '' if rows is None else '{:.0f}'.format(rows)])
+                self.table.insert('', 'end', values=values)
+
+            # Counters of events such as write lock retries, kept even while not recording
+            for name, count in metrics.counts():
+                self.table.insert('', 'end', values=[name, count] + [''] * (len(COLUMNS) - 2))
+
+        if metrics.enabled:
+            self.refresh_job = self.after(REFRESH_INTERVAL, self.refresh)
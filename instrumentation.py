@@ -0,0 +1,164 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import deque
+import datetime
+import io
+import math
+import threading
+from timeit import default_timer
+
+SAMPLE_WINDOW = 1000  # latest timings kept per operation for the percentiles
+SLOW_THRESHOLD = 0.1  # s, operations at least this slow are written to the slow operation log
+PERCENTILES = [50, 90, 99]
+
+
+def percentile(values, point):
+    """
+    Returns the nearest-rank percentile of sorted values
+    """
+
+    rank = int(math.ceil(point / 100 * len(values)))
+    return values[max(0, min(rank, len(values)) - 1)]
+
+
+class _NullSpan(object):
+    """
+    The span handed out while recording is off, it records nothing
+    """
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @property
+    def rows(self):
+        return None
+
+    @rows.setter
+    def rows(self, rows):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span(object):
+    """
+    Times the with block it is used in, set rows inside the block to record a row count
+    """
+
+    __slots__ = ('metrics', 'name', 'rows', 'start')
+
+    def __init__(self, metrics, name, rows=None):
+        self.metrics = metrics
+        self.name = name
+        self.rows = rows
+        self.start = None
+
+    def __enter__(self):
+        self.start = default_timer()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, default_timer() - self.start, self.rows)
+        return False
+
+
+class Metrics(object):
+    """
+    Wall time and row counts of named operations, such as SQL statements and list refreshes.
+
+    Recording is off until enabled, and span() then hands out a shared span
+    that does nothing, so instrumented code only pays for a method call. When
+    on, each operation keeps its latest SAMPLE_WINDOW timings for rolling
+    percentiles, and operations slower than slow_threshold are appended to
+    the slow operation log if one is set. Counters of events such as lock
+    retries are always kept. Any thread may record.
+    """
+
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.window = window
+        self.enabled = False
+        self.slow_log = None  # path of the slow operation log, None for no log
+        self.slow_threshold = SLOW_THRESHOLD
+        self.lock = threading.Lock()
+        self.log_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}  # name -> deque of the latest (seconds, rows)
+            self.totals = {}  # name -> operations recorded since the reset
+            self.counters = {}  # name -> count
+
+    def configure(self, enabled, slow_log=None):
+        self.enabled = enabled
+        self.slow_log = slow_log or None
+
+    def span(self, name, rows=None):
+        if not self.enabled:
+            return NULL_SPAN
+
+        return Span(self, name, rows)
+
+    def record(self, name, seconds, rows=None):
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.window)
+
+            samples.append((seconds, rows))
+            self.totals[name] = self.totals.get(name, 0) + 1
+
+        if self.slow_log is not None and seconds >= self.slow_threshold:
+            self._log_slow(name, seconds, rows)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def summary(self):
+        """
+        Returns (name, count, percentiles in s, max in s, mean rows or None) for each operation, by name
+        """
+
+        with self.lock:
+            snapshot = [(name, self.totals[name], list(samples)) for name, samples in self.samples.items()]
+
+        result = []
+
+        for name, total, samples in sorted(snapshot):
+            times = sorted(seconds for seconds, rows in samples)
+            rows = [rows for seconds, rows in samples if rows is not None]
+
+            result.append((name, total, [percentile(times, point) for point in PERCENTILES], times[-1],
+                           sum(rows) / len(rows) if rows else None))
+
+        return result
+
+    def counts(self):
+        """
+        Returns (name, count) for each counter, by name
+        """
+
+        with self.lock:
+            return sorted(self.counters.items())
+
+    def _log_slow(self, name, seconds, rows):
+        line = '{} {} {:.1f} ms{}\n'.format(datetime.datetime.now().isoformat(), name, seconds * 1000,
+                                            '' if rows is None else ' {} rows'.format(rows))
+
+        try:
+            with self.log_lock:
+                with io.open(self.slow_log, 'a', encoding='utf-8') as log:
+                    log.write(line)
+        except (IOError, OSError) as ex:
+            print('ERROR:', str(ex))
+            self.slow_log = None
+
+
+metrics = Metrics()  # shared by everything in an application
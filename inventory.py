@@ -1,14 +1,10 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import datetime
 import json
 from operator import itemgetter
 import os
-import random
-import re
 import sqlite3
 import sys
-import time
 
 if sys.version_info.major == 2:
     import Tkinter as tk
@@ -22,97 +18,43 @@ else:
     import tkinter.ttk as ttk
     from tkinter import messagebox, filedialog
 
+from columnar import ColumnStore, split_fields
+from database import Database
+from diagnostics import DiagnosticsPanel
+from instrumentation import metrics
+from listbox import ListView, MultiColumnListbox, PagedView
+from records import record_type
+from search_index import IncrementalSearch, SearchIndex
+from store import AssetSearch, InventoryStore, asset_query
+
 COLUMN_INDEX = {'Asset Number': 0, 'Item': 1, 'State': 2, 'Loaned To': 3, 
                 'Email': 4, 'Due Date': 5, 'Storage Location': 6, 
                 'Description': 7, 'Comments': 8}
+LIST_COLUMNS = ['asset_id', 'name', 'state', 'borrower_name', 'borrower_email', 
+                'return_date', 'storage_location', 'description', 'comments']
+# Every asset with its borrower, in list column order
+ASSET_QUERY = asset_query(LIST_COLUMNS)
+AssetRecord = record_type('AssetRecord', sorted(COLUMN_INDEX, key=COLUMN_INDEX.get),
+                          interned=['Item', 'State', 'Storage Location'])
 NOTEBOOK_INDEX = {'Asset List': 0, 'Shopping Cart': 1, 'Settings': 2}
-SEARCHABLE = ['Asset Number', 'Item', 'Loaned To', 'Email', 'Due Date', 'Description']
+# Searched in memory by substring, the name, description and comments are also searched
+# word by word in the database's full text index (see Application.search_text)
+SEARCHABLE = ['Asset Number', 'Item', 'Loaned To', 'Email', 'Due Date']
+FILTER_FIELDS = {'state': COLUMN_INDEX['State'], 
+                 'location': COLUMN_INDEX['Storage Location'],
+                 'due': COLUMN_INDEX['Due Date']}  # search terms such as state:available
 SEARCH_HINT = 'Search...'
-SETTINGS = ['first_name', 'last_name', 'email', 'database_path']
+SEARCH_DELAY = 150  # ms to wait for more keystrokes before filtering
+MIN_RANKED_SEARCH = 3  # characters a search needs before the full text index ranks its matches
+RANKED_MATCHES = 200  # best full text matches listed first, the rest follow in list order
+SYNC_INTERVAL = 5000  # ms between checks for changes made by other applications
+LOAD_PAGE_SIZE = 2000  # assets added to the list per event loop pass while loading
+LOAD_DELAY = 1  # ms between pages, lets pending events run
+REMOTE_ASSETS = 500000  # more assets than this are browsed a page at a time rather than loaded
+SETTINGS = ['first_name', 'last_name', 'email', 'database_path', 'record_timings', 'slow_log',
+            'remote_mode']
 SETTINGS_PATH = os.path.join('settings', 'asset_settings.json')
 
-# TEMPORARY DUMMY DATA
-items = ['Laptop', 'Microphone', 'Pen', 'Monitor', 'Keyboard', 'Strapped Bag',
-            'Mouse', 'Notebook', 'CD', 'USB Stick', 'Desk', 'Key']
-states = ['Available', 'Borrowed', 'Shopping Cart']
-
-class MultiColumnListbox(tk.Frame):
-    def __init__(self, master, header, items):
-        tk.Frame.__init__(self, master)
-       
-        self.header = header
-        self.items = items
-        self.filtered_items_ix = list(range(len(items)))  # indexes of filtered items
-
-        self.tree = ttk.Treeview(self, columns=self.header, show='headings')
-        v_scroll = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.tree.yview)
-        h_scroll = ttk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.tree.xview)
-        self.tree.configure(yscrollcommand=v_scroll.set, xscrollcommand=h_scroll.set)
-        self.tree.grid(row=0, column=0, sticky='nesw')
-        v_scroll.grid(row=0, column=1, sticky='ns')
-        h_scroll.grid(row=1, column=0, sticky='ew')
-
-        self._build_tree()
-
-    def _build_tree(self):
-        """
-        Initializes the items in the tree to be displayed on the gui
-        """
-
-        for col in self.header:
-            self.tree.heading(col, text=col.title(),
-                                command=lambda c=col: self.sortby(c, False))
-            self.tree.column(col, width=tkFont.Font().measure(col.title())+20)  # +20 for extra padding
-
-        for ix in self.filtered_items_ix:
-            self.tree.insert('', index='end', values=self.items[ix])
-
-            # Ensure column width fits values
-            for i in range(len(self.header)):
-                col_width = tkFont.Font().measure(self.items[ix][i]) + 20
-                if self.tree.column(self.header[i], width=None) < col_width:
-                    self.tree.column(self.header[i], width=col_width)
-
-    def fit_columns(self):
-        """
-        Resizes each column to fit the longest text
-        """
-
-        column_count = len(self.header)
-        widths = [self.tree.column(col)['width'] for col in self.header]
-
-        for ix in self.filtered_items_ix:
-            for i in range(column_count):
-                item_width = tkFont.Font().measure(self.items[ix][i]) + 20
-                widths[i] = max(item_width, widths[i])
-
-        for i in range(len(self.header)):
-            self.tree.column(self.header[i], width=widths[i])
-
-    def sortby(self, col, descending):
-        """
-        Sorts the data in a list column
-        """
-
-        data = [(self.tree.set(child, col), child) for child in self.tree.get_children('')]
-        data.sort(reverse=descending)
-
-        for i, item in enumerate(data):
-            self.tree.move(item[1], '', i)
-
-        self.tree.heading(col, command=lambda c=col: self.sortby(c, not descending))
-
-    def repopulate_list(self):
-        """
-        Refreshes the view of the list
-        """
-
-        for row in self.tree.get_children():
-                self.tree.delete(row)
-        for ix in self.filtered_items_ix:
-            self.tree.insert('', index='end', values=self.items[ix])
-
-        self.fit_columns()
 
 class AssetList(MultiColumnListbox):
     def __init__(self, master, app_toplevel, header, items):
@@ -135,107 +77,74 @@ class AssetList(MultiColumnListbox):
         self.items.sort(key=itemgetter(COLUMN_INDEX['Asset Number']))
         self.repopulate_list()
 
-    def repopulate_list(self):
+    def row_tags(self, values):
         """
-        Refreshes the view of the list
+        Colours the row by the state of the item
         """
 
-        for row in self.tree.get_children():
-                self.tree.delete(row)
-        for ix in self.filtered_items_ix:
-            item = self.items[ix]
-            self.tree.insert('', index='end', values=item, 
-                                tags=[item[COLUMN_INDEX['State']]])
-        self.fit_columns()
+        return [values[COLUMN_INDEX['State']]]
 
     def select_item(self, *args):
         item = self.tree.item(self.tree.focus())
-        item_index = self.tree.index(self.tree.focus())
-        full_list_index = self.filtered_items_ix[item_index]
 
         if item['values'] != '':
-            asset_number = item['values'][COLUMN_INDEX['Asset Number']]
-            item_name = item['values'][COLUMN_INDEX['Item']]
-            item_state = item['values'][COLUMN_INDEX['State']]
-            new_values = item['values']
+            full_list_index = self.index_of(self.tree.focus())
+            old_values = self.items[full_list_index]
+            item_name = old_values.item
+            item_state = old_values.state
+            new_values = old_values
             
             if item_state == 'Available':
                 self.app_toplevel.history_msg.set('{} was put into shopping cart'.format(item_name))
-                new_values[COLUMN_INDEX['State']] = 'Shopping Cart'
-
-                # Edit the item in the initial non-filtered list
-                self.app_toplevel.shopping_cart.filtered_items_ix.append(full_list_index)
-                self.app_toplevel.update_cart_count()
-                self.app_toplevel.shopping_cart.tree.insert('', 'end', values=new_values)
-
+                new_values = old_values.replace(state='Shopping Cart')
             elif item_state == 'Shopping Cart':
-                # Remove item from shopping cart
                 self.app_toplevel.history_msg.set('{} was removed from shopping cart'.format(item_name))
-                new_values[COLUMN_INDEX['State']] = 'Available'
-
-                for filter_index, ix in enumerate(self.app_toplevel.shopping_cart.filtered_items_ix):
-                    current = self.app_toplevel.shopping_cart.items[ix]
-                    if current[COLUMN_INDEX['Asset Number']] == asset_number:
-                        del self.app_toplevel.shopping_cart.filtered_items_ix[filter_index]
-                        self.app_toplevel.update_cart_count()
-                        break
+                new_values = old_values.replace(state='Available')
 
-                # Remove listing in shopping cart gui
-                for leaf_id in self.app_toplevel.shopping_cart.tree.get_children(''):
-                    current = self.app_toplevel.shopping_cart.tree.item(leaf_id)
+            self.items[full_list_index] = new_values
+            self.app_toplevel.index_item(full_list_index)
+            self.refresh_item(full_list_index, old_values)
 
-                    if asset_number == current['values'][COLUMN_INDEX['Asset Number']]:
-                        self.app_toplevel.shopping_cart.tree.delete(leaf_id)
-                        break
+            if item_state == 'Available':
+                # Add item to shopping cart
+                self.app_toplevel.shopping_cart.add_item(full_list_index)
+                self.app_toplevel.update_cart_count()
 
-            self.items[full_list_index] = new_values
-            self.tree.item(self.tree.focus(), values=new_values, tags=[new_values[COLUMN_INDEX['State']]])
+            elif item_state == 'Shopping Cart':
+                # Remove item from shopping cart
+                self.app_toplevel.shopping_cart.remove_item(full_list_index)
+                self.app_toplevel.update_cart_count()
 
 class ShoppingCart(MultiColumnListbox):
     def __init__(self, master, app_toplevel, header, items):
-        MultiColumnListbox.__init__(self, master, header, items)
+        # A cart is short, every row is a tree item and refreshes are diffed against them
+        MultiColumnListbox.__init__(self, master, header, items, virtual=False)
         self.master = master
         self.app_toplevel = app_toplevel
         for binding in ['<ButtonRelease-1>', '<KeyRelease-Up>', '<KeyRelease-Down>']:
             self.tree.bind(binding, 
                         lambda event, tree=self.tree: self.app_toplevel.update_description(tree))
         self.tree.bind('<Double-Button-1>', self.select_item)
-        self.filtered_items_ix = []
-        self.repopulate_list()
+        self.clear()
 
     def select_item(self, *args):
         item = self.tree.item(self.tree.focus())
 
         if item['values'] != '':
-            item_index = self.tree.index(self.tree.focus())
-            full_list_index = self.filtered_items_ix[item_index]
-            asset_number = item['values'][COLUMN_INDEX['Asset Number']]
-            item_name = item['values'][COLUMN_INDEX['Item']]
-            item_state = item['values'][COLUMN_INDEX['State']]
-            new_values = item['values']
+            full_list_index = self.index_of(self.tree.focus())
+            new_values = self.items[full_list_index].replace(state='Available')
 
-            self.app_toplevel.history_msg.set('{} was removed from shopping cart'.format(item_name))
-            new_values[COLUMN_INDEX['State']] = 'Available'
-
-            # Remove from shopping cart
-            for filter_index, ix in enumerate(self.app_toplevel.shopping_cart.filtered_items_ix):
-                current = self.app_toplevel.shopping_cart.items[ix]
-                if current[COLUMN_INDEX['Asset Number']] == asset_number:
-                    del self.filtered_items_ix[filter_index]
-                    self.app_toplevel.update_cart_count()
-                    break
+            self.app_toplevel.history_msg.set('{} was removed from shopping cart'.format(new_values.item))
 
             self.items[full_list_index] = new_values
-            self.tree.delete(self.tree.focus())
+            self.app_toplevel.index_item(full_list_index)
 
-            # Update item listing in asset list
-            for leaf_id in self.app_toplevel.asset_list.tree.get_children(''):
-                current = self.app_toplevel.asset_list.tree.item(leaf_id)
+            # Remove from shopping cart
+            self.remove_item(full_list_index)
+            self.app_toplevel.update_cart_count()
 
-                if asset_number == current['values'][COLUMN_INDEX['Asset Number']]:
-                    self.app_toplevel.asset_list.tree.item(leaf_id, 
-                        values=new_values, tags=[new_values[COLUMN_INDEX['State']]])
-                    break
+            # Update item listing in asset list
+            self.app_toplevel.asset_list.refresh_item(full_list_index)
         
 class Application(object):
     def __init__(self, master):
@@ -245,6 +154,9 @@ class Application(object):
         self.master.columnconfigure(0, weight=1)
 
         self.settings = {setting: tk.StringVar() for setting in SETTINGS}
+        self.db = Database()
+        self.store = InventoryStore(self.db)
+        self.master.protocol('WM_DELETE_WINDOW', self.close)
 
         # Items
         self.asset_list_header = [header[0] for header in 
@@ -252,6 +164,22 @@ class Application(object):
                                                 for column in COLUMN_INDEX], key=itemgetter(1))
                                     if header[0] not in ['Description', 'Comments']]
         self.asset_list_items = []
+        self.asset_index = {}  # asset number -> index in asset_list_items
+        self.free_ixs = []  # indexes in asset_list_items the paged list let go of, reused first
+        self.kept_ixs = set()  # indexes the paged list let go of while in the cart or on screen
+        self.search_index = SearchIndex([COLUMN_INDEX[column] for column in SEARCHABLE])
+        self.incremental_search = IncrementalSearch(self.search_index)
+        self.columns = ColumnStore(range(len(self.asset_list_header)),
+                                   categorical=[COLUMN_INDEX['State'], COLUMN_INDEX['Storage Location']])
+        self.search_job = None
+        self.db_version = 0  # latest database change reflected in the list
+        self.sync_job = self.master.after(SYNC_INTERVAL, self.poll_changes)
+        self.load_job = None
+        self.load_pages = None  # pages of assets still to be added to the list
+        self.load_after = None  # asset number of the last asset loaded
+        self.load_total = 0
+        self.remote = False  # True while the list pages through the database instead of holding every asset
+        self.asset_search = AssetSearch(LIST_COLUMNS)  # the search the database runs for the paged list
 
         # Tabs for asset list / shopping cart
         self.notebook = ttk.Notebook(self.master)
@@ -389,6 +317,14 @@ class Application(object):
                                         text='WARNING: all unsaved changes will be lost',
                                         font=self.label_font)
         self.db_warning_lbl.grid(row=1, column=0, columnspan=2, padx=15, pady=5)
+        self.remote_btn = tk.Checkbutton(self.db_path_frame, text='Browse the database page by page',
+                                         variable=self.settings['remote_mode'], onvalue='1', offvalue='',
+                                         command=self.change_mode)
+        self.remote_btn.grid(row=2, column=0, columnspan=2, padx=15, pady=(0, 5))
+
+        self.diagnostics = DiagnosticsPanel(self.about_frame, self.settings['record_timings'],
+                                            self.settings['slow_log'], self.save_settings)
+        self.diagnostics.grid(row=1, column=0, sticky='new', padx=15, pady=(15, 0))
 
         if os.path.exists(SETTINGS_PATH):
             with open(SETTINGS_PATH, 'r') as config_file:
@@ -396,12 +332,11 @@ class Application(object):
                 for setting in in_settings:
                     self.settings[setting].set(in_settings[setting])
 
-                self.update_asset_items(self.retrieve_assets(self.settings['database_path'].get()))
-                self.asset_list.filtered_items_ix = list(range(len(self.asset_list_items)))
-                self.shopping_cart.filtered_items_ix = list(range(0))
-  
-                self.asset_list.repopulate_list()
-                self.shopping_cart.repopulate_list()
+                self.diagnostics.apply()
+
+                if self.open_database(self.settings['database_path'].get()):
+                    self.load_assets()
+                self.shopping_cart.clear()
         else:
             self.notebook.select(self.notebook.tabs()[NOTEBOOK_INDEX['Settings']])
             messagebox.showwarning(title='Missing database path', 
@@ -412,122 +347,379 @@ class Application(object):
         Updates the database to indicate the items in the shopping cart have been requested
         """
 
-        db_path = self.settings['database_path'].get()
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        SELECT_QUERY = ('SELECT borrow_list.asset_id, name FROM borrow_list '
-                        'LEFT JOIN assets '
-                        'WHERE borrow_list.asset_id={}')
+        first_name = self.settings['first_name'].get()
+        last_name = self.settings['last_name'].get()
+        full_name = '{} {}'.format(first_name, last_name)
+        email = self.settings['email'].get()
+        reason = self.checkout_reason.get('1.0', tk.END)
 
-        CHECKOUT_QUERY = ('INSERT INTO borrow_list '
-                          'VALUES (?,?,?,?,?,?,?)')
+        cart = {self.asset_list_items[ix].asset_number: ix 
+                for ix in self.shopping_cart.filtered_items_ix}
+        asset_nums = list(cart)
 
-        today = datetime.date.today()
-        today_formatted = '{}-{:02}-{:02}'.format(
-                            today.year, today.month, today.day)
-        borrow_time = datetime.timedelta(days=30)
-        due_date = today + borrow_time
-        due_formatted = '{}-{:02}-{:02}'.format(
-                            due_date.year, due_date.month, due_date.day)
-
-        checked_out = []  # Keep track of items that may be requested already
+        # borrowed maps the items someone else requested first to their borrow_list row
+        try:
+            due_formatted, borrowed = self.store.checkout(asset_nums, full_name, email, reason)
+        except sqlite3.Error as ex:
+            # Nothing was requested, the cart is left as it is to try again
+            messagebox.showerror('Checkout Error', 'Could not check out, please try again: {}'.format(ex))
+            return
+
+        # Update only the rows in the cart instead of reloading every asset
+        for asset_num, ix in cart.items():
+            old_values = self.asset_list_items[ix]
+
+            if asset_num in borrowed:
+                name, state, borrower_name, borrower_email, return_date, comments = borrowed[asset_num]
+            else:
+                state, borrower_name, borrower_email, return_date, comments = ('Requested', full_name, 
+                                                                               email, due_formatted, 
+                                                                               reason)
 
-        for ix in self.shopping_cart.filtered_items_ix:
-            values = self.shopping_cart.items[ix]
+            new_values = old_values.replace(state=state, loaned_to=borrower_name, 
+                                            email=borrower_email, due_date=return_date, 
+                                            comments=comments)
 
-            result = cursor.execute(SELECT_QUERY.format(
-                        values[COLUMN_INDEX['Asset Number']]))
+            self.asset_list_items[ix] = new_values
+            self.index_item(ix)
+            self.asset_list.refresh_item(ix, old_values)
 
-            if list(result):
-                checked_out.append((values[COLUMN_INDEX['Asset Number']], 
-                                    values[COLUMN_INDEX['Item']]))
-            else:
-                first_name = self.settings['first_name'].get()
-                last_name = self.settings['last_name'].get()
-                full_name = '{} {}'.format(first_name, last_name)
-
-                cursor.execute(CHECKOUT_QUERY,
-                    [values[COLUMN_INDEX['Asset Number']], 
-                    full_name,
-                    self.settings['email'].get(), 'Requested',
-                    today_formatted, due_formatted,
-                    self.checkout_reason.get('1.0', tk.END)])
-                conn.commit()
-
-        if checked_out:
-            checked = ', '.join(['{} ({})'.format(name, asset_num) 
-                                 for asset_num, name in checked_out])
+        if borrowed:
+            checked = ', '.join(['{} ({})'.format(borrowed[asset_num][0], asset_num) 
+                                 for asset_num in sorted(borrowed)])
             messagebox.showwarning('Checkout Error',
                                    ('The following items have already ' 
                                     'been checked out by someone else: {}').format(checked))
 
         self.history_msg.set('{} items were checked out'.format(
-            len(self.shopping_cart.filtered_items_ix) - len(checked_out)))
+            len(asset_nums) - len(borrowed)))
 
-        self.shopping_cart.filtered_items_ix = list(range(0))
-        self.shopping_cart.repopulate_list()
+        self.shopping_cart.clear()
         self.update_cart_count()
 
-        items = self.retrieve_assets(self.settings['database_path'].get())
-        self.update_asset_items(items)
-        self.asset_list.repopulate_list()
-
     def choose_db_file(self, *args):
         db_path = filedialog.askopenfilename(filetypes=(('Database Files', '*.db'),)) 
-        items = self.retrieve_assets(db_path)
-
-        if items is not None:
-            self.asset_list.tree.delete(*self.asset_list.tree.get_children())
-            self.update_asset_items(items)
-            self.asset_list.filtered_items_ix = list(range(len(self.asset_list.items)))
-            self.settings['database_path'].set(db_path)
-            self.save_settings()
-            self.shopping_cart.filtered_items_ix = []
-            self.shopping_cart.repopulate_list()
-            self.update_cart_count()
-            self.history_msg.set('Changed database ({})'.format(db_path))
-            
-        self.asset_list.repopulate_list()    
 
-    def _match_searchables(self, query, columns):
+        # Exit if user cancels
+        if not db_path:
+            return
+
+        if not self.open_database(db_path):
+            return
+
+        self.shopping_cart.clear()
+        self.update_cart_count()
+        self.load_assets()
+        self.settings['database_path'].set(db_path)
+        self.save_settings()
+
+    def open_database(self, path):
         """
-        Goes through all searchable columns and returns True if query matches at least one, else False
+        Connects to the database at path. Returns False, with the lists emptied and the
+        Settings tab shown, if there is no inventory database there.
         """
 
-        for column in SEARCHABLE:
-            if str(columns[COLUMN_INDEX[column]]).lower().find(query.lower()) != -1:
-                return True 
+        # Connecting to a missing file would create an empty one
+        if not os.path.isfile(path):
+            error = 'Database file not found: {}'.format(path)
+        else:
+            try:
+                self.db.open(path)
+                error = None if self.db.has_table('assets') else 'Not an inventory database: {}'.format(path)
+            except sqlite3.Error as ex:
+                error = 'Could not open {}: {}'.format(path, ex)
+
+        if error is None:
+            return True
+
+        self.db.close()
+        self.cancel_load()
+        self.update_asset_items([])
+        self.remote = False
+
+        if isinstance(self.asset_list.view, PagedView):
+            self.asset_list.set_view(ListView(self.asset_list.sorter))
+            self.run_search()
+        else:
+            self.asset_list.clear()
+
+        self.shopping_cart.clear()
+        self.update_cart_count()
+        self.notebook.select(self.notebook.tabs()[NOTEBOOK_INDEX['Settings']])
+        messagebox.showerror('Database Error', error)
         return False
 
-    def retrieve_assets(self, db_path):
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        SELECT_QUERY = ('SELECT assets.asset_id, name, state, borrower_name, ' 
-                        'borrower_email, return_date, storage_location, '
-                        'description, comments ' 
-                        'from assets LEFT JOIN borrow_list '
-                        'ON assets.asset_id=borrow_list.asset_id')
-        items = []
-        today = datetime.date.today()
+    def change_mode(self):
+        self.save_settings()
+
+        if self.db.conn is not None:
+            self.load_assets()
+            self.shopping_cart.clear()
+            self.update_cart_count()
+
+    def load_assets(self):
+        """
+        Starts reading every asset from the open database. The list is filled a page at a
+        time between events, so the first rows show right away and the window stays responsive.
+        Large databases, or any with the remote mode setting on, are browsed instead: only the
+        rows scrolled to are read, and the database runs the searches and sorts.
+        """
+
+        self.cancel_load()
+        self.update_asset_items([])
 
         try:
-            for item in list(cursor.execute(SELECT_QUERY)):
-                item = [value if value is not None else '---' for value in item]
-                if item[COLUMN_INDEX['State']] == '---':
-                    item[COLUMN_INDEX['State']] = 'Available'
-                elif item[COLUMN_INDEX['State']] == 'Borrowed':
-                    year, month, day = [int(d) for d in item[COLUMN_INDEX['Due Date']].split('-')]
-                    due_date = datetime.date(year=year, month=month, day=day)
-
-                    if today > due_date:
-                        item[COLUMN_INDEX['State']] = 'Overdue'
-    
-                items.append(item)
+            self.db_version = self.db.current_version()
+            self.load_total = self.db.execute('SELECT COUNT(*) FROM assets').fetchone()[0]
+            error = None
+        except sqlite3.Error as ex:
+            error = ex
+            self.load_total = 0
+
+        self.remote = error is None and (self.settings['remote_mode'].get() == '1'
+                                         or self.load_total > REMOTE_ASSETS)
+
+        if self.remote:
+            self.asset_list.set_view(PagedView(self.fetch_assets, self.count_assets,
+                                               evict=self.release_assets))
+            # The search bar may hold a query from before, the database runs it from now on
+            self.run_search()
+            self.history_msg.set('Browsing {} assets'.format(self.load_total))
+            return
+
+        if isinstance(self.asset_list.view, PagedView):
+            self.asset_list.set_view(ListView(self.asset_list.sorter))
+            self.run_search()
+        else:
+            self.asset_list.clear()
+
+        if error is not None:
+            # Busy or locked, try again shortly
+            print('ERROR:', str(error))
+            self.history_msg.set('Could not load assets, retrying: {}'.format(error))
+            self.load_job = self.master.after(SYNC_INTERVAL, self.load_assets)
+            return
+
+        self.load_after = None
+        self.load_pages = self.retrieve_assets()
+        self.load_job = self.master.after_idle(self._load_next_page)
+
+    def cancel_load(self):
+        if self.load_job is not None:
+            self.master.after_cancel(self.load_job)
+            self.load_job = None
+            self.load_pages = None
+
+    def _load_next_page(self):
+        try:
+            page = next(self.load_pages, None)
         except Exception as ex:
+            # Busy or locked, carry on from the last asset loaded in a while
             print('ERROR:', str(ex))
+            self.load_pages = self.retrieve_assets(self.load_after)
+            self.history_msg.set('Could not load every asset, retrying: {} of {} loaded ({})'.format(
+                len(self.asset_list_items), self.load_total, ex))
+            self.load_job = self.master.after(SYNC_INTERVAL, self._load_next_page)
+            return
+
+        if page is None:
+            self.load_job = None
+            self.load_pages = None
+            self.history_msg.set('Loaded {} assets'.format(len(self.asset_list_items)))
+            return
+
+        first_ix = len(self.asset_list_items)
+
+        with metrics.span('load index page', len(page)):
+            for item in page:
+                ix = len(self.asset_list_items)
+                item = AssetRecord.from_row(item)
+                self.asset_list_items.append(item)
+                self.asset_index[item.asset_number] = ix
+                self.index_item(ix)
+
+        self.load_after = item.asset_number
+
+        # The list only shows the new rows matching the current search
+        self.asset_list.add_items(range(first_ix, len(self.asset_list_items)))
+        self.history_msg.set('Loading assets... {} of {}'.format(len(self.asset_list_items), 
+                                                                 self.load_total))
+        self.load_job = self.master.after(LOAD_DELAY, self._load_next_page)
+
+    def retrieve_assets(self, after=None):
+        """
+        Yields every asset in the database a page at a time, or those numbered above after
+        """
+
+        return self.store.asset_pages(ASSET_QUERY, size=LOAD_PAGE_SIZE, after=after)
+
+    def fetch_assets(self, offset, size, sort_columns, after=None):
+        """
+        Reads a page of the assets matching the search for the paged list (see PagedView),
+        returns their indexes in asset_list_items and the key of the last one
+        """
+
+        try:
+            rows, key = self.asset_search.page(self.db, offset, size, sort_columns, after)
+        except sqlite3.Error as ex:
+            print('ERROR:', str(ex))
+            return [], None
+
+        return [self.hold_asset(AssetRecord.from_row(row)) for row in rows], key
+
+    def count_assets(self):
+        """
+        Counts the assets matching the search for the paged list, None if the database could not be read
+        """
+
+        try:
+            return self.asset_search.count(self.db)
+        except sqlite3.Error as ex:
+            print('ERROR:', str(ex))
+            return None
+
+    def hold_asset(self, item):
+        """
+        Keeps an asset read for the paged list in asset_list_items, returns its index.
+        Only the assets of the pages the list keeps are held (see release_assets),
+        an asset read again replaces its old values.
+        """
+
+        ix = self.asset_index.get(item.asset_number)
+
+        if ix is None:
+            if self.free_ixs:
+                ix = self.free_ixs.pop()
+                self.asset_list_items[ix] = item
+            else:
+                ix = len(self.asset_list_items)
+                self.asset_list_items.append(item)
+
+            self.asset_index[item.asset_number] = ix
+            self.asset_list.column_widths.add(item)
+            return ix
+
+        old_values = self.asset_list_items[ix]
+        if old_values.state == 'Shopping Cart' and item.state == 'Available':
+            item = item.replace(state='Shopping Cart')
+
+        if item != old_values:
+            self.asset_list_items[ix] = item
+            self.asset_list.column_widths.replace(old_values, item)
+
+        return ix
+
+    def release_assets(self, ixs):
+        """
+        Lets go of the assets of the pages the paged list dropped, their indexes are reused for
+        the assets read next. Those in the cart, selected or on screen are kept until they are
+        off every page and out of the cart.
+        """
+
+        ixs = set(ixs)
+        if self.kept_ixs:
+            ixs.update(self.kept_ixs.difference(self.asset_list.view.rows))
+
+        keep = set(self.shopping_cart.filtered_items_ix)
+        keep.update(self.asset_list.selected_ix)
+        keep.update(self.asset_list.row_ix)
+        keep.add(self.asset_list.focus_ix)
+        self.kept_ixs = ixs & keep
+
+        for ix in ixs - keep:
+            item = self.asset_list_items[ix]
+            del self.asset_index[item.asset_number]
+            self.unindex_item(ix)
+            self.asset_list.column_widths.remove(item)
+            self.free_ixs.append(ix)
+
+    def _read_assets(self, asset_ids):
+        """
+        Reads the assets with the given asset numbers
+        """
+
+        return [AssetRecord.from_row(item) for item in self.store.read_assets(asset_ids, ASSET_QUERY)]
+
+    def poll_changes(self):
+        """
+        Periodically picks up the changes other applications made to the database
+        """
+
+        # Changes made during a load are picked up once it finishes
+        if self.db.conn is not None and self.load_job is None:
+            try:
+                with metrics.span('sync changes'):
+                    self.sync_changes()
+            except sqlite3.Error as ex:
+                # Busy or locked, try again next time
+                print('ERROR:', str(ex))
+
+        self.sync_job = self.master.after(SYNC_INTERVAL, self.poll_changes)
+
+    def sync_changes(self):
+        """
+        Patches the list with only the assets changed since the last version seen, instead of reloading every asset
+        """
+
+        version, asset_ids = self.db.changes_since(self.db_version)
+
+        if not asset_ids:
+            return
+
+        changed = dict((item.asset_number, item) 
+                       for item in self._read_assets(asset_ids))
+        new_ixs = []
+        cart_changed = False
+
+        for asset_id in asset_ids:
+            ix = self.asset_index.get(asset_id)
+            item = changed.get(asset_id)
+            in_cart = ix is not None and self.asset_list_items[ix].state == 'Shopping Cart'
+
+            if in_cart and (item is None or item.state != 'Available'):
+                # Someone else got to it first
+                self.shopping_cart.remove_item(ix)
+                cart_changed = True
+            elif in_cart:
+                item = item.replace(state='Shopping Cart')
+
+            if item is None and self.remote:
+                # Let go of when the pages are dropped below
+                continue
+            elif item is None:
+                # Deleted
+                if ix is not None:
+                    del self.asset_index[asset_id]
+                    self.unindex_item(ix)
+                    self.asset_list.remove_item(ix)
+            elif ix is None and self.remote:
+                # Listed when its page is read again
+                continue
+            elif ix is None:
+                ix = len(self.asset_list_items)
+                self.asset_list_items.append(item)
+                self.asset_index[asset_id] = ix
+                self.index_item(ix)
+                new_ixs.append(ix)
+            elif item != self.asset_list_items[ix]:
+                old_values = self.asset_list_items[ix]
+                self.asset_list_items[ix] = item
+                self.index_item(ix)
+                self.asset_list.refresh_item(ix, old_values)
+
+        if self.remote:
+            # Changes may move rows in or out of the search or to another page
+            self.asset_list.view.invalidate()
+            self.asset_list.repopulate_list()
+        elif new_ixs:
+            # Only the new rows matching the current search are shown
+            self.asset_list.add_items(new_ixs)
+
+        if cart_changed:
+            self.update_cart_count()
+
+        self.db_version = version
 
-        return items
-        
     def search_clear(self, *args):
         """
         Clears the search bar if the search hint is present
@@ -537,24 +729,114 @@ class Application(object):
             self.search_query.set('')
  
     def search(self, *args):
+        """
+        Schedules a search so that a burst of keystrokes only filters the list once
+        """
+
+        if self.search_job is not None:
+            self.master.after_cancel(self.search_job)
+
+        self.search_job = self.master.after(SEARCH_DELAY, self.run_search)
+
+    def run_search(self):
         """
         Filters the indexes of the asset list that matches the search query, then refreshes the list view
         """
 
+        self.search_job = None
         query = self.search_bar.get() 
-        if len(query) > 0 and query != SEARCH_HINT:
-            self.asset_list.filtered_items_ix = [index for index in range(len(self.asset_list.items))
-                                                    if self._match_searchables(query, self.asset_list.items[index])]
+        if query == SEARCH_HINT:
+            query = ''
+
+        if self.remote:
+            # The database filters the pages as they are read, matching what the in-memory search would
+            with metrics.span('search'):
+                text, terms = split_fields(query, FILTER_FIELDS)
+                self.asset_search = AssetSearch(LIST_COLUMNS, text, terms,
+                                                [COLUMN_INDEX[column] for column in SEARCHABLE],
+                                                self.db.text_index)
+                self.asset_list.set_filter(None)
+            return
+
+        # Rows added later are filtered by the same query, the current sort is kept
+        with metrics.span('search') as span:
+            self.asset_list.set_filter(lambda ixs: self.filter_assets(query, ixs), self.filter_assets(query),
+                                       ranked=True)
+            span.rows = len(self.asset_list.filtered_items_ix)
+
+    def filter_assets(self, query, ixs=None):
+        """
+        Returns the indexes of the assets matching a search query, field:value terms filter a single column.
+        Full text matches come first, best first (see search_text), then the other matches in list order.
+        Only the indexes in ixs are checked when given, otherwise every asset.
+        """
+
+        text, terms = split_fields(query, FILTER_FIELDS)
+
+        if ixs is None:
+            ranked = self.search_text(text)
+            ixs = self.incremental_search.search(text)
         else:
-            self.asset_list.filtered_items_ix = list(range(len(self.asset_list.items)))
+            ranked = self.search_text(text, ixs)
+            ixs = [ix for ix in ixs if self.search_index.matches(ix, text.lower())]
+
+        if ranked:
+            found = set(ranked)
+            ixs = ranked + [ix for ix in ixs if ix not in found]
+
+        return self.columns.filter(ixs, terms)
+
+    def search_text(self, text, ixs=None):
+        """
+        Returns the indexes of the RANKED_MATCHES assets whose name, description or comments best
+        match the words or "quoted phrases" of text, as whole words or word prefixes, best first.
+        Only the indexes in ixs are checked when given, otherwise every asset. Searches shorter
+        than MIN_RANKED_SEARCH match too many assets to be worth ranking and return none.
+        """
+
+        if self.db.conn is None or len(text.strip()) < MIN_RANKED_SEARCH:
+            return []
+
+        asset_ids = None if ixs is None else [self.asset_list_items[ix].asset_number for ix in ixs]
+
+        try:
+            asset_ids = self.store.search_text(text, asset_ids, RANKED_MATCHES)
+        except sqlite3.Error as ex:
+            # Busy or locked, the in memory matches still stand
+            print('ERROR:', str(ex))
+            return []
+
+        return [self.asset_index[asset_id] for asset_id in asset_ids if asset_id in self.asset_index]
+
+    def index_item(self, ix):
+        """
+        Brings the search index and column store up to date with asset_list_items[ix]
+        """
 
-        self.asset_list.repopulate_list()
+        self.search_index.update(ix, self.asset_list_items[ix])
+        self.columns.update(ix, self.asset_list_items[ix])
+
+    def unindex_item(self, ix):
+        """
+        Drops asset_list_items[ix] from searches and filters
+        """
+
+        self.search_index.remove(ix)
+        self.columns.remove(ix)
 
     def update_asset_items(self, items):
         del self.asset_list_items[:]
         for item in items:
             self.asset_list_items.append(item)
 
+        self.asset_index = dict((item.asset_number, ix)
+                                for ix, item in enumerate(self.asset_list_items))
+        self.free_ixs = []
+        self.kept_ixs = set()
+        self.search_index.build(self.asset_list_items)
+        self.columns.build(self.asset_list_items)
+        self.asset_list.reset_widths()
+
     def update_cart_count(self):
         self.notebook.tab(self.notebook.tabs()[NOTEBOOK_INDEX['Shopping Cart']], 
                     text='Shopping Cart ({})'.format(len(self.shopping_cart.filtered_items_ix)))
@@ -581,6 +863,16 @@ class Application(object):
         self.item_msg.insert(tk.END, description)
         self.item_msg.configure(state=tk.DISABLED)
 
+    def close(self, *args):
+        """
+        Closes the database connection, then the application window
+        """
+
+        self.master.after_cancel(self.sync_job)
+        self.cancel_load()
+        self.db.close()
+        self.master.destroy()
+
     def save_settings(self, *args):
         new_settings = {setting: self.settings[setting].get() 
                         for setting in self.settings}
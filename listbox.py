@@ -0,0 +1,838 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from bisect import bisect_left
+from collections import OrderedDict
+import sys
+
+if sys.version_info.major == 2:
+    import Tkinter as tk
+    import tkFont
+    import ttk
+else:
+    import tkinter as tk
+    import tkinter.font as tkFont
+    import tkinter.ttk as ttk
+
+from instrumentation import metrics
+from sorting import SortEngine
+
+DEFAULT_ROW_HEIGHT = 20  # px, used when the theme does not set a Treeview row height
+OVERSCAN = 5  # rows rendered past the bottom of the visible window
+WHEEL_ROWS = 3  # rows scrolled per mouse wheel step
+COLUMN_PADDING = 20  # px added to the widest text of a column
+MEASURE_CACHE_SIZE = 4096  # texts whose pixel width is remembered
+MAX_SORT_COLUMNS = 3  # columns clicked before the current one that still break ties
+SORT_ARROWS = {False: ' \u25b2', True: ' \u25bc'}  # shown after the title of the sort column
+PAGE_SIZE = 200  # rows a PagedView fetches at a time
+CACHED_PAGES = 20  # pages a PagedView keeps, least recently shown are dropped first
+
+_font = None  # shared by every measurement, created with the first one
+_text_widths = OrderedDict()  # text -> pixel width, least recently used first
+
+
+def measure(text):
+    """
+    Returns the pixel width of text, measuring each distinct text only once while it stays cached
+    """
+
+    global _font
+
+    width = _text_widths.pop(text, None)
+    if width is None:
+        if _font is None:
+            _font = tkFont.Font()
+        width = _font.measure(text)
+
+        if len(_text_widths) >= MEASURE_CACHE_SIZE:
+            _text_widths.popitem(last=False)
+
+    _text_widths[text] = width
+    return width
+
+
+def longest_increasing(sequence):
+    """
+    Returns the positions in sequence of one of its longest strictly increasing subsequences
+    """
+
+    tails = []  # tails[k] is the position ending the best increasing run of length k + 1
+    tail_values = []
+    previous = [None] * len(sequence)
+
+    for position, value in enumerate(sequence):
+        k = bisect_left(tail_values, value)
+        if k:
+            previous[position] = tails[k - 1]
+
+        if k == len(tails):
+            tails.append(position)
+            tail_values.append(value)
+        else:
+            tails[k] = position
+            tail_values[k] = value
+
+    positions = []
+    position = tails[-1] if tails else None
+    while position is not None:
+        positions.append(position)
+        position = previous[position]
+
+    positions.reverse()
+    return positions
+
+
+class ColumnWidths(object):
+    """
+    Running maximum of the text width of each column over a changing set of rows.
+
+    Each column counts its rows by measured width, so adding, editing or
+    removing a row adjusts a few counts instead of re-measuring every row.
+    """
+
+    def __init__(self, column_count):
+        self.column_count = column_count
+        self.reset([])
+
+    def reset(self, rows):
+        """
+        Starts over with the given rows
+        """
+
+        self.counts = [{} for _ in range(self.column_count)]  # width -> number of rows
+        self.maximums = [0] * self.column_count
+
+        for values in rows:
+            self.add(values)
+
+    def add(self, values):
+        for column in range(self.column_count):
+            width = measure(values[column])
+            counts = self.counts[column]
+            counts[width] = counts.get(width, 0) + 1
+
+            if width > self.maximums[column]:
+                self.maximums[column] = width
+
+    def remove(self, values):
+        for column in range(self.column_count):
+            width = measure(values[column])
+            counts = self.counts[column]
+
+            if width not in counts:
+                continue
+
+            counts[width] -= 1
+            if not counts[width]:
+                del counts[width]
+                if width == self.maximums[column]:
+                    self.maximums[column] = max(counts) if counts else 0
+
+    def replace(self, old_values, new_values):
+        self.remove(old_values)
+        self.add(new_values)
+
+
+class ListView(object):
+    """
+    The rows a list shows: the rows it holds that pass the filter, in sort order.
+
+    Each stage keeps its result so changing one only redoes what it must. A
+    filter that narrows the last one keeps the sorted order as it is, rows
+    that start matching are sorted on their own and merged into it, and rows
+    added to the list are filtered and merged the same way. Only changing
+    the sort sorts every shown row. Without a sort, rows are shown in the
+    order they were added, or in the order of a ranked filter's matches.
+    """
+
+    def __init__(self, sorter, ixs=()):
+        self.sorter = sorter
+        self.rows = list(ixs)  # indexes of the rows held, in the order they were added
+        self.predicate = None  # returns the indexes of a list of indexes that pass the filter, None for all
+        self.sort_columns = []  # (column position, descending) pairs, most significant first
+        self.ixs = list(self.rows)  # indexes of the rows shown, in order
+
+    def set_filter(self, predicate, matches=None, ranked=False):
+        """
+        Filters the rows with predicate. matches may give the rows held that pass it when the
+        caller can find them faster than the predicate, e.g. from an index. If ranked, matches
+        are best first and are shown in that order until the list is sorted.
+        """
+
+        with metrics.span('list filter') as span:
+            self.predicate = predicate
+
+            if matches is None:
+                matches = self.filter(self.rows)
+
+            if ranked and not self.sort_columns:
+                self.ixs = list(matches)
+                span.rows = len(self.ixs)
+                return
+
+            wanted = set(matches)
+            kept = [ix for ix in self.ixs if ix in wanted]
+
+            if len(kept) == len(wanted):
+                # Narrowed (or unchanged), what is left is still in order
+                self.ixs = kept
+            elif not self.sort_columns:
+                self.ixs = [ix for ix in self.rows if ix in wanted]
+            else:
+                shown = set(kept)
+                added = [ix for ix in matches if ix not in shown]
+
+                if len(added) > len(kept):
+                    self.ixs = self.sorter.sort(matches, self.sort_columns)
+                else:
+                    self.ixs = self.sorter.merge(kept, self.sorter.sort(added, self.sort_columns), 
+                                                 self.sort_columns)
+
+            span.rows = len(self.ixs)
+
+    def set_sort(self, columns):
+        """
+        Sorts the shown rows by a list of (column position, descending) pairs, [] for the order they were added
+        """
+
+        self.sort_columns = list(columns)
+
+        if self.sort_columns:
+            self.ixs = self.sorter.sort(self.ixs, self.sort_columns)
+        else:
+            shown = set(self.ixs)
+            self.ixs = [ix for ix in self.rows if ix in shown]
+
+    def filter(self, ixs):
+        """
+        Returns the indexes of ixs, in order, that pass the filter
+        """
+
+        if self.predicate is None:
+            return list(ixs)
+
+        return self.predicate(ixs)
+
+    def add(self, ixs):
+        """
+        Holds new rows, showing those that pass the filter in their sorted place
+        """
+
+        ixs = list(ixs)
+        self.rows.extend(ixs)
+        matches = self.filter(ixs)
+
+        if self.sort_columns:
+            self.ixs = self.sorter.merge(self.ixs, self.sorter.sort(matches, self.sort_columns),
+                                         self.sort_columns)
+        else:
+            self.ixs.extend(matches)
+
+    def remove(self, ix):
+        self.rows.remove(ix)
+        if ix in self.ixs:
+            self.ixs.remove(ix)
+
+    def clear(self):
+        self.rows = []
+        self.ixs = []
+
+
+class PagedView(object):
+    """
+    The rows a list shows when there are too many to hold, fetched a page at a time as they are shown.
+
+    fetch(offset, size, sort_columns, after) returns the indexes in items of up to size rows
+    from offset in sort order, filtered however the caller chose, along with a key of the last
+    row. Once a page is fetched the key is passed as after for the next one, so the source can
+    carry on from that row rather than step over offset rows again. count() returns how many
+    rows there are. Only the latest pages are kept, and changing the filter, the sort or the
+    rows drops them all. As a sequence it stands in for ListView.ixs, though only the rows of
+    the pages kept can be found with in and index(). It needs a list in virtual mode.
+
+    Both should catch their own errors, a page that fails to read is returned short and count()
+    returns None. Such a page is left out of slices and its rows are None when indexed, until
+    it is read again the next time it is shown, as is the count.
+
+    evict(ixs), if given, is called with the indexes of the rows that no page kept holds any more
+    whenever pages are dropped, so the caller can let go of what it holds for them.
+    """
+
+    def __init__(self, fetch, count, page_size=PAGE_SIZE, cached_pages=CACHED_PAGES, evict=None):
+        self.fetch = fetch
+        self.count = count
+        self.evict = evict
+        self.page_size = page_size
+        self.cached_pages = cached_pages
+        self.predicate = None  # filtering is up to fetch, kept for symmetry with ListView
+        self.sort_columns = []
+        self.pages = OrderedDict()  # page number -> (indexes, key of the last row), least recently used first
+        self.total = None  # number of rows, counted when first needed
+
+    @property
+    def ixs(self):
+        return self
+
+    @property
+    def rows(self):
+        return [ix for ixs, key in self.pages.values() for ix in ixs]
+
+    def invalidate(self, recount=True):
+        """
+        Drops the pages fetched so the rows are fetched again when shown
+        """
+
+        dropped = self.rows
+        self.pages.clear()
+        if recount:
+            self.total = None
+
+        if self.evict is not None and dropped:
+            self.evict(dropped)
+
+    def set_filter(self, predicate, matches=None, ranked=False):
+        self.predicate = predicate
+        self.invalidate()
+
+    def set_sort(self, columns):
+        self.sort_columns = list(columns)
+        self.invalidate(recount=False)
+
+    def filter(self, ixs):
+        return list(ixs)
+
+    def add(self, ixs):
+        self.invalidate()
+
+    def remove(self, ix):
+        self.invalidate()
+
+    def clear(self):
+        self.invalidate()
+
+    def __len__(self):
+        if self.total is None:
+            self.total = self.count()
+
+            if self.total is None:
+                # Could not be counted, try again next time
+                return 0
+
+        return self.total
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            start, stop, step = position.indices(len(self))
+            ixs = []
+
+            for page in range(start // self.page_size, (stop - 1) // self.page_size + 1 if stop > start else 0):
+                first = page * self.page_size
+                ixs.extend(self._page(page)[max(0, start - first):stop - first])
+
+            return ixs[::step]
+
+        if position < 0:
+            position += len(self)
+
+        ixs = self._page(position // self.page_size)
+        return ixs[position % self.page_size] if position % self.page_size < len(ixs) else None
+
+    def __contains__(self, ix):
+        return any(ix in ixs for ixs, key in self.pages.values())
+
+    def index(self, ix):
+        for page, (ixs, key) in self.pages.items():
+            if ix in ixs:
+                return page * self.page_size + ixs.index(ix)
+
+        raise ValueError('{} is not in a fetched page'.format(ix))
+
+    def _page(self, page):
+        cached = self.pages.pop(page, None)
+
+        if cached is None:
+            before = self.pages.get(page - 1)
+            cached = self.fetch(page * self.page_size, self.page_size, self.sort_columns,
+                                None if before is None else before[1])
+
+            # A short page that is not the last one failed to read, try again next time
+            if len(cached[0]) < self.page_size and (self.total is None
+                                                    or (page + 1) * self.page_size < self.total):
+                return cached[0]
+
+        self.pages[page] = cached
+        while len(self.pages) > self.cached_pages:
+            ixs, key = self.pages.popitem(last=False)[1]
+
+            if self.evict is not None:
+                # A row can be on two pages when the rows changed between their reads
+                held = set(self.rows)
+                self.evict([ix for ix in ixs if ix not in held])
+
+        return cached[0]
+
+
+class MultiColumnListbox(tk.Frame):
+    """
+    Treeview listing the rows of items chosen by its ListView (or PagedView), in view.ixs.
+
+    In virtual mode (the default) only the visible window of rows plus a small
+    overscan exists as Treeview items. Scrolling re-uses those items for the
+    rows that come into view, and the scrollbar is driven by the number of
+    filtered rows rather than by the tree.
+
+    Outside virtual mode, meant for short lists such as the shopping cart,
+    every listed row is a tree item.
+
+    Refreshes are diffed against what the tree currently shows, so only rows
+    that appeared, disappeared, moved or changed cost any Tk calls.
+    """
+
+    def __init__(self, master, header, items, virtual=True):
+        tk.Frame.__init__(self, master)
+
+        self.header = header
+        self.items = items
+        self.virtual = virtual
+        self.sorter = SortEngine(items)
+        self.view = ListView(self.sorter, range(len(items)))
+
+        # Virtual mode state
+        self.first_row = 0  # position in filtered_items_ix of the top rendered row
+        self.row_iids = []  # tree items, recycled from one render to the next
+        self.row_ix = []  # item index shown by each of the tree items
+        self.row_values = []  # values and tags last drawn into each of the tree items
+        self.row_positions = {}  # item index -> position of the tree item showing it
+        self.focus_ix = None  # item index of the focused row, kept while scrolled away
+        self.selected_ix = []  # item indexes of the selected rows, kept while scrolled away
+        self.row_height = None
+
+        # Outside virtual mode every listed row is a tree item whose iid is str(ix)
+        self.drawn = {}  # item index -> values and tags last drawn into its tree item
+
+        self.column_widths = ColumnWidths(len(self.header))  # rows the list holds, ignoring filtering
+        self.header_widths = []
+        self.applied_widths = [None] * len(self.header)
+
+        self.tree = ttk.Treeview(self, columns=self.header, show='headings')
+        h_scroll = ttk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.tree.xview)
+
+        if self.virtual:
+            self.v_scroll = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+            self.tree.configure(yscrollcommand=self._on_tree_scroll, xscrollcommand=h_scroll.set)
+            self.tree.bind('<Configure>', lambda event: self._render())
+            self.tree.bind('<MouseWheel>',
+                            lambda event: self.scroll_rows(-WHEEL_ROWS if event.delta > 0 else WHEEL_ROWS))
+            self.tree.bind('<Button-4>', lambda event: self.scroll_rows(-WHEEL_ROWS))
+            self.tree.bind('<Button-5>', lambda event: self.scroll_rows(WHEEL_ROWS))
+            self.tree.bind('<Up>', lambda event: self.move_focus(-1))
+            self.tree.bind('<Down>', lambda event: self.move_focus(1))
+            self.tree.bind('<Prior>', lambda event: self.move_focus(-self.visible_row_count()))
+            self.tree.bind('<Next>', lambda event: self.move_focus(self.visible_row_count()))
+        else:
+            self.v_scroll = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.tree.yview)
+            self.tree.configure(yscrollcommand=self.v_scroll.set, xscrollcommand=h_scroll.set)
+
+        self.tree.grid(row=0, column=0, sticky='nesw')
+        self.v_scroll.grid(row=0, column=1, sticky='ns')
+        h_scroll.grid(row=1, column=0, sticky='ew')
+
+        self._build_tree()
+
+    @property
+    def filtered_items_ix(self):
+        """
+        Indexes of the rows shown, in order
+        """
+
+        return self.view.ixs
+
+    @filtered_items_ix.setter
+    def filtered_items_ix(self, ixs):
+        self.view.ixs = list(ixs)
+
+    @property
+    def sort_columns(self):
+        return self.view.sort_columns
+
+    def _build_tree(self):
+        """
+        Initializes the items in the tree to be displayed on the gui
+        """
+
+        for col in self.header:
+            self.tree.heading(col, text=col.title(),
+                                command=lambda c=col: self.sortby(c))
+            self.header_widths.append(measure(col.title()) + COLUMN_PADDING)
+
+        self.reset_widths()
+        self.repopulate_list()
+
+    def row_tags(self, values):
+        """
+        Tags given to the tree item of a row, override to style rows
+        """
+
+        return ()
+
+    def fit_columns(self):
+        """
+        Resizes each column to fit the longest text
+        """
+
+        with metrics.span('list fit_columns', len(self.header)):
+            for column, col in enumerate(self.header):
+                width = max(self.header_widths[column],
+                            self.column_widths.maximums[column] + COLUMN_PADDING)
+
+                # Only touch columns whose width changed so manual resizing sticks
+                if width != self.applied_widths[column]:
+                    self.tree.column(col, width=width)
+                    self.applied_widths[column] = width
+
+    def reset_widths(self, ixs=None):
+        """
+        Recomputes the column widths over items[ix] for each ix (all items by default)
+        """
+
+        if ixs is None:
+            # Every row may have been replaced
+            self.sorter.invalidate()
+            self.column_widths.reset(self.items)
+        else:
+            self.column_widths.reset(self.items[ix] for ix in ixs)
+
+    def sortby(self, col, descending=None):
+        """
+        Sorts the list by a column, ties are broken by the columns sorted on before it.
+        Sorting again by the current sort column reverses it unless descending is given.
+        """
+
+        with metrics.span('list sortby', len(self.filtered_items_ix)):
+            col_index = self.header.index(col)
+
+            if descending is None:
+                descending = self.sort_columns[:1] == [(col_index, False)]
+
+            sort_columns = [(col_index, descending)] + [(position, reverse) for position, reverse 
+                                                         in self.sort_columns if position != col_index]
+
+            self.view.set_sort(sort_columns[:MAX_SORT_COLUMNS])
+            self.repopulate_list(keep_position=False)
+
+            for column, heading in enumerate(self.header):
+                text = heading.title()
+                if column == col_index:
+                    text += SORT_ARROWS[descending]
+                self.tree.heading(heading, text=text)
+
+    def set_view(self, view):
+        """
+        Lists the rows chosen by another view, such as a PagedView in place of the ListView, keeping the sort
+        """
+
+        view.set_sort(self.sort_columns)
+        self.view = view
+        self.repopulate_list(keep_position=False)
+
+    def set_filter(self, predicate, matches=None, ranked=False):
+        """
+        Shows only the rows passing predicate, keeping the sort. See ListView.set_filter.
+        """
+
+        self.view.set_filter(predicate, matches, ranked)
+        self.repopulate_list()
+
+    def repopulate_list(self, keep_position=True):
+        """
+        Refreshes the view of the list, keep_position keeps the top row in place if it is still listed
+        """
+
+        with metrics.span('list repopulate', len(self.filtered_items_ix)):
+            if self.virtual:
+                if not keep_position:
+                    self.first_row = 0
+                elif self.row_ix:
+                    try:
+                        self.first_row = self.filtered_items_ix.index(self.row_ix[0])
+                    except ValueError:
+                        pass
+
+                self._render()
+            else:
+                self._reconcile()
+
+            self.fit_columns()
+
+    def index_of(self, iid):
+        """
+        Returns the index in items of the row shown by a tree item
+        """
+
+        if self.virtual:
+            return self.row_ix[self.row_iids.index(iid)]
+
+        return int(iid)
+
+    def add_item(self, ix):
+        """
+        Adds the row of items[ix] to the list
+        """
+
+        self.add_items([ix])
+
+    def add_items(self, ixs):
+        """
+        Adds the rows of items[ix] for each ix to the list, those passing the filter are shown in sort order
+        """
+
+        with metrics.span('list add_items') as span:
+            ixs = list(ixs)
+            span.rows = len(ixs)
+            self.sorter.invalidate()
+
+            for ix in ixs:
+                self.column_widths.add(self.items[ix])
+
+            if self.virtual or self.sort_columns:
+                self.view.add(ixs)
+                self.repopulate_list()
+                return
+
+            # Unsorted rows go at the end, no need to reconcile the whole tree
+            for ix in self.view.filter(ixs):
+                values = self.items[ix]
+                drawn = self._drawn(values)
+                self.view.ixs.append(ix)
+                self.tree.insert('', index='end', iid=str(ix), values=values, tags=drawn[1])
+                self.drawn[ix] = drawn
+
+            self.view.rows.extend(ixs)
+            self.fit_columns()
+
+    def clear(self):
+        """
+        Removes every row from the list
+        """
+
+        self.view.clear()
+        self.column_widths.reset([])
+        self.repopulate_list()
+
+    def refresh_item(self, ix, old_values=None):
+        """
+        Redraws the row of items[ix] if it is in the list, old_values are the values it had before an edit
+        """
+
+        values = self.items[ix]
+        self.sorter.invalidate()
+
+        if old_values is not None:
+            self.column_widths.replace(old_values, values)
+            self.fit_columns()
+
+        if self.virtual:
+            if ix in self.row_positions:
+                position = self.row_positions[ix]
+                drawn = self._drawn(values)
+                self.tree.item(self.row_iids[position], values=values, tags=drawn[1])
+                self.row_values[position] = drawn
+        elif ix in self.drawn:
+            drawn = self._drawn(values)
+            self.tree.item(str(ix), values=values, tags=drawn[1])
+            self.drawn[ix] = drawn
+
+    def remove_item(self, ix):
+        """
+        Removes the row of items[ix] from the list
+        """
+
+        if ix not in self.view.rows:
+            return
+
+        shown = ix in self.view.ixs
+        self.view.remove(ix)
+        self.column_widths.remove(self.items[ix])
+
+        if self.virtual:
+            self._render()
+        elif shown:
+            self.tree.delete(str(ix))
+            del self.drawn[ix]
+
+        self.fit_columns()
+
+    def visible_row_count(self):
+        """
+        Number of rows that fit in the tree, not counting the heading
+        """
+
+        if self.row_height is None:
+            row_height = ttk.Style().lookup('Treeview', 'rowheight')
+            self.row_height = int(row_height) if row_height else DEFAULT_ROW_HEIGHT
+
+        return max(1, self.tree.winfo_height() // self.row_height - 1)
+
+    def yview(self, *args):
+        """
+        Vertical scrollbar command, scrolls through the filtered rows
+        """
+
+        if args[0] == 'moveto':
+            self.first_row = int(float(args[1]) * len(self.filtered_items_ix))
+            self._render()
+        elif args[0] == 'scroll':
+            amount = int(args[1])
+            if args[2] == 'pages':
+                amount *= self.visible_row_count()
+            self.scroll_rows(amount)
+
+    def scroll_rows(self, amount):
+        """
+        Scrolls the virtual list by amount rows
+        """
+
+        self.first_row += amount
+        self._render()
+        return 'break'
+
+    def move_focus(self, amount):
+        """
+        Moves the focus and selection amount rows, scrolling the virtual list if needed
+        """
+
+        self._capture_selection()
+
+        if not self.filtered_items_ix:
+            return 'break'
+
+        if self.focus_ix in self.filtered_items_ix:
+            position = self.filtered_items_ix.index(self.focus_ix) + amount
+        else:
+            position = self.first_row
+
+        position = max(0, min(position, len(self.filtered_items_ix) - 1))
+        visible = self.visible_row_count()
+
+        if position < self.first_row:
+            self.first_row = position
+        elif position >= self.first_row + visible:
+            self.first_row = position - visible + 1
+
+        self.focus_ix = self.filtered_items_ix[position]
+        self.selected_ix = [self.focus_ix]
+        self._render(capture=False)
+        return 'break'
+
+    def _capture_selection(self):
+        """
+        Maps the tree's focus and selection back to item indexes before the rendered rows change
+        """
+
+        shown = dict(zip(self.row_iids, self.row_ix))
+
+        focus = self.tree.focus()
+        if focus in shown:
+            self.focus_ix = shown[focus]
+
+        selection = [shown[iid] for iid in self.tree.selection() if iid in shown]
+        if selection or any(ix in self.row_ix for ix in self.selected_ix):
+            self.selected_ix = selection
+
+    def _drawn(self, values):
+        return tuple(values), tuple(self.row_tags(values))
+
+    def _render(self, capture=True):
+        """
+        Points the recycled tree items at the rows of the visible window
+        """
+
+        with metrics.span('list render') as span:
+            if capture:
+                self._capture_selection()
+
+            rows = len(self.filtered_items_ix)
+            visible = self.visible_row_count()
+            self.first_row = max(0, min(self.first_row, rows - visible))
+            window = self.filtered_items_ix[self.first_row:self.first_row + visible + OVERSCAN]
+            span.rows = len(window)
+
+            if len(self.row_iids) > len(window):
+                self.tree.delete(*self.row_iids[len(window):])
+                del self.row_iids[len(window):]
+                del self.row_values[len(window):]
+
+            # Only redraw the tree items whose row or values changed
+            for position, ix in enumerate(window):
+                values = self.items[ix]
+                drawn = self._drawn(values)
+
+                if position == len(self.row_iids):
+                    self.row_iids.append(self.tree.insert('', index='end', values=values,
+                                                          tags=drawn[1]))
+                    self.row_values.append(drawn)
+                elif self.row_ix[position] != ix or self.row_values[position] != drawn:
+                    self.tree.item(self.row_iids[position], values=values, tags=drawn[1])
+                    self.row_values[position] = drawn
+
+            self.row_ix = window
+            self.row_positions = dict((ix, position) for position, ix in enumerate(window))
+
+            # Restore the focus and selection onto whichever tree items now show those rows
+            shown = dict(zip(self.row_ix, self.row_iids))
+            selection = tuple(shown[ix] for ix in self.selected_ix if ix in shown)
+            if selection != tuple(self.tree.selection()):
+                self.tree.selection_set(selection)
+            self.tree.focus(shown.get(self.focus_ix, ''))
+
+            self.tree.yview_moveto(0)
+            if rows:
+                self.v_scroll.set(self.first_row / rows, min(1, (self.first_row + visible) / rows))
+            else:
+                self.v_scroll.set(0, 1)
+
+    def _on_tree_scroll(self, first, last):
+        """
+        Turns the tree scrolling itself (e.g. to show a clicked overscan row) into a virtual scroll
+        """
+
+        offset = int(round(float(first) * len(self.row_iids)))
+        if offset:
+            self.scroll_rows(offset)
+
+    def _reconcile(self):
+        """
+        Updates the tree items to list filtered_items_ix using as few tree calls as possible
+        """
+
+        with metrics.span('list reconcile', len(self.filtered_items_ix)):
+            positions = dict((ix, position) for position, ix in enumerate(self.filtered_items_ix))
+            current = [int(iid) for iid in self.tree.get_children('')]
+
+            removed = [ix for ix in current if ix not in positions]
+            if removed:
+                self.tree.delete(*[str(ix) for ix in removed])
+                for ix in removed:
+                    del self.drawn[ix]
+
+            # Rows already in the right relative order stay, the others are detached and put back in place
+            kept = [ix for ix in current if ix in positions]
+            stable = set(kept[position] for position in
+                         longest_increasing([positions[ix] for ix in kept]))
+            moved = set(ix for ix in kept if ix not in stable)
+            if moved:
+                self.tree.detach(*[str(ix) for ix in moved])
+
+            for position, ix in enumerate(self.filtered_items_ix):
+                values = self.items[ix]
+                drawn = self._drawn(values)
+
+                if ix not in self.drawn:
+                    self.tree.insert('', index=position, iid=str(ix), values=values,
+                                     tags=drawn[1])
+                else:
+                    if ix in moved:
+                        self.tree.move(str(ix), '', position)
+                    if self.drawn[ix] != drawn:
+                        self.tree.item(str(ix), values=values, tags=drawn[1])
+
+                self.drawn[ix] = drawn
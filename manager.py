@@ -1,11 +1,10 @@
 from __future__ import absolute_import, division, print_function, unicode_literals
 
-import datetime
+import csv
 import json
+from itertools import islice
 from operator import itemgetter
 import os
-import random
-import re
 import sqlite3
 import sys
 import time
@@ -22,16 +21,44 @@ else:
     import tkinter.ttk as ttk
     from tkinter import messagebox, filedialog
 
+from columnar import ColumnStore, split_fields
+from database import Database, DatabaseWorker, NO_VALUE
+from diagnostics import DiagnosticsPanel
+from instrumentation import metrics
+from listbox import MultiColumnListbox
+from records import record_type
+from search_index import IncrementalSearch, SearchIndex
+from store import (ASSET_COLUMNS, BORROW_DAYS, IMPORT_BATCH_SIZE, InventoryStore, asset_query, 
+                   batch_message, parse_asset_numbers, read_rows)
+
 COLUMN_INDEX = {'Asset Number': 0, 'Item': 1, 'State': 2, 'Loaned To': 3, 
                 'Email': 4, 'Date Requested': 5, 'Due Date': 6,
                 'Storage Location': 7, 'Purchase Date': 8, 'Description': 9, 
                 'Comments': 10}
+# Every asset with its borrower, in list column order
+ASSET_QUERY = asset_query(ASSET_COLUMNS)
+AssetRecord = record_type('AssetRecord', sorted(COLUMN_INDEX, key=COLUMN_INDEX.get),
+                          interned=['Item', 'State', 'Storage Location'])
 NOTEBOOK_INDEX = {'Asset List': 0, 'Settings': 1}
+# Searched in memory by substring, the name, description and comments are also searched
+# word by word in the database's full text index (see Application.search_text)
 SEARCHABLE = ['Asset Number', 'Item', 'Loaned To', 'Email', 
-                'Date Requested', 'Due Date', 'Description', 
+                'Date Requested', 'Due Date', 
                 'Purchase Date', 'Storage Location']
+FILTER_FIELDS = {'state': COLUMN_INDEX['State'], 
+                 'location': COLUMN_INDEX['Storage Location'],
+                 'requested': COLUMN_INDEX['Date Requested'], 
+                 'due': COLUMN_INDEX['Due Date'],
+                 'purchased': COLUMN_INDEX['Purchase Date']}  # search terms such as state:overdue
 SEARCH_HINT = 'Search...'
-SETTINGS = ['first_name', 'last_name', 'email', 'database_path']
+SEARCH_DELAY = 150  # ms to wait for more keystrokes before filtering
+MIN_RANKED_SEARCH = 3  # characters a search needs before the full text index ranks its matches
+RANKED_MATCHES = 200  # best full text matches listed first, the rest follow in list order
+SYNC_INTERVAL = 5000  # ms between checks for changes made by other applications
+WORKER_POLL_INTERVAL = 50  # ms between checks for finished database jobs
+LOAD_PAGE_SIZE = 2000  # assets added to the list per event loop pass while loading
+LOAD_DELAY = 1  # ms between pages, lets pending events run
+SETTINGS = ['first_name', 'last_name', 'email', 'database_path', 'record_timings', 'slow_log']
 SETTINGS_PATH = os.path.join('settings', 'asset_settings.json')
 
 class LabelEntry(tk.Frame):
@@ -58,6 +85,7 @@ class LabelEntry(tk.Frame):
 class AddItemWindow(object):
     def __init__(self, app_toplevel, values=None):
         self.app_toplevel = app_toplevel
+        self.values = values  # the values of the item being edited, None when adding
         self.root = tk.Toplevel()
         self.root.transient(self.app_toplevel.master)
         self.root.title('Add Asset')
@@ -125,7 +153,6 @@ class AddItemWindow(object):
         self.root.update()
         self.root.minsize(self.root.winfo_width(), 
                             self.root.winfo_height())
-        self.root.mainloop()
 
     def add_items(self, is_update, *args):
         """
@@ -152,12 +179,13 @@ class AddItemWindow(object):
         elif purchase_date is not None and not self._valid_date(purchase_date):
             messagebox.showerror('Date Error', 'Invalid date, please use YYYY-MM-DD format')
         else:
-            conn = sqlite3.connect(database_path)
-            cursor = conn.cursor()
+            try:
+                asset_num_list = parse_asset_numbers(asset_numbers)
+            except ValueError as ex:
+                messagebox.showerror('Insert Error', str(ex))
+                return
 
-            
             num_count = {}
-            asset_num_list = asset_numbers.split(',')
 
             for num in asset_num_list:
                 if num in num_count:
@@ -167,154 +195,100 @@ class AddItemWindow(object):
 
             non_unique_assets = [num for num in num_count if num_count[num] > 1]
 
-            if not is_update:
-                for asset_no in asset_num_list:
-                    result = cursor.execute(
-                                'SELECT name FROM assets WHERE asset_id={}'.format(asset_no))
-                    if list(result):
-                        non_unique_assets.append(asset_no)
-
             if non_unique_assets:
-                messagebox.showerror('Update Error', 
-                                        'Non-unique asset numbers:' 
-                                        + ', '.join(non_unique_assets))
+                self._show_non_unique(non_unique_assets)
             elif is_update and len(asset_num_list) > 1:
                 messagebox.showerror('Update Error',
                                         'Cannot add multiple items for an update')
             else:
-                if is_update:
-                    values = self.app_toplevel.asset_list.selected_values
-                    old_asset_num = values[COLUMN_INDEX['Asset Number']]
-                    DELETE_QUERY = 'DELETE FROM assets WHERE asset_id={}'.format(
-                                        old_asset_num)
-
-                    UPDATE_QUERY = ('UPDATE borrow_list ' 
-                                    'SET asset_id = {} '
-                                    'WHERE asset_id = {}').format(old_asset_num, asset_num_list[0])
-
-                    cursor.execute(DELETE_QUERY)
-                    cursor.execute(UPDATE_QUERY)
-
-                ADD_QUERY = 'INSERT INTO assets VALUES (?,?,?,?,?)'
-                # Split asset number entry by , for bulk entry
-                for asset_no in asset_num_list:
-                    cursor.execute(ADD_QUERY, [asset_no, asset_name, 
-                                                description, purchase_date,
-                                                storage_location])
-                    conn.commit()
-                
-                if is_update:
-                    new_values = list(values)
-                    new_values[COLUMN_INDEX['Asset Number']] = asset_num_list[0]
-                    new_values[COLUMN_INDEX['Item']] = asset_name
-                    new_values[COLUMN_INDEX['Description']] = description
-                    new_values[COLUMN_INDEX['Purchase Date']] = purchase_date
-                    new_values[COLUMN_INDEX['Storage Location']] = storage_location
-                    self.app_toplevel.asset_list.change_values(new_values)
-                else:
-                    items = self.app_toplevel.retrieve_assets(database_path)
-                    self.app_toplevel.update_asset_items(items)
-                    self.app_toplevel.asset_list.filtered_items_ix = list(
-                                                    range(len(self.app_toplevel.asset_list_items)))
-                    self.app_toplevel.asset_list.repopulate_list()
-                
-                self.root.destroy()
+                old_asset_num = self.values[COLUMN_INDEX['Asset Number']] if is_update else None
+                row = [asset_name, description, purchase_date, storage_location]
+                asset_list = self.app_toplevel.asset_list
 
-            conn.close()
+                def write(db):
+                    return InventoryStore(db).add_assets(asset_num_list, row, old_asset_num)
 
-    def _valid_date(self, date):
-        date_lst = date.split('-')
+                def written(non_unique_assets):
+                    if is_update:
+                        asset_list.set_pending(old_asset_num, False)
 
-        if len(date_lst) != 3:
-            return False
-        else:
-            year, month, day = [int(x) for x in date_lst]
-
-        if (not 1 <= month <= 12
-            and (month == 2 and not 1 <= month <= 29)
-            and not (1 <= day <= 31)):
-            return False
-
-        return True
+                    if non_unique_assets:
+                        self._enable()
+                        self._show_non_unique(non_unique_assets)
+                    else:
+                        self._assets_written(asset_num_list, row, old_asset_num)
 
+                def failed(error):
+                    if is_update:
+                        asset_list.set_pending(old_asset_num, False)
 
-class MultiColumnListbox(tk.Frame):
-    def __init__(self, master, header, items):
-        tk.Frame.__init__(self, master)
-       
-        self.header = header
-        self.items = items
-        self.filtered_items_ix = list(range(len(items)))  # indexes of filtered items
-
-        self.tree = ttk.Treeview(self, columns=self.header, show='headings')
-        v_scroll = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.tree.yview)
-        h_scroll = ttk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.tree.xview)
-        self.tree.configure(yscrollcommand=v_scroll.set, xscrollcommand=h_scroll.set)
-        self.tree.grid(row=0, column=0, sticky='nesw')
-        v_scroll.grid(row=0, column=1, sticky='ns')
-        h_scroll.grid(row=1, column=0, sticky='ew')
-
-        self._build_tree()
-
-    def _build_tree(self):
-        """
-        Initializes the items in the tree to be displayed on the gui
-        """
+                    self._enable()
+                    messagebox.showerror('Database Error', str(error))
 
-        for col in self.header:
-            self.tree.heading(col, text=col.title(),
-                                command=lambda c=col: self.sortby(c, False))
-            self.tree.column(col, width=tkFont.Font().measure(col.title())+20)  # +20 for extra padding
-
-        for ix in self.filtered_items_ix:
-            self.tree.insert('', index='end', values=self.items[ix])
+                # The window stays up, disabled, until the database has the items
+                self.add_btn.configure(state=tk.DISABLED)
+                if is_update:
+                    asset_list.set_pending(old_asset_num, True)
+                    self.app_toplevel.history_msg.set('Updating {}...'.format(asset_name))
+                else:
+                    self.app_toplevel.history_msg.set('Adding {} items...'.format(len(asset_num_list)))
 
-            # Ensure column width fits values
-            for i in range(len(self.header)):
-                col_width = tkFont.Font().measure(self.items[ix][i]) + 20
-                if self.tree.column(self.header[i], width=None) < col_width:
-                    self.tree.column(self.header[i], width=col_width)
+                self.app_toplevel.worker.submit(write, written, failed)
 
-    def fit_columns(self):
+    def _assets_written(self, asset_num_list, row, old_asset_num):
         """
-        Resizes each column to fit the longest text
+        Shows the assets the database worker wrote in the list, then closes the window
         """
 
-        column_count = len(self.header)
-        widths = [self.tree.column(col)['width'] for col in self.header]
+        asset_name, description, purchase_date, storage_location = row
+        new_items = []
 
-        for ix in self.filtered_items_ix:
-            for i in range(column_count):
-                item_width = tkFont.Font().measure(self.items[ix][i]) + 20
-                widths[i] = max(item_width, widths[i])
+        if old_asset_num is None:
+            base = AssetRecord.from_row([NO_VALUE] * len(COLUMN_INDEX)).replace(state='Available')
+        else:
+            base = AssetRecord.from_row(self.values)
+
+        for asset_no in asset_num_list:
+            new_items.append(base.replace(asset_number=asset_no, 
+                                          item=asset_name,
+                                          storage_location=storage_location,
+                                          description=description if description is not None else NO_VALUE,
+                                          purchase_date=purchase_date if purchase_date is not None else NO_VALUE))
+
+        if old_asset_num is None:
+            self.app_toplevel.add_asset_items(new_items)
+            self.app_toplevel.history_msg.set('Added {} items'.format(len(new_items)))
+        else:
+            self.app_toplevel.asset_list.change_values(new_items[0], old_asset_num)
+            self.app_toplevel.history_msg.set('Updated {}'.format(asset_name))
 
-        for i in range(len(self.header)):
-            self.tree.column(self.header[i], width=widths[i])
+        if self.root.winfo_exists():
+            self.root.destroy()
 
-    def sortby(self, col, descending):
-        """
-        Sorts the data in a list column
-        """
+    def _enable(self):
+        if self.root.winfo_exists():
+            self.add_btn.configure(state=tk.NORMAL)
 
-        data = [(self.tree.set(child, col), child) for child in self.tree.get_children('')]
-        data.sort(reverse=descending)
+    def _show_non_unique(self, non_unique_assets):
+        messagebox.showerror('Update Error', 
+                                'Non-unique asset numbers: ' 
+                                + ', '.join(str(num) for num in sorted(non_unique_assets)))
 
-        for i, item in enumerate(data):
-            self.tree.move(item[1], '', i)
+    def _valid_date(self, date):
+        date_lst = date.split('-')
 
-        self.tree.heading(col, command=lambda c=col: self.sortby(c, not descending))
+        if len(date_lst) != 3:
+            return False
+        else:
+            year, month, day = [int(x) for x in date_lst]
 
-    def repopulate_list(self):
-        """
-        Refreshes the view of the list
-        """
+        if (not 1 <= month <= 12
+            and (month == 2 and not 1 <= month <= 29)
+            and not (1 <= day <= 31)):
+            return False
 
-        for row in self.tree.get_children():
-                self.tree.delete(row)
-        for ix in self.filtered_items_ix:
-            self.tree.insert('', index='end', values=self.items[ix])
+        return True
 
-        self.fit_columns()
 
 class AssetList(MultiColumnListbox):
     def __init__(self, master, app_toplevel, header, items):
@@ -322,6 +296,7 @@ class AssetList(MultiColumnListbox):
         self.master = master
         self.app_toplevel = app_toplevel
         self.selected_values = None
+        self.pending = set()  # asset numbers of the items with database changes in progress
 
         # Asset list tree configurations
         self.tree.bind('<Button-3>', self.popup_menu)
@@ -334,6 +309,7 @@ class AssetList(MultiColumnListbox):
         self.tree.tag_configure('Requested', background='#FFCC80')
         self.tree.tag_configure('Shopping Cart', background='#90CAF9')
         self.tree.tag_configure('Overdue', background='#B39DDB')
+        self.tree.tag_configure('Pending', foreground='#9E9E9E')
         self.items.sort(key=itemgetter(COLUMN_INDEX['Asset Number']))
         self.repopulate_list()
 
@@ -350,20 +326,26 @@ class AssetList(MultiColumnListbox):
             messagebox.showerror('Approve Error', 
                 '{} is not requested'.format(values[COLUMN_INDEX['Item']]))
 
-    def change_values(self, new_values):
+    def change_values(self, new_values, asset_number=None):
         """
-        Change the values of the selected item on the list
+        Change the values of an item on the list, the selected item unless its asset number is given
         """
 
-        asset_number = self.selected_values[COLUMN_INDEX['Asset Number']]
+        if asset_number is None:
+            asset_number = self.selected_values[COLUMN_INDEX['Asset Number']]
+
+        full_list_index = self.app_toplevel.asset_index.pop(asset_number, None)
+
+        if full_list_index is None:
+            # Already deleted, possibly by another application
+            return
 
-        for leaf_id in self.tree.get_children(''):
-                current = self.tree.item(leaf_id)
+        old_values = self.items[full_list_index]
 
-                if asset_number == current['values'][COLUMN_INDEX['Asset Number']]:
-                    self.tree.item(leaf_id, values=new_values, 
-                                    tags=[new_values[COLUMN_INDEX['State']]])
-                    break
+        self.items[full_list_index] = new_values
+        self.app_toplevel.asset_index[int(new_values.asset_number)] = full_list_index
+        self.app_toplevel.index_item(full_list_index)
+        self.refresh_item(full_list_index, old_values)
 
     def delete_item(self, *args):
         """
@@ -379,17 +361,20 @@ class AssetList(MultiColumnListbox):
                                          default=messagebox.CANCEL)
 
         if confirm:
-            db_path = self.app_toplevel.settings['database_path'].get()
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute(('DELETE FROM assets '
-                            'WHERE asset_id={}').format(asset_id))
-            conn.commit()
-            conn.close()
+            def delete(db):
+                InventoryStore(db).delete_assets([asset_id])
 
-            self.app_toplevel.history_msg.set(
-                'Deleted {} from database'.format(values[COLUMN_INDEX['Item']]))
-            self.tree.delete(self.tree.selection()[0])
+            def deleted(result):
+                self.app_toplevel.history_msg.set(
+                    'Deleted {} from database'.format(values[COLUMN_INDEX['Item']]))
+
+                full_list_index = self.app_toplevel.asset_index.pop(asset_id, None)
+                if full_list_index is not None:
+                    self.app_toplevel.unindex_item(full_list_index)
+                    self.remove_item(full_list_index)
+
+            self.submit(asset_id, delete, deleted,
+                        'Deleting {}...'.format(values[COLUMN_INDEX['Item']]))
 
     def extend_due_date(self, *args):
         """
@@ -398,59 +383,42 @@ class AssetList(MultiColumnListbox):
 
         values = self.selected_values
         asset_num = values[COLUMN_INDEX['Asset Number']]
-        year, month, day = [int(d) for d in values[COLUMN_INDEX['Due Date']].split('-')]
-
-        old_due = datetime.date(year=year, month=month, day=day)
-        extra = datetime.timedelta(days=30)
-        new_due = old_due + extra
 
-        due_formatted = '{}-{:02}-{:02}'.format(
-                            new_due.year, new_due.month, new_due.day)
+        def extend(db):
+            return InventoryStore(db).extend_due_dates([asset_num], BORROW_DAYS)
 
-        db_path = self.app_toplevel.settings['database_path'].get()
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute(('UPDATE borrow_list '
-                        'SET return_date = "{}" '
-                        'WHERE asset_id={}').format(due_formatted, asset_num))
-        conn.commit()
-        conn.close()
+        def extended(due_dates):
+            if asset_num in due_dates:
+                self._update_values(asset_num, due_date=due_dates[asset_num])
+            self.app_toplevel.history_msg.set('Extended due date of {} by 30 days'.format(
+                values[COLUMN_INDEX['Item']]))
 
-        values[COLUMN_INDEX['Due Date']] = due_formatted
-        self.change_values(values)
-        self.app_toplevel.history_msg.set('Extended due date of {} by 30 days'.format(
-            values[COLUMN_INDEX['Item']]))
+        self.submit(asset_num, extend, extended, 
+                    'Extending due date of {}...'.format(values[COLUMN_INDEX['Item']]))
 
     def make_available(self):
         """
         Changes an item's state to available
         """
 
-        db_path = self.app_toplevel.settings['database_path'].get()
         asset_id = self.selected_values[COLUMN_INDEX['Asset Number']]
 
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute(('DELETE FROM borrow_list '
-                        'WHERE asset_id={}').format(asset_id))
-        conn.commit()
-        conn.close()
+        def clear_borrower(db):
+            return InventoryStore(db).make_available([asset_id])
 
-        self.set_state('Available')
+        self.submit(asset_id, clear_borrower, 
+                    lambda count: self._state_changed(asset_id, 'Available', count),
+                    'Making {} available...'.format(self.selected_values[COLUMN_INDEX['Item']]))
 
-
-    def repopulate_list(self):
+    def row_tags(self, values):
         """
-        Refreshes the view of the list
+        Colours the row by the state of the item, rows with database changes in progress are greyed out
         """
 
-        for row in self.tree.get_children():
-                self.tree.delete(row)
-        for ix in self.filtered_items_ix:
-            item = self.items[ix]
-            self.tree.insert('', index='end', values=item, 
-                                tags=[item[COLUMN_INDEX['State']]])
-        self.fit_columns()
+        if values[COLUMN_INDEX['Asset Number']] in self.pending:
+            return [values[COLUMN_INDEX['State']], 'Pending']
+
+        return [values[COLUMN_INDEX['State']]]
 
     def select_item(self, *args):
         """
@@ -458,38 +426,88 @@ class AssetList(MultiColumnListbox):
         """
 
         item = self.tree.item(self.tree.focus())
-        item_index = self.tree.index(self.tree.focus())
-        full_list_index = self.filtered_items_ix[item_index]
+        full_list_index = self.index_of(self.tree.focus())
+
+    def set_pending(self, asset_number, pending):
+        """
+        Marks the row of an item as waiting on the database, or as done
+        """
+
+        if pending:
+            self.pending.add(asset_number)
+        else:
+            self.pending.discard(asset_number)
+
+        full_list_index = self.app_toplevel.asset_index.get(asset_number)
+        if full_list_index is not None:
+            self.refresh_item(full_list_index)
 
     def set_state(self, state, *args):
         """ 
         Changes an items state to desired value
         """
 
-        database_path = self.app_toplevel.settings['database_path'].get()
-        conn = sqlite3.connect(database_path)
-        cursor = conn.cursor()
-
         values = self.selected_values
         asset_number = values[COLUMN_INDEX['Asset Number']]
 
-        QUERY = ('UPDATE borrow_list '
-                 'SET state = "{}"'
-                 'WHERE asset_id={}').format(state, asset_number)
+        def update_state(db):
+            return InventoryStore(db).set_state([asset_number], state)
+
+        self.submit(asset_number, update_state, 
+                    lambda count: self._state_changed(asset_number, state, count),
+                    'Changing {} to {}...'.format(values[COLUMN_INDEX['Item']].lower(), state))
+
+    def submit(self, asset_number, job, callback, message):
+        """
+        Runs a database job for an item on the database worker, the item shows as pending until it is done
+        """
+
+        if asset_number in self.pending:
+            self.app_toplevel.history_msg.set('Still saving the last change to that item')
+            return
+
+        def done(result):
+            self.set_pending(asset_number, False)
+            callback(result)
 
-        cursor.execute(QUERY)
+        def failed(error):
+            self.set_pending(asset_number, False)
+            self.app_toplevel.history_msg.set('Could not save the change')
+            messagebox.showerror('Database Error', str(error))
 
-        conn.commit()
+        self.set_pending(asset_number, True)
+        self.app_toplevel.history_msg.set(message)
+        self.app_toplevel.worker.submit(job, done, failed)
 
-        values[COLUMN_INDEX['State']] = state
+    def _state_changed(self, asset_number, state, count):
+        if not count:
+            # Someone else made it available first, the next sync shows the row as it is
+            self.app_toplevel.history_msg.set('{} was already available, nothing changed'.format(asset_number))
+            return
 
         if state == 'Available':
-            for column in ['Loaned To', 'Email', 'Date Requested', 'Due Date']:
-                values[COLUMN_INDEX[column]] = '---'
+            values = self._update_values(asset_number, state=state, loaned_to=NO_VALUE, 
+                                         email=NO_VALUE, date_requested=NO_VALUE, 
+                                         due_date=NO_VALUE, comments=NO_VALUE)
+        else:
+            values = self._update_values(asset_number, state=state)
 
-        self.change_values(values)
-        self.app_toplevel.history_msg.set(
-            '{} is now {}'.format(values[COLUMN_INDEX['Item']].lower(), state))
+        if values is not None:
+            self.app_toplevel.history_msg.set(
+                '{} is now {}'.format(values.item.lower(), state))
+
+    def _update_values(self, asset_number, **changes):
+        """
+        Changes some fields of an item, returns its new values or None if it is no longer on the list
+        """
+
+        full_list_index = self.app_toplevel.asset_index.get(asset_number)
+        if full_list_index is None:
+            return None
+
+        values = self.items[full_list_index].replace(**changes)
+        self.change_values(values, asset_number)
+        return values
 
     def popup_menu(self, event):
         """
@@ -532,6 +550,10 @@ class Application(object):
         self.master.columnconfigure(0, weight=1)
 
         self.settings = {setting: tk.StringVar() for setting in SETTINGS}
+        self.db = Database()  # reads on the Tk thread
+        self.store = InventoryStore(self.db)
+        self.worker = DatabaseWorker()  # writes, with a connection of its own
+        self.master.protocol('WM_DELETE_WINDOW', self.close)
         self.label_font = tkFont.Font(size=8, weight='bold')
 
         # Items
@@ -540,6 +562,19 @@ class Application(object):
                                                 for column in COLUMN_INDEX], key=itemgetter(1))
                                     if header[0] not in ['Description', 'Comments']]
         self.asset_list_items = []
+        self.asset_index = {}  # asset number -> index in asset_list_items
+        self.search_index = SearchIndex([COLUMN_INDEX[column] for column in SEARCHABLE])
+        self.incremental_search = IncrementalSearch(self.search_index)
+        self.columns = ColumnStore(range(len(self.asset_list_header)),
+                                   categorical=[COLUMN_INDEX['State'], COLUMN_INDEX['Storage Location']])
+        self.search_job = None
+        self.db_version = 0  # latest database change reflected in the list
+        self.sync_job = self.master.after(SYNC_INTERVAL, self.poll_changes)
+        self.worker_job = self.master.after(WORKER_POLL_INTERVAL, self.poll_worker)
+        self.load_job = None
+        self.load_pages = None  # pages of assets still to be added to the list
+        self.load_after = None  # asset number of the last asset loaded
+        self.load_total = 0
 
         # Tabs for asset list / shopping cart
         self.notebook = ttk.Notebook(self.master)
@@ -633,6 +668,16 @@ class Application(object):
         self.create_db_btn = tk.Button(self.options_frame, text='Create New Database',
                                         command=self.create_database)
         self.create_db_btn.grid(row=0, column=0, sticky='nesw', padx=15, pady=15)
+        self.import_btn = tk.Button(self.options_frame, text='Import Assets',
+                                    command=self.import_assets)
+        self.import_btn.grid(row=1, column=0, sticky='nesw', padx=15, pady=(0, 15))
+        self.export_btn = tk.Button(self.options_frame, text='Export Assets',
+                                    command=self.export_assets)
+        self.export_btn.grid(row=2, column=0, sticky='nesw', padx=15, pady=(0, 15))
+
+        self.diagnostics = DiagnosticsPanel(self.settings_frame, self.settings['record_timings'],
+                                            self.settings['slow_log'], self.save_settings)
+        self.diagnostics.grid(row=2, column=0, sticky='nesw', padx=15, pady=(0, 25))
 
         if os.path.exists(SETTINGS_PATH):
             with open(SETTINGS_PATH, 'r') as config_file:
@@ -640,9 +685,10 @@ class Application(object):
                 for setting in in_settings:
                     self.settings[setting].set(in_settings[setting])
 
-                self.update_asset_items(self.retrieve_assets(self.settings['database_path'].get()))
-                self.asset_list.filtered_items_ix = list(range(len(self.asset_list_items))) 
-                self.asset_list.repopulate_list()
+                self.diagnostics.apply()
+
+                if self.open_database(self.settings['database_path'].get()):
+                    self.load_assets()
         else:
             self.notebook.select(self.notebook.tabs()[NOTEBOOK_INDEX['Settings']])
             messagebox.showwarning(title='Missing database path', 
@@ -655,17 +701,12 @@ class Application(object):
         if not db_path:
             return
 
-        items = self.retrieve_assets(db_path)
-
-        if items is not None:
-            self.asset_list.tree.delete(*self.asset_list.tree.get_children())
-            self.update_asset_items(items)
-            self.asset_list.filtered_items_ix = list(range(len(self.asset_list.items)))
-            self.settings['database_path'].set(db_path)
-            self.save_settings()
-            self.history_msg.set('Changed default database ({})'.format(db_path))
+        if not self.open_database(db_path):
+            return
 
-        self.asset_list.repopulate_list()  
+        self.load_assets()
+        self.settings['database_path'].set(db_path)
+        self.save_settings()
 
     def create_database(self, *args):
         """
@@ -678,79 +719,279 @@ class Application(object):
 
         if path != '':
             if os.path.exists(path):
+                # The shared connection has to let go of the file before it is replaced
+                is_current = os.path.abspath(path) == os.path.abspath(self.db.path or '')
+                if is_current:
+                    self.db.close()
+                    self.worker.close()
+
                 os.remove(path)
 
+                # A new database must not pick up the journal of the old one
+                for journal in [path + '-wal', path + '-shm']:
+                    if os.path.exists(journal):
+                        os.remove(journal)
+
                 # List is empty because user overwrote old database with new empty one
+                self.cancel_load()
                 self.update_asset_items([])
-                self.asset_list.filtered_items_ix = []
-                self.asset_list.repopulate_list()
-
-            conn = sqlite3.connect(path)
-            cursor = conn.cursor()
-
-            # Make asset list
-            cursor.execute(('CREATE TABLE assets ('
-                            'asset_id INTEGER PRIMARY KEY,'
-                            'name TEXT NOT NULL,'
-                            'description TEXT,'
-                            'purchase_date TEXT,'
-                            'storage_location TEXT)'))
-
-            # Make borrow list
-            cursor.execute(('CREATE TABLE borrow_list ('
-                            'asset_id INTEGER PRIMARY KEY,'
-                            'borrower_name TEXT NOT NULL,'
-                            'borrower_email TEXT NOT NULL,'
-                            'state TEXT NOT NULL,'
-                            'date_requested TEXT NOT NULL,'
-                            'return_date TEXT NOT NULL,'
-                            'comments TEXT)'))
-
-            conn.commit()
-            conn.close()
+                self.asset_list.clear()
+            else:
+                is_current = False
+
+            if is_current:
+                self.db.open(path)
+                self.db.create_schema()
+                self.worker.open(path)
+                self.db_version = self.db.current_version()
+            else:
+                database = Database(path)
+                database.create_schema()
+                database.close()
 
             self.history_msg.set('Created database ({})'.format(path))
 
-    def _match_searchables(self, query, columns):
+    def import_assets(self, *args):
         """
-        Goes through all searchable columns and returns True if query matches at least one, else False
+        Adds the assets of a CSV or JSON file chosen by the user. The file is read and written
+        a batch at a time on the database worker, so the window stays responsive.
         """
 
-        for column in SEARCHABLE:
-            if str(columns[COLUMN_INDEX[column]]).lower().find(query.lower()) != -1:
-                return True 
+        path = filedialog.askopenfilename(filetypes=(('CSV File', '*.csv'), 
+                                                     ('JSON File', ('*.json', '*.jsonl'))),
+                                          title='Import assets')
+
+        if path:
+            self.import_btn.configure(state=tk.DISABLED)
+            self.history_msg.set('Importing assets...')
+            self._import_next_batch(read_rows(path), 1, 0, 0)
+
+    def _import_next_batch(self, rows, batch, read, imported):
+        try:
+            chunk = list(islice(rows, IMPORT_BATCH_SIZE))
+        except (IOError, ValueError, csv.Error) as ex:
+            # ValueError covers text that is not UTF-8 and lines that are not JSON
+            self._import_failed(ex, imported)
+            return
+
+        if not chunk:
+            self._import_done(imported)
+            return
+
+        def write(db):
+            start = time.time()
+            count = InventoryStore(db).import_batch(chunk, first_row=read + 1)
+            return count, time.time() - start
+
+        def written(result):
+            count, seconds = result
+            self.history_msg.set(batch_message(batch, count, seconds))
+            self._import_next_batch(rows, batch + 1, read + len(chunk), imported + count)
+
+        self.worker.submit(write, written, lambda error: self._import_failed(error, imported))
+
+    def _import_failed(self, error, imported):
+        self._import_done(imported)
+
+        if isinstance(error, sqlite3.Error):
+            error = 'Import stopped by a database error after {} assets: {}'.format(imported, error)
+
+        messagebox.showerror('Import Error', str(error))
+
+    def _import_done(self, imported):
+        self.import_btn.configure(state=tk.NORMAL)
+        self.history_msg.set('Imported {} assets'.format(imported))
+
+        # Show the new assets now rather than at the next poll
+        self.master.after_cancel(self.sync_job)
+        self.poll_changes()
+
+    def export_assets(self, *args):
+        """
+        Writes every asset to a CSV or JSON file chosen by the user, streamed from the database worker
+        """
+
+        path = filedialog.asksaveasfilename(defaultextension='.csv',
+                                            filetypes=(('CSV File', '*.csv'), 
+                                                       ('JSON File', ('*.json', '*.jsonl'))),
+                                            title='Export assets')
+
+        if path:
+            self.history_msg.set('Exporting assets...')
+            self.worker.submit(lambda db: InventoryStore(db).export_assets(path),
+                               lambda count: self.history_msg.set('Exported {} assets to {}'.format(count, path)),
+                               lambda error: messagebox.showerror('Export Error', str(error)))
+
+    def open_database(self, path):
+        """
+        Connects the application and its database worker to the database at path. Returns False,
+        with the list emptied and the Settings tab shown, if there is no inventory database there.
+        """
+
+        # Connecting to a missing file would create an empty one
+        if not os.path.isfile(path):
+            error = 'Database file not found: {}'.format(path)
+        else:
+            try:
+                self.db.open(path)
+                error = None if self.db.has_table('assets') else 'Not an inventory database: {}'.format(path)
+            except sqlite3.Error as ex:
+                error = 'Could not open {}: {}'.format(path, ex)
+
+        if error is None:
+            self.worker.open(path)
+            return True
+
+        self.db.close()
+        self.worker.close()
+        self.cancel_load()
+        self.update_asset_items([])
+        self.asset_list.clear()
+        self.notebook.select(self.notebook.tabs()[NOTEBOOK_INDEX['Settings']])
+        messagebox.showerror('Database Error', error)
         return False
 
-    def retrieve_assets(self, db_path):
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        SELECT_QUERY = ('SELECT assets.asset_id, name, state, borrower_name, ' 
-                        'borrower_email, date_requested, return_date, '
-                        'storage_location, purchase_date, description, comments ' 
-                        'from assets LEFT JOIN borrow_list '
-                        'ON assets.asset_id=borrow_list.asset_id')
-        items = []
-        today = datetime.date.today()
+    def poll_worker(self):
+        """
+        Applies the results of finished database jobs to the window
+        """
+
+        self.worker.poll()
+        self.worker_job = self.master.after(WORKER_POLL_INTERVAL, self.poll_worker)
+
+    def load_assets(self):
+        """
+        Starts reading every asset from the open database. The list is filled a page at a
+        time between events, so the first rows show right away and the window stays responsive.
+        """
+
+        self.cancel_load()
+        self.update_asset_items([])
+        self.asset_list.clear()
 
         try:
-            for item in list(cursor.execute(SELECT_QUERY)):
-                item = [value if value is not None else '---' for value in item]
-                if item[COLUMN_INDEX['State']] == '---':
-                    item[COLUMN_INDEX['State']] = 'Available'
-                elif item[COLUMN_INDEX['State']] == 'Borrowed':
-                    year, month, day = [int(d) for d in item[COLUMN_INDEX['Due Date']].split('-')]
-                    due_date = datetime.date(year=year, month=month, day=day)
-
-                    if today > due_date:
-                        item[COLUMN_INDEX['State']] = 'Overdue'
-
-                items.append(item)
+            self.db_version = self.db.current_version()
+            self.load_total = self.db.execute('SELECT COUNT(*) FROM assets').fetchone()[0]
+        except sqlite3.Error as ex:
+            # Busy or locked, try again shortly
+            print('ERROR:', str(ex))
+            self.history_msg.set('Could not load assets, retrying: {}'.format(ex))
+            self.load_job = self.master.after(SYNC_INTERVAL, self.load_assets)
+            return
+
+        self.load_after = None
+        self.load_pages = self.retrieve_assets()
+        self.load_job = self.master.after_idle(self._load_next_page)
+
+    def cancel_load(self):
+        if self.load_job is not None:
+            self.master.after_cancel(self.load_job)
+            self.load_job = None
+            self.load_pages = None
+
+    def _load_next_page(self):
+        try:
+            page = next(self.load_pages, None)
         except Exception as ex:
+            # Busy or locked, carry on from the last asset loaded in a while
             print('ERROR:', str(ex))
+            self.load_pages = self.retrieve_assets(self.load_after)
+            self.history_msg.set('Could not load every asset, retrying: {} of {} loaded ({})'.format(
+                len(self.asset_list_items), self.load_total, ex))
+            self.load_job = self.master.after(SYNC_INTERVAL, self._load_next_page)
+            return
+
+        if page is None:
+            self.load_job = None
+            self.load_pages = None
+            self.history_msg.set('Loaded {} assets'.format(len(self.asset_list_items)))
+            return
+
+        first_ix = len(self.asset_list_items)
+
+        with metrics.span('load index page', len(page)):
+            for item in page:
+                ix = len(self.asset_list_items)
+                item = AssetRecord.from_row(item)
+                self.asset_list_items.append(item)
+                self.asset_index[item.asset_number] = ix
+                self.index_item(ix)
+
+        self.load_after = item.asset_number
+
+        # The list only shows the new rows matching the current search
+        self.asset_list.add_items(range(first_ix, len(self.asset_list_items)))
+        self.history_msg.set('Loading assets... {} of {}'.format(len(self.asset_list_items), 
+                                                                 self.load_total))
+        self.load_job = self.master.after(LOAD_DELAY, self._load_next_page)
+
+    def retrieve_assets(self, after=None):
+        """
+        Yields every asset in the database a page at a time, or those numbered above after
+        """
+
+        return self.store.asset_pages(ASSET_QUERY, size=LOAD_PAGE_SIZE, after=after)
+
+    def _read_assets(self, asset_ids):
+        """
+        Reads the assets with the given asset numbers
+        """
+
+        return [AssetRecord.from_row(item) for item in self.store.read_assets(asset_ids, ASSET_QUERY)]
+
+    def poll_changes(self):
+        """
+        Periodically picks up the changes other applications made to the database
+        """
+
+        # Changes made during a load are picked up once it finishes
+        if self.db.conn is not None and self.load_job is None:
+            try:
+                with metrics.span('sync changes'):
+                    self.sync_changes()
+            except sqlite3.Error as ex:
+                # Busy or locked, try again next time
+                print('ERROR:', str(ex))
+
+        self.sync_job = self.master.after(SYNC_INTERVAL, self.poll_changes)
+
+    def sync_changes(self):
+        """
+        Patches the list with only the assets changed since the last version seen, instead of reloading every asset
+        """
+
+        version, asset_ids = self.db.changes_since(self.db_version)
+
+        if not asset_ids:
+            return
+
+        changed = dict((item.asset_number, item) 
+                       for item in self._read_assets(asset_ids))
+        new_items = []
+
+        for asset_id in asset_ids:
+            ix = self.asset_index.get(asset_id)
+            item = changed.get(asset_id)
+
+            if item is None:
+                # Deleted
+                if ix is not None:
+                    del self.asset_index[asset_id]
+                    self.unindex_item(ix)
+                    self.asset_list.remove_item(ix)
+            elif ix is None:
+                new_items.append(item)
+            elif item != self.asset_list_items[ix]:
+                old_values = self.asset_list_items[ix]
+                self.asset_list_items[ix] = item
+                self.index_item(ix)
+                self.asset_list.refresh_item(ix, old_values)
+
+        if new_items:
+            self.add_asset_items(new_items)
+
+        self.db_version = version
 
-        conn.close()
-        return items
-        
     def search_clear(self, *args):
         """
         Clears the search bar if the search hint is present
@@ -760,24 +1001,122 @@ class Application(object):
             self.search_query.set('')
  
     def search(self, *args):
+        """
+        Schedules a search so that a burst of keystrokes only filters the list once
+        """
+
+        if self.search_job is not None:
+            self.master.after_cancel(self.search_job)
+
+        self.search_job = self.master.after(SEARCH_DELAY, self.run_search)
+
+    def run_search(self):
         """
         Filters the indexes of the asset list that matches the search query, then refreshes the list view
         """
 
+        self.search_job = None
         query = self.search_bar.get() 
-        if len(query) > 0 and query != SEARCH_HINT:
-            self.asset_list.filtered_items_ix = [index for index in range(len(self.asset_list.items))
-                                                    if self._match_searchables(query, self.asset_list.items[index])]
+        if query == SEARCH_HINT:
+            query = ''
+
+        # Rows added later are filtered by the same query, the current sort is kept
+        with metrics.span('search') as span:
+            self.asset_list.set_filter(lambda ixs: self.filter_assets(query, ixs), self.filter_assets(query),
+                                       ranked=True)
+            span.rows = len(self.asset_list.filtered_items_ix)
+
+    def filter_assets(self, query, ixs=None):
+        """
+        Returns the indexes of the assets matching a search query, field:value terms filter a single column.
+        Full text matches come first, best first (see search_text), then the other matches in list order.
+        Only the indexes in ixs are checked when given, otherwise every asset.
+        """
+
+        text, terms = split_fields(query, FILTER_FIELDS)
+
+        if ixs is None:
+            ranked = self.search_text(text)
+            ixs = self.incremental_search.search(text)
         else:
-            self.asset_list.filtered_items_ix = list(range(len(self.asset_list.items)))
+            ranked = self.search_text(text, ixs)
+            ixs = [ix for ix in ixs if self.search_index.matches(ix, text.lower())]
+
+        if ranked:
+            found = set(ranked)
+            ixs = ranked + [ix for ix in ixs if ix not in found]
+
+        return self.columns.filter(ixs, terms)
+
+    def search_text(self, text, ixs=None):
+        """
+        Returns the indexes of the RANKED_MATCHES assets whose name, description or comments best
+        match the words or "quoted phrases" of text, as whole words or word prefixes, best first.
+        Only the indexes in ixs are checked when given, otherwise every asset. Searches shorter
+        than MIN_RANKED_SEARCH match too many assets to be worth ranking and return none.
+        """
+
+        if self.db.conn is None or len(text.strip()) < MIN_RANKED_SEARCH:
+            return []
+
+        asset_ids = None if ixs is None else [self.asset_list_items[ix].asset_number for ix in ixs]
+
+        try:
+            asset_ids = self.store.search_text(text, asset_ids, RANKED_MATCHES)
+        except sqlite3.Error as ex:
+            # Busy or locked, the in memory matches still stand
+            print('ERROR:', str(ex))
+            return []
+
+        return [self.asset_index[asset_id] for asset_id in asset_ids if asset_id in self.asset_index]
+
+    def index_item(self, ix):
+        """
+        Brings the search index and column store up to date with asset_list_items[ix]
+        """
 
-        self.asset_list.repopulate_list()
+        self.search_index.update(ix, self.asset_list_items[ix])
+        self.columns.update(ix, self.asset_list_items[ix])
+
+    def unindex_item(self, ix):
+        """
+        Drops asset_list_items[ix] from searches and filters
+        """
+
+        self.search_index.remove(ix)
+        self.columns.remove(ix)
 
     def update_asset_items(self, items):
         del self.asset_list_items[:]
         for item in items:
             self.asset_list_items.append(item)
 
+        self.asset_index = dict((item.asset_number, ix)
+                                for ix, item in enumerate(self.asset_list_items))
+        self.search_index.build(self.asset_list_items)
+        self.columns.build(self.asset_list_items)
+        self.asset_list.reset_widths()
+
+    def add_asset_items(self, items):
+        """
+        Appends newly added assets to the list without reloading the database.
+        Assets already listed, e.g. by a sync that ran before the add's callback, are left as they are.
+        """
+
+        first_ix = len(self.asset_list_items)
+
+        for item in items:
+            if item.asset_number in self.asset_index:
+                continue
+
+            ix = len(self.asset_list_items)
+            self.asset_list_items.append(item)
+            self.asset_index[item.asset_number] = ix
+            self.index_item(ix)
+
+        # Only the new rows matching the current search are shown
+        self.asset_list.add_items(range(first_ix, len(self.asset_list_items)))
+
     def update_description(self, tree):
         item = None
 
@@ -798,6 +1137,18 @@ class Application(object):
             self.item_msg.insert(tk.END, description)
             self.item_msg.configure(state=tk.DISABLED)
 
+    def close(self, *args):
+        """
+        Closes the database connection, then the application window
+        """
+
+        self.master.after_cancel(self.sync_job)
+        self.master.after_cancel(self.worker_job)
+        self.cancel_load()
+        self.worker.stop()
+        self.db.close()
+        self.master.destroy()
+
     def save_settings(self, *args):
         new_settings = {setting: self.settings[setting].get() 
                         for setting in self.settings}
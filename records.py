@@ -0,0 +1,66 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from collections import namedtuple
+
+from database import NO_VALUE
+
+_interned = {}
+
+
+def intern_value(value):
+    """
+    Returns the one shared copy of values equal to value, so repeated strings are only stored once
+    """
+
+    return _interned.setdefault(value, value)
+
+
+def field_name(column):
+    """
+    Returns the record field of a list column, 'Asset Number' -> 'asset_number'
+    """
+
+    return column.lower().replace(' ', '_')
+
+
+def record_type(name, columns, interned=()):
+    """
+    Makes the record type for the rows of an asset list.
+
+    Records are immutable tuples without a per-instance __dict__, so they take
+    less memory than lists and can be indexed by COLUMN_INDEX where a row used
+    to be a list. The values of the interned columns, and every --- placeholder,
+    share a single copy across all records.
+    """
+
+    interned_positions = [columns.index(column) for column in interned]
+    interned_fields = set(field_name(column) for column in interned)
+
+    class AssetRecord(namedtuple(str(name), [str(field_name(column)) for column in columns])):
+        __slots__ = ()
+
+        @classmethod
+        def from_row(cls, row):
+            """
+            Makes a record from a database row or the values of a tree item
+            """
+
+            values = [NO_VALUE if value == NO_VALUE else value for value in row]
+            for position in interned_positions:
+                values[position] = intern_value(values[position])
+
+            return tuple.__new__(cls, values)
+
+        def replace(self, **changes):
+            """
+            Returns a copy of the record with the given fields changed
+            """
+
+            for field in changes:
+                if field in interned_fields:
+                    changes[field] = intern_value(changes[field])
+
+            return self._replace(**changes)
+
+    AssetRecord.__name__ = str(name)
+    return AssetRecord
@@ -0,0 +1,171 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from array import array
+from collections import OrderedDict
+
+NGRAM_SIZE = 3
+SEPARATOR = '\n'  # Joins the searchable columns of a row, never part of a query
+
+
+class SearchIndex(object):
+    """
+    In-memory trigram index over the searchable columns of the asset list.
+
+    Rows are identified by their index in the asset list. Each row keeps its
+    searchable text pre-lowercased, and every trigram maps to the rows that
+    contain it, so a query only has to verify the rows sharing its rarest
+    trigrams instead of scanning every row and column.
+    """
+
+    def __init__(self, columns):
+        self.columns = columns  # positions of the searchable values in a row
+        self.texts = []  # lowercased searchable text per row, None if removed
+        self.postings = {}  # trigram -> array of row indexes
+        self.version = 0  # bumped on every change so cached results can be dropped
+
+    def build(self, items):
+        """
+        Rebuilds the index from scratch for the given rows
+        """
+
+        self.texts = []
+        self.postings = {}
+        self.version += 1
+
+        for ix, values in enumerate(items):
+            self.add(ix, values)
+
+    def add(self, ix, values):
+        """
+        Indexes a new row, or re-indexes a row that was removed
+        """
+
+        if ix < len(self.texts) and self.texts[ix] is not None:
+            self.remove(ix)
+
+        while len(self.texts) <= ix:
+            self.texts.append(None)
+
+        self.version += 1
+        text = SEPARATOR.join(str(values[column]).lower() for column in self.columns)
+        self.texts[ix] = text
+
+        for gram in self._ngrams(text):
+            posting = self.postings.get(gram)
+            if posting is None:
+                self.postings[gram] = array(str('i'), [ix])
+            else:
+                posting.append(ix)
+
+    def remove(self, ix):
+        """
+        Drops a row from the index, it will no longer show up in any search
+        """
+
+        if ix >= len(self.texts) or self.texts[ix] is None:
+            return
+
+        for gram in self._ngrams(self.texts[ix]):
+            posting = self.postings[gram]
+            posting.remove(ix)
+            if not posting:
+                del self.postings[gram]
+
+        self.texts[ix] = None
+        self.version += 1
+
+    def update(self, ix, values):
+        """
+        Re-indexes a row whose values were edited
+        """
+
+        self.add(ix, values)
+
+    def matches(self, ix, query):
+        """
+        Returns True if the row contains the (lowercased) query, else False
+        """
+
+        text = self.texts[ix] if ix < len(self.texts) else None
+        return text is not None and query in text
+
+    def search(self, query):
+        """
+        Returns the sorted indexes of the rows matching the query in at least one searchable column
+        """
+
+        query = query.lower()
+
+        if not query:
+            return [ix for ix, text in enumerate(self.texts) if text is not None]
+
+        if len(query) < NGRAM_SIZE:
+            return [ix for ix, text in enumerate(self.texts)
+                    if text is not None and query in text]
+
+        postings = []
+        for gram in self._ngrams(query):
+            posting = self.postings.get(gram)
+            if posting is None:
+                return []
+            postings.append(posting)
+
+        # Intersect the two rarest trigrams, the substring check does the rest
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        if len(postings) > 1:
+            candidates.intersection_update(postings[1])
+
+        return sorted(ix for ix in candidates if query in self.texts[ix])
+
+    def _ngrams(self, text):
+        return set(text[i:i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)
+                   if SEPARATOR not in text[i:i + NGRAM_SIZE])
+
+
+class IncrementalSearch(object):
+    """
+    Runs queries against a SearchIndex while remembering recent results.
+
+    A query that contains a previous query can only match rows the previous
+    query matched, so it is answered by filtering that smaller result instead
+    of going back to the index. Recent results are kept in a small LRU so
+    backspacing over a query is instant. The cache is dropped whenever the
+    index changes.
+    """
+
+    def __init__(self, index, cache_size=16):
+        self.index = index
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # lowercased query -> sorted row indexes
+        self.version = index.version
+
+    def search(self, query):
+        """
+        Returns the sorted indexes of the rows matching the query
+        """
+
+        query = query.lower()
+
+        if self.version != self.index.version:
+            self.cache.clear()
+            self.version = self.index.version
+
+        result = self.cache.pop(query, None)
+
+        if result is None:
+            base = None
+            for cached_query, cached_result in self.cache.items():
+                if cached_query and cached_query in query and (base is None or len(cached_result) < len(base)):
+                    base = cached_result
+
+            if base is None:
+                result = self.index.search(query)
+            else:
+                result = [ix for ix in base if self.index.matches(ix, query)]
+
+        self.cache[query] = result
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return list(result)
@@ -0,0 +1,168 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from bisect import bisect_left
+import re
+
+from database import NO_VALUE
+
+DATE = re.compile(r'^(\d{4})-(\d{1,2})-(\d{1,2})$')
+NUMBER = re.compile(r'^-?\d+(\.\d+)?$')
+
+# Kinds of values, in the order they sort
+NUMBER_KEY = 0
+DATE_KEY = 1
+TEXT_KEY = 2
+
+INSERT_RATIO = 32  # merge by bisection when the sorted list is this many times longer than the new rows
+
+
+def sort_key(value):
+    """
+    Returns a key that orders numbers numerically, YYYY-MM-DD dates by date and other text
+    case insensitively. Placeholders are not given a key, the SortEngine puts them last.
+    """
+
+    if isinstance(value, (int, float)):
+        return NUMBER_KEY, value
+
+    text = str(value).strip()
+
+    if NUMBER.match(text):
+        return NUMBER_KEY, float(text)
+
+    match = DATE.match(text)
+    if match:
+        return DATE_KEY, tuple(int(part) for part in match.groups())
+
+    return TEXT_KEY, text.lower()
+
+
+def is_placeholder(value):
+    return value is None or value == NO_VALUE or value == ''
+
+
+class SortEngine(object):
+    """
+    Sorts row indexes by one or more columns of the rows they index.
+
+    The first time a column is sorted on, every row is ranked by the typed
+    sort_key of its value in that column, so later sorts, of any subset of
+    rows, in either direction and in combination with other columns, only
+    compare integers. Rows whose value is a placeholder go last whatever the
+    direction. The rankings must be dropped with invalidate() whenever a row
+    is edited or added.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self.ranks = {}  # column position -> rank of every row, None for placeholders
+
+    def invalidate(self):
+        self.ranks = {}
+
+    def column_ranks(self, position):
+        """
+        Returns the rank of every row in a column, equal values share a rank
+        """
+
+        ranks = self.ranks.get(position)
+
+        if ranks is None or len(ranks) != len(self.items):
+            values = [self.items[ix][position] for ix in range(len(self.items))]
+            keyed = [(sort_key(value), ix) for ix, value in enumerate(values)
+                     if not is_placeholder(value)]
+            keyed.sort()
+
+            ranks = [None] * len(values)
+            rank = -1
+            previous = None
+            for key, ix in keyed:
+                if key != previous:
+                    rank += 1
+                    previous = key
+                ranks[ix] = rank
+
+            self.ranks[position] = ranks
+
+        return ranks
+
+    def key(self, columns):
+        """
+        Returns the key a row index sorts by for a list of (column position, descending) pairs,
+        rows that tie on every column are ordered by their index
+        """
+
+        ranks = [(self.column_ranks(position), descending) for position, descending in columns]
+
+        def key(ix):
+            parts = []
+            for column, descending in ranks:
+                rank = column[ix]
+                if rank is None:
+                    parts.append((1, 0))
+                else:
+                    parts.append((0, -rank if descending else rank))
+            parts.append(ix)
+            return parts
+
+        return key
+
+    def sort(self, ixs, columns):
+        """
+        Returns ixs sorted by a list of (column position, descending) pairs, most significant first.
+        Rows that tie are kept in index order, so the result only depends on the rows and the columns.
+        """
+
+        columns = list(columns)
+        if not columns:
+            return sorted(ixs)
+
+        if len(columns) == 1:
+            # Most sorts are on a single column, skip building keys
+            column = self.column_ranks(columns[0][0])
+            present = sorted(ix for ix in ixs if column[ix] is not None)
+            missing = sorted(ix for ix in ixs if column[ix] is None)
+            present.sort(key=column.__getitem__, reverse=columns[0][1])
+            return present + missing
+
+        return sorted(ixs, key=self.key(columns))
+
+    def merge(self, ixs, new, columns):
+        """
+        Returns ixs with the rows of new merged in, both already sorted by columns
+        """
+
+        if not new:
+            return list(ixs)
+
+        key = self.key(columns)
+
+        if len(new) * INSERT_RATIO < len(ixs):
+            # A few rows, find their places by bisection instead of keying the whole list
+            merged = list(ixs)
+            keys = _Keys(merged, key)
+            position = 0
+            for ix in new:
+                position = bisect_left(keys, key(ix), position)
+                merged.insert(position, ix)
+                position += 1
+            return merged
+
+        # The sort finds the two sorted runs and merges them in linear time
+        return sorted(list(ixs) + list(new), key=key)
+
+
+class _Keys(object):
+    """
+    Sequence of the sort keys of a list, computed as bisection looks at them
+    """
+
+    def __init__(self, ixs, key):
+        self.ixs = ixs
+        self.key = key
+
+    def __len__(self):
+        return len(self.ixs)
+
+    def __getitem__(self, position):
+        return self.key(self.ixs[position])
@@ -0,0 +1,805 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import argparse
+import csv
+import datetime
+import errno
+import io
+from itertools import islice
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+
+from database import Database, NO_VALUE, STATE_COLUMN, display_column
+from instrumentation import metrics
+
+if sys.version_info.major == 2:
+    # csv only reads and writes bytes on Python 2, files are UTF-8
+    def open_rows(path, mode):
+        return io.open(path, mode + 'b')
+
+    def encode_value(value):
+        return value.encode('utf-8') if isinstance(value, type('')) else value
+
+    def decode_row(row):
+        return dict((key if key is None else key.decode('utf-8'),
+                     value.decode('utf-8') if isinstance(value, bytes) else value)
+                    for key, value in row.items())
+else:
+    def open_rows(path, mode):
+        return io.open(path, mode, newline='', encoding='utf-8')
+
+    def encode_value(value):
+        return value
+
+    def decode_row(row):
+        return row
+
+# Columns of an asset with its borrower, in the order the manager lists them
+ASSET_COLUMNS = ['asset_id', 'name', 'state', 'borrower_name', 'borrower_email', 'date_requested',
+                 'return_date', 'storage_location', 'purchase_date', 'description', 'comments']
+ASSET_TABLE_COLUMNS = ['asset_id', 'name', 'description', 'purchase_date', 'storage_location']
+BORROW_STATES = ['Requested', 'Borrowed']  # kept in borrow_list, assets without a row are available
+BORROW_DAYS = 30  # loan period of a checkout, and the default due date extension
+ASSET_RANGE = re.compile(r'^\s*(\d+)\s*(?:-\s*(\d+)\s*)?$')  # 1000 or 1000-1999
+MAX_BULK_ASSETS = 100000  # most asset numbers the add window takes at once
+IMPORT_BATCH_SIZE = 5000  # imported rows written per transaction
+TEXT_TERM = re.compile(r'"([^"]*)"?|(\S+)')  # a "quoted phrase" or a word of a text search
+TEXT_RANK = 'bm25(asset_text, 4.0, 1.0, 1.0)'  # lower is better, a match in the name counts most
+WHOLE_VALUE_COLUMNS = ['state', 'storage_location']  # filtered on their whole value, not a substring
+RANGE = '..'  # due:2017-01-01..2017-02-01, either end may be left out
+ROW_VALUES = sqlite3.sqlite_version_info >= (3, 15, 0)  # comparisons such as (a, b) > (?, ?)
+
+# Items of a checkout that someone else has already requested, with their borrower
+CONFLICT_QUERY = ('SELECT borrow_list.asset_id, name, ' + STATE_COLUMN + ', '
+                  'borrower_name, borrower_email, return_date, '
+                  + display_column('comments') + ' FROM borrow_list '
+                  'LEFT JOIN assets ON assets.asset_id=borrow_list.asset_id '
+                  'WHERE borrow_list.asset_id IN ({})')
+
+
+def column_expression(column, display=True):
+    """
+    Returns the SQL expression of one of the ASSET_COLUMNS of an asset joined with its borrower.
+    The state is worked out and, for display, missing values show as --- rather than NULL.
+    """
+
+    if column == 'state':
+        return STATE_COLUMN
+
+    column = '{}.{}'.format('assets' if column in ASSET_TABLE_COLUMNS else 'borrow_list', column)
+    return display_column(column) if display and column not in ['assets.asset_id', 'assets.name'] else column
+
+
+def asset_query(columns, display=True):
+    """
+    Returns the query of every asset with its borrower, selecting the given ASSET_COLUMNS
+    """
+
+    return ('SELECT ' + ', '.join(column_expression(column, display) for column in columns) + ' '
+            'FROM assets LEFT JOIN borrow_list '
+            'ON assets.asset_id=borrow_list.asset_id')
+
+
+ASSET_QUERY = asset_query(ASSET_COLUMNS)
+EXPORT_QUERY = asset_query(ASSET_COLUMNS, display=False)
+
+
+def format_date(date):
+    return '{}-{:02}-{:02}'.format(date.year, date.month, date.day)
+
+
+def parse_date(text):
+    """
+    Returns the date of a YYYY-MM-DD string, the month and day may have a single digit
+    """
+
+    year, month, day = [int(part) for part in text.split('-')]
+    return datetime.date(year=year, month=month, day=day)
+
+
+def parse_asset_numbers(text, limit=MAX_BULK_ASSETS):
+    """
+    Splits a list of asset numbers by , and expands ranges such as 1000-1999.
+    Raises ValueError for anything else or for more than limit numbers (None for no limit).
+    """
+
+    asset_numbers = []
+
+    for entry in text.split(','):
+        match = ASSET_RANGE.match(entry)
+        if match is None:
+            raise ValueError('Invalid asset number: {}'.format(entry.strip()))
+
+        first = int(match.group(1))
+        last = int(match.group(2)) if match.group(2) else first
+        if last < first:
+            raise ValueError('Invalid asset number range: {}'.format(entry.strip()))
+
+        asset_numbers.extend(range(first, last + 1))
+        if limit is not None and len(asset_numbers) > limit:
+            raise ValueError('Cannot add more than {} items at once'.format(limit))
+
+    return asset_numbers
+
+
+def file_format(path):
+    """
+    Returns the format of an import or export file from its extension, 'json' or 'csv'
+    """
+
+    return 'json' if os.path.splitext(path)[1].lower() in ['.json', '.jsonl'] else 'csv'
+
+
+def read_rows(path, format=None):
+    """
+    Yields the rows of a CSV file with a header line, or of a JSON file of one object per
+    line, as dicts keyed by column, reading a single row at a time
+    """
+
+    format = format or file_format(path)
+
+    with open_rows(path, 'r') as rows:
+        if format == 'csv':
+            for row in csv.DictReader(rows):
+                yield decode_row(row)
+        else:
+            for line in rows:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def import_values(row):
+    """
+    Returns the assets and borrow_list values of an imported row, keyed by ASSET_COLUMNS. The
+    borrow_list values are None for an available asset. Raises ValueError for an incomplete row.
+    """
+
+    def value(column):
+        value = row.get(column)
+        if value is None:
+            return None
+
+        value = '{}'.format(value).strip()
+        return None if value in ['', NO_VALUE] else value
+
+    asset_id = value('asset_id')
+    if asset_id is None or not asset_id.isdigit():
+        raise ValueError('Invalid asset number: {}'.format(asset_id))
+
+    asset = [int(asset_id), value('name'), value('description'), value('purchase_date'),
+             value('storage_location')]
+    if asset[1] is None or asset[4] is None:
+        raise ValueError('Asset {} needs a name and a storage location'.format(asset_id))
+
+    state = value('state')
+    if state in [None, 'Available']:
+        return asset, None
+    elif state == 'Overdue':
+        state = 'Borrowed'
+    elif state not in BORROW_STATES:
+        raise ValueError('Invalid state of asset {}: {}'.format(asset_id, state))
+
+    borrow = [int(asset_id), value('borrower_name'), value('borrower_email'), state,
+              value('date_requested'), value('return_date'), value('comments')]
+    if None in borrow[:6]:
+        raise ValueError('Asset {} is {} but its borrower or dates are missing'.format(asset_id, state))
+
+    return asset, borrow
+
+
+def text_query(text):
+    """
+    Returns the asset_text MATCH expression of a search, None if it has no words.
+    Every word has to appear, as the start of a word, and a "quoted phrase" has to appear as is.
+    """
+
+    terms = []
+
+    for phrase, word in TEXT_TERM.findall(text):
+        term = phrase or word
+
+        # Punctuation alone would make an empty phrase
+        if re.search(r'\w', term, re.UNICODE):
+            terms.append('"{}"{}'.format(term.replace('"', '""'), '' if phrase else '*'))
+
+    return ' '.join(terms) or None
+
+
+def batch_message(batch, count, seconds):
+    return 'Batch {}: {} assets in {:.2f} s ({:.0f} assets/s)'.format(batch, count, seconds,
+                                                                      count / max(seconds, 1e-6))
+
+
+class AssetSearch(object):
+    """
+    A search of the asset list that the database runs, reading one page of the result at a time,
+    for lists too long to hold in memory.
+
+    columns are the ASSET_COLUMNS of the list in order and must include asset_id. text is
+    searched for in the full text index (see text_query) and, as the in-memory search of the
+    asset list does, as a substring of the columns at the searchable positions, ignoring case.
+    terms are (column position, value) filters matched like ColumnStore.match: whole values
+    of WHOLE_VALUE_COLUMNS, 'low..high' ranges or substrings, ignoring case. Pages come sorted
+    by (column position, descending) pairs with --- placeholders last, as SortEngine has them,
+    ties and unsorted lists go by asset number, or full text matches first, best first, for a
+    text search. For a database without a full text index (see Database.text_index) text_index
+    is False and the text is only looked for in the searchable columns.
+
+    A page is read with OFFSET, which has the database step over every row before it, or
+    given the key of the last row of the page before, straight from that row (keyset paging).
+    """
+
+    def __init__(self, columns, text='', terms=(), searchable=(), text_index=True):
+        self.columns = list(columns)
+        self.expressions = [column_expression(column) for column in self.columns]
+        self.id_position = self.columns.index('asset_id')
+        self.match = text_query(text) if text_index else None
+
+        conditions = []
+        self.parameters = []
+        self.tables = 'assets'
+        matches = []
+
+        if self.match is not None:
+            self.tables += (' LEFT JOIN (SELECT rowid, {} AS rank FROM asset_text WHERE asset_text MATCH ?) '
+                            'AS matched ON assets.asset_id=matched.rowid').format(TEXT_RANK)
+            self.parameters.append(self.match)
+            matches.append('matched.rowid IS NOT NULL')
+
+        if text:
+            for position in searchable:
+                matches.append('INSTR(LOWER({}), ?) > 0'.format(self.expressions[position]))
+                self.parameters.append(text.lower())
+
+        if matches:
+            conditions.append('(' + ' OR '.join(matches) + ')')
+
+        self.tables += ' LEFT JOIN borrow_list ON assets.asset_id=borrow_list.asset_id'
+
+        for position, value in terms:
+            expression = self.expressions[position]
+            value = value.lower()
+
+            if self.columns[position] in WHOLE_VALUE_COLUMNS:
+                conditions.append('LOWER({}) = ?'.format(expression))
+                self.parameters.append(value)
+            elif RANGE in value:
+                low, high = value.split(RANGE, 1)
+                conditions.append("{} <> '{}'".format(expression, NO_VALUE))
+                if low:
+                    conditions.append('LOWER({}) >= ?'.format(expression))
+                    self.parameters.append(low)
+                if high:
+                    conditions.append('LOWER({}) <= ?'.format(expression))
+                    self.parameters.append(high)
+            else:
+                conditions.append('INSTR(LOWER({}), ?) > 0'.format(expression))
+                self.parameters.append(value)
+
+        self.conditions = conditions
+
+    def count(self, db):
+        """
+        Returns the number of assets matching the search
+        """
+
+        query = 'SELECT COUNT(*) FROM ' + self.tables
+        if self.conditions:
+            query += ' WHERE ' + ' AND '.join(self.conditions)
+
+        return db.execute(query, self.parameters).fetchone()[0]
+
+    def page(self, db, offset, size, sort_columns=(), after=None):
+        """
+        Returns up to size matching rows from offset in sort order, and the key of the last one.
+        Given the key of the row before offset as after, the page is read from that row instead.
+        """
+
+        sort_columns = [(position, descending) for position, descending in sort_columns
+                        if position != self.id_position]
+        conditions = list(self.conditions)
+        parameters = list(self.parameters)
+
+        if sort_columns or self.match is None:
+            # (expression, descending) pairs and the (column position, placeholder flag) of each in the key
+            order = []
+            key_positions = []
+
+            for position, descending in sort_columns:
+                column = self.columns[position]
+                if self.expressions[position] != column_expression(column, display=False):
+                    # Placeholders go last whichever way the column is sorted
+                    order.append(("{} = '{}'".format(self.expressions[position], NO_VALUE), False))
+                    key_positions.append((position, True))
+
+                order.append((self.expressions[position], descending))
+                key_positions.append((position, False))
+
+            # Ties go the same way as the first column so a single column sort can page along its index
+            order.append((self.expressions[self.id_position], sort_columns[0][1] if sort_columns else False))
+            key_positions.append((self.id_position, False))
+        else:
+            order = [('matched.rank IS NULL', False), ('matched.rank', False),
+                     (self.expressions[self.id_position], False)]
+            key_positions = None  # the rank is not one of the columns, pages are read by offset
+
+        if (after is not None and key_positions is not None and ROW_VALUES
+                and len(set(descending for expression, descending in order)) == 1):
+            # Rows past the key: (a, b) > (?, ?), which the database can look up in an index
+            conditions.append('({}) {} ({})'.format(', '.join(expression for expression, descending in order),
+                                                    '<' if order[0][1] else '>', ','.join('?' * len(order))))
+            parameters.extend(after)
+            offset = 0
+        elif after is not None and key_positions is not None:
+            # Columns sorted both ways: (a > ?) OR (a = ? AND b < ?) OR ... with < for descending columns
+            past = []
+            for length in range(len(order)):
+                past.append('(' + ' AND '.join(['{} = ?'.format(expression) for expression, descending
+                                                 in order[:length]]
+                                                + ['{} {} ?'.format(order[length][0],
+                                                                    '<' if order[length][1] else '>')]) + ')')
+                parameters.extend(after[:length + 1])
+
+            conditions.append('(' + ' OR '.join(past) + ')')
+            offset = 0
+
+        query = 'SELECT ' + ', '.join(self.expressions) + ' FROM ' + self.tables
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+        query += ' ORDER BY ' + ', '.join(expression + (' DESC' if descending else '')
+                                          for expression, descending in order)
+        query += ' LIMIT ? OFFSET ?'
+
+        rows = db.execute(query, parameters + [size, offset]).fetchall()
+
+        if not rows or key_positions is None:
+            return rows, None
+
+        return rows, tuple(int(rows[-1][position] == NO_VALUE) if placeholder else rows[-1][position]
+                           for position, placeholder in key_positions)
+
+
+class InventoryStore(object):
+    """
+    The inventory's data and operations, with no user interface.
+
+    Works on an open Database. Each write is one transaction that takes the
+    write lock up front, and takes a list of asset numbers so that changing
+    thousands of assets costs a single transaction. The applications call
+    the same methods, the manager from its database worker.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    @classmethod
+    def open(cls, path):
+        return cls(Database(path))
+
+    def close(self):
+        self.db.close()
+
+    def asset_pages(self, query=ASSET_QUERY, size=1000, after=None):
+        """
+        Yields every asset by asset number a page of up to size rows at a time, only those
+        numbered above after if given, so a read that failed part way can carry on
+        """
+
+        if after is None:
+            return self.db.fetch_pages(query + ' ORDER BY assets.asset_id', size=size)
+
+        return self.db.fetch_pages(query + ' WHERE assets.asset_id > ? ORDER BY assets.asset_id', [after], size)
+
+    def read_assets(self, asset_ids, query=ASSET_QUERY):
+        """
+        Yields the assets with the given asset numbers, missing ones are left out
+        """
+
+        return self.db.select_in(query + ' WHERE assets.asset_id IN ({})', asset_ids)
+
+    def search_text(self, text, asset_ids=None, limit=None):
+        """
+        Returns the numbers of the assets whose name, description or comments match a search
+        (see text_query), best match first, only the first limit of them if given. Only the
+        given asset numbers are searched if any.
+        """
+
+        match = text_query(text)
+        if match is None or not self.db.text_index:
+            return []
+
+        query = 'SELECT rowid, {} AS rank FROM asset_text WHERE asset_text MATCH ?'.format(TEXT_RANK)
+        order = ' ORDER BY rank, rowid' + ('' if limit is None else ' LIMIT {:d}'.format(limit))
+
+        if asset_ids is None:
+            ranked = self.db.execute(query + order, [match]).fetchall()
+        else:
+            # The numbers are looked up in chunks, each ranked on its own, so the chunks are merged by rank
+            ranked = sorted(self.db.select_in(query + ' AND rowid IN ({})' + order, asset_ids, [match]),
+                            key=lambda row: (row[1], row[0]))[:limit]
+
+        return [asset_id for asset_id, rank in ranked]
+
+    def find_assets(self, state=None, location=None, borrower=None, due_before=None, text=None,
+                    query=ASSET_QUERY, size=1000):
+        """
+        Yields the assets matching every filter given a page at a time, by asset number.
+        borrower matches part of a borrower's name or email, due_before is a YYYY-MM-DD date
+        and text is searched for in the name, description and comments (see text_query).
+        """
+
+        conditions = []
+        parameters = []
+
+        if text is not None and self.db.text_index:
+            conditions.append('assets.asset_id IN (SELECT rowid FROM asset_text WHERE asset_text MATCH ?)')
+            parameters.append(text_query(text) or '""')
+        elif text is not None:
+            # No full text index, each word or "quoted phrase" has to be part of one of them
+            terms = [phrase or word for phrase, word in TEXT_TERM.findall(text)] or ['']
+            for term in terms:
+                conditions.append("INSTR(LOWER(assets.name || ' ' || IFNULL(assets.description, '') || ' ' "
+                                  "|| IFNULL(borrow_list.comments, '')), ?) > 0")
+                parameters.append(term.lower())
+
+        if state is not None:
+            conditions.append(STATE_COLUMN + ' = ?')
+            parameters.append(state)
+        if location is not None:
+            conditions.append('storage_location = ?')
+            parameters.append(location)
+        if borrower is not None:
+            conditions.append('(borrower_name LIKE ? OR borrower_email LIKE ?)')
+            parameters.extend(['%{}%'.format(borrower)] * 2)
+        if due_before is not None:
+            conditions.append('return_date < ?')
+            parameters.append(due_before)
+
+        if conditions:
+            query += ' WHERE ' + ' AND '.join(conditions)
+
+        return self.db.fetch_pages(query + ' ORDER BY assets.asset_id', parameters, size)
+
+    def add_assets(self, asset_ids, row, replace=None):
+        """
+        Inserts an asset for each asset number with the values of row (name, description,
+        purchase date, storage location), or renumbers and updates the asset replace. Returns
+        the asset numbers that are already taken, in which case nothing is written.
+        """
+
+        with self.db.transaction(immediate=True):
+            if asset_ids != [replace]:
+                # Primary key lookups of only the numbers asked for, however far apart they are
+                taken = sorted(asset_id for (asset_id,) in self.db.select_in(
+                    'SELECT asset_id FROM assets WHERE asset_id IN ({})', asset_ids))
+
+                if taken:
+                    return taken
+
+            if replace is not None:
+                self.db.execute('DELETE FROM assets WHERE asset_id=?', [replace])
+                self.db.execute('UPDATE borrow_list SET asset_id = ? WHERE asset_id = ?',
+                                [asset_ids[0], replace])
+
+            self.db.executemany('INSERT INTO assets VALUES (?,?,?,?,?)',
+                                ([asset_id] + list(row) for asset_id in asset_ids))
+
+        return []
+
+    def delete_assets(self, asset_ids):
+        """
+        Deletes assets, returns how many there were
+        """
+
+        with self.db.transaction(immediate=True):
+            return self.db.executemany('DELETE FROM assets WHERE asset_id=?',
+                                       ([asset_id] for asset_id in asset_ids)).rowcount
+
+    def set_state(self, asset_ids, state):
+        """
+        Changes the state of borrowed or requested assets, returns how many changed.
+        Assets made available in the meantime have no borrow_list row and are left out.
+        """
+
+        if state not in BORROW_STATES:
+            raise ValueError('Invalid state: {}'.format(state))
+
+        with self.db.transaction(immediate=True):
+            count = self.db.executemany('UPDATE borrow_list SET state = ? WHERE asset_id=?',
+                                        ([state, asset_id] for asset_id in asset_ids)).rowcount
+
+        metrics.count('state change conflicts', len(asset_ids) - count)
+        return count
+
+    def make_available(self, asset_ids):
+        """
+        Clears the borrowers of assets, returns how many had one
+        """
+
+        with self.db.transaction(immediate=True):
+            count = self.db.executemany('DELETE FROM borrow_list WHERE asset_id=?',
+                                        ([asset_id] for asset_id in asset_ids)).rowcount
+
+        metrics.count('state change conflicts', len(asset_ids) - count)
+        return count
+
+    def extend_due_dates(self, asset_ids, days=BORROW_DAYS):
+        """
+        Pushes back the due date of borrowed or requested assets by days, returns their new due dates by asset number
+        """
+
+        due_dates = {}
+
+        with self.db.transaction(immediate=True):
+            for asset_id, return_date in self.db.select_in(
+                    'SELECT asset_id, return_date FROM borrow_list WHERE asset_id IN ({})', asset_ids):
+                try:
+                    due_date = parse_date(return_date) + datetime.timedelta(days=days)
+                except ValueError:
+                    raise ValueError('Invalid due date of {}: {}'.format(asset_id, return_date))
+
+                due_dates[asset_id] = format_date(due_date)
+
+            self.db.executemany('UPDATE borrow_list SET return_date = ? WHERE asset_id=?',
+                                ([due_date, asset_id] for asset_id, due_date in due_dates.items()))
+
+        return due_dates
+
+    def import_batch(self, rows, replace=False, first_row=1):
+        """
+        Writes a batch of imported rows (dicts keyed by ASSET_COLUMNS) in one transaction and returns
+        how many assets were written. Assets whose number is taken are skipped, or overwritten along
+        with their borrower if replace is set. Raises ValueError naming the row, counted from
+        first_row, of an incomplete row, in which case nothing is written.
+        """
+
+        assets = {}
+        borrows = {}
+
+        for number, row in enumerate(rows, first_row):
+            try:
+                asset, borrow = import_values(row)
+            except ValueError as ex:
+                raise ValueError('Row {}: {}'.format(number, ex))
+
+            if replace or asset[0] not in assets:
+                assets[asset[0]] = asset
+                borrows.pop(asset[0], None)
+                if borrow is not None:
+                    borrows[asset[0]] = borrow
+
+        with self.db.transaction(immediate=True):
+            if not replace:
+                for (asset_id,) in self.db.select_in('SELECT asset_id FROM assets WHERE asset_id IN ({})',
+                                                     list(assets)):
+                    del assets[asset_id]
+                    borrows.pop(asset_id, None)
+
+            # Replaced borrowers, and borrow rows left behind by assets deleted without them,
+            # would clash with the borrow rows written
+            self.db.executemany('DELETE FROM borrow_list WHERE asset_id=?', ([asset_id] for asset_id in assets))
+            self.db.executemany('INSERT OR REPLACE INTO assets VALUES (?,?,?,?,?)', assets.values())
+            self.db.executemany('INSERT INTO borrow_list VALUES (?,?,?,?,?,?,?)', borrows.values())
+
+        return len(assets)
+
+    def import_assets(self, rows, batch_size=IMPORT_BATCH_SIZE, replace=False, progress=None):
+        """
+        Imports rows (see import_batch) batch_size at a time, so any number of rows streamed from
+        read_rows takes constant memory. progress(batch, count, seconds) is called after each
+        batch is written. Returns how many assets were written.
+        """
+
+        rows = iter(rows)
+        total = 0
+        read = 0
+        batch = 0
+
+        while True:
+            chunk = list(islice(rows, batch_size))
+            if not chunk:
+                return total
+
+            batch += 1
+            start = time.time()
+            count = self.import_batch(chunk, replace, read + 1)
+
+            read += len(chunk)
+            total += count
+            if progress is not None:
+                progress(batch, count, time.time() - start)
+
+    def export_assets(self, path, format=None, size=1000):
+        """
+        Writes every asset with its borrower to a CSV file, or to a JSON file of one object per line,
+        streaming the rows from the database a page at a time. Returns how many were written.
+        """
+
+        format = format or file_format(path)
+        count = 0
+
+        with open_rows(path, 'w') as output:
+            if format == 'csv':
+                writer = csv.writer(output)
+                writer.writerow([encode_value(column) for column in ASSET_COLUMNS])
+
+            for page in self.db.fetch_pages(EXPORT_QUERY, size=size):
+                if format == 'csv':
+                    writer.writerows([encode_value('' if value is None else value) for value in row]
+                                     for row in page)
+                else:
+                    for row in page:
+                        output.write(encode_value('{}\n'.format(json.dumps(dict(zip(ASSET_COLUMNS, row)),
+                                                                          sort_keys=True))))
+
+                count += len(page)
+
+        return count
+
+    def checkout(self, asset_ids, name, email, reason, days=BORROW_DAYS, today=None):
+        """
+        Requests assets for a borrower. Returns the due date and, by asset number, the rows
+        (name, state, borrower name, borrower email, due date, comments) of the assets someone
+        else requested first, which are left alone.
+        """
+
+        today = today or datetime.date.today()
+        due_date = format_date(today + datetime.timedelta(days=days))
+        taken = []
+        error = None
+        borrowed = {}
+
+        # The borrow_list primary key lets only one request for an asset in, so whoever
+        # inserts first gets it. No check beforehand that could go stale.
+        with self.db.transaction(immediate=True):
+            for asset_id in asset_ids:
+                try:
+                    self.db.execute('INSERT INTO borrow_list VALUES (?,?,?,?,?,?,?)',
+                                    [asset_id, name, email, 'Requested', format_date(today), due_date, reason])
+                except sqlite3.IntegrityError as ex:
+                    taken.append(asset_id)
+                    error = ex
+
+            for row in self.db.select_in(CONFLICT_QUERY, taken):
+                borrowed[row[0]] = row[1:]
+
+            if len(borrowed) < len(taken):
+                # Not a request already there, such as a missing name
+                raise error
+
+        metrics.count('checkout conflicts', len(taken))
+        return due_date, borrowed
+
+
+def read_asset_numbers(arguments):
+    """
+    Returns the asset numbers of command line arguments, - reads whitespace separated ones from stdin
+    """
+
+    asset_ids = []
+
+    for argument in arguments:
+        if argument == '-':
+            for line in sys.stdin:
+                for entry in line.split():
+                    asset_ids.extend(parse_asset_numbers(entry, limit=None))
+        else:
+            asset_ids.extend(parse_asset_numbers(argument, limit=None))
+
+    return asset_ids
+
+
+def main(argv=None):
+    """
+    Runs queries and bulk changes on an inventory database from the command line
+    """
+
+    parser = argparse.ArgumentParser(description='Queries and bulk changes on an inventory database.')
+    parser.add_argument('database', help='inventory database file')
+    commands = parser.add_subparsers(dest='command')
+
+    query = commands.add_parser('query', help='print the assets matching every filter, tab separated')
+    query.add_argument('--state', help='Available, Requested, Borrowed or Overdue')
+    query.add_argument('--location', help='storage location')
+    query.add_argument('--borrower', help='part of the borrower name or email')
+    query.add_argument('--due-before', help='YYYY-MM-DD')
+    query.add_argument('--text', help='words in the name, description or comments, "quote" phrases')
+    query.add_argument('--ids', action='store_true', help='print only the asset numbers')
+
+    set_state = commands.add_parser('set-state', help='change the state of borrowed or requested assets')
+    set_state.add_argument('state', choices=BORROW_STATES + ['Available'])
+
+    extend = commands.add_parser('extend', help='push back the due dates of assets')
+    extend.add_argument('--days', type=int, default=BORROW_DAYS)
+
+    delete = commands.add_parser('delete', help='delete assets')
+
+    import_ = commands.add_parser('import', help='add the assets of a CSV or JSON lines file')
+    import_.add_argument('file', help='CSV with a header line of asset columns, or .json/.jsonl objects')
+    import_.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='rows per transaction')
+    import_.add_argument('--replace', action='store_true', help='overwrite assets whose number is taken')
+
+    export = commands.add_parser('export', help='write every asset to a CSV or JSON lines file')
+    export.add_argument('file', help='.csv, or .json/.jsonl for one object per line')
+
+    for command in [set_state, extend, delete]:
+        command.add_argument('assets', nargs='+',
+                             help='asset numbers or ranges such as 1000-1999, - reads them from stdin')
+
+    args = parser.parse_args(argv)
+
+    if args.command is None:
+        parser.print_help()
+        return 1
+
+    if not os.path.isfile(args.database):
+        print('{}: file not found'.format(args.database))
+        return 1
+
+    store = InventoryStore.open(args.database)
+
+    try:
+        if args.command == 'query':
+            if not args.ids:
+                print('\t'.join(ASSET_COLUMNS))
+
+            for page in store.find_assets(args.state, args.location, args.borrower, args.due_before,
+                                         args.text):
+                for row in page:
+                    print(row[0] if args.ids else '\t'.join(str(value) for value in row))
+            return 0
+        elif args.command == 'export':
+            print('{} assets exported'.format(store.export_assets(args.file)))
+            return 0
+        elif args.command == 'import':
+            try:
+                count = store.import_assets(read_rows(args.file), args.batch_size, args.replace,
+                                            lambda *batch: print(batch_message(*batch)))
+            except (IOError, ValueError, csv.Error) as ex:
+                # ValueError covers text that is not UTF-8 and lines that are not JSON
+                print(str(ex))
+                return 1
+            except sqlite3.Error as ex:
+                # The batches reported so far stay imported
+                print('Import stopped by a database error: {}'.format(ex))
+                return 1
+
+            print('{} assets imported'.format(count))
+            return 0
+
+        try:
+            asset_ids = read_asset_numbers(args.assets)
+
+            if args.command == 'set-state' and args.state == 'Available':
+                count = store.make_available(asset_ids)
+            elif args.command == 'set-state':
+                count = store.set_state(asset_ids, args.state)
+            elif args.command == 'extend':
+                count = len(store.extend_due_dates(asset_ids, args.days))
+            else:
+                count = store.delete_assets(asset_ids)
+        except ValueError as ex:
+            print(str(ex))
+            return 1
+
+        print('{} of {} assets changed'.format(count, len(asset_ids)))
+        return 0
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except IOError as ex:
+        # Output piped into a command that stopped reading, such as head
+        if ex.errno != errno.EPIPE:
+            raise
+
+        # Python flushes stdout again on exit, which would fail the same way
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
@@ -0,0 +1,23 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import pytest
+
+from database import Database
+from store import InventoryStore
+
+
+@pytest.fixture
+def db(tmp_path):
+    """
+    An empty inventory database in a temporary file
+    """
+
+    database = Database(str(tmp_path / 'inventory.db'))
+    database.create_schema()
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def store(db):
+    return InventoryStore(db)
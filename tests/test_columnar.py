@@ -0,0 +1,77 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import random
+
+import pytest
+
+import columnar
+from columnar import ColumnStore, split_fields
+from database import NO_VALUE
+
+FIELDS = {'state': 2, 'due': 1}
+STATES = ['Available', 'Borrowed', 'Overdue']
+TERMS = [[(2, 'borrowed')], [(2, 'BORROWED'), (0, 'lap')], [(0, 'a')], [(0, '')],
+         [(1, '2017-02-01..')], [(1, '..2017-02-01')], [(1, '2017-01-10..2017-03-01'), (2, 'overdue')],
+         [(2, 'lost')], [(0, 'zzz')]]
+
+both_modes = pytest.mark.parametrize('use_numpy', [
+    False, pytest.param(True, marks=pytest.mark.skipif(columnar.numpy is None, reason='needs NumPy'))])
+
+
+@pytest.mark.parametrize('query, text, terms', [
+    ('laptop', 'laptop', []),
+    ('state:overdue', '', [(2, 'overdue')]),
+    ('  grey state:Borrowed  laptop ', 'grey laptop', [(2, 'Borrowed')]),
+    ('STATE:overdue due:2017-01-01..2017-02-01', '', [(2, 'overdue'), (1, '2017-01-01..2017-02-01')]),
+    ('room:100 state:', 'room:100', [(2, '')]),
+    ('http://example.com', 'http://example.com', []),
+])
+def test_split_fields(query, text, terms):
+    assert split_fields(query, FIELDS) == (text, terms)
+
+
+def random_row(generator):
+    name = generator.choice(['Laptop', 'Dell laptop', 'Cable', 'Tablet', NO_VALUE])
+    due = generator.choice([NO_VALUE, '2017-01-{:02d}'.format(generator.randint(1, 31)),
+                            '2017-02-01', '2017-03-{:02d}'.format(generator.randint(1, 31))])
+    return [name, due, generator.choice(STATES)]
+
+
+def plain_match(values, position, value):
+    value = value.lower()
+    if position == 2:
+        return values[position].lower() == value
+    if columnar.RANGE in value:
+        low, high = value.split(columnar.RANGE, 1)
+        text = values[position].lower()
+        return values[position] != NO_VALUE and (not low or text >= low) and (not high or text <= high)
+    return value in values[position].lower()
+
+
+@both_modes
+def test_filter_matches_a_plain_filter(use_numpy):
+    generator = random.Random(6)
+    rows = [random_row(generator) for _ in range(300)]
+    store = ColumnStore([0, 1, 2], categorical=[2], use_numpy=use_numpy)
+    store.build(rows)
+
+    for _ in range(200):
+        ix = generator.randrange(len(rows) + 3)
+        if generator.random() < 0.3 and ix < len(rows):
+            store.remove(ix)
+            rows[ix] = None
+        else:
+            values = random_row(generator)
+            store.update(ix, values)
+            while len(rows) <= ix:
+                rows.append(None)
+            rows[ix] = values
+
+    for terms in TERMS:
+        # All the rows are checked column by column, a few of them row by row
+        for ixs in [range(len(rows)), [7, 3, 250, len(rows) - 1]]:
+            expected = [ix for ix in ixs if rows[ix] is not None
+                        and all(plain_match(rows[ix], position, value) for position, value in terms)]
+            assert store.filter(ixs, terms) == expected
+
+    assert store.filter([5, 1, 3], []) == [5, 1, 3]
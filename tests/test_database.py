@@ -0,0 +1,263 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import sqlite3
+
+import pytest
+
+import database
+from database import (ASSET_SCHEMA, Database, DatabaseWorker, MAX_QUERY_PARAMETERS, SCHEMA_VERSION,
+                      is_locked, statement_name)
+from instrumentation import metrics
+
+
+def add_asset(db, asset_id, name='Laptop', description=None):
+    db.execute('INSERT INTO assets VALUES (?,?,?,?,?)', [asset_id, name, description, None, 'Room 100'])
+    db.commit()
+
+
+def test_create_schema(db):
+    assert db.schema_version() == SCHEMA_VERSION
+    for table in ['assets', 'borrow_list', 'change_log', 'asset_text']:
+        assert db.has_table(table)
+
+
+def test_migrate_unversioned_database(tmp_path):
+    path = str(tmp_path / 'old.db')
+    old = sqlite3.connect(path)
+    for statement in ASSET_SCHEMA:
+        old.execute(statement)
+    old.execute("INSERT INTO assets VALUES (1, 'Laptop', 'Grey', NULL, 'Room 100')")
+    old.execute("INSERT INTO borrow_list VALUES (1, 'Ann', 'ann@example.com', 'Borrowed', "
+                "'2017-01-01', '2017-02-01', 'for the trip')")
+    old.commit()
+    old.close()
+
+    db = Database(path)
+    try:
+        assert db.schema_version() == SCHEMA_VERSION
+        assert db.current_version() == 0
+        assert db.execute('SELECT rowid, name, description, comments FROM asset_text').fetchall() == [
+            (1, 'Laptop', 'Grey', 'for the trip')]
+        assert db.migrate() == SCHEMA_VERSION
+    finally:
+        db.close()
+
+
+def test_schema_without_fts5(tmp_path, monkeypatch):
+    path = str(tmp_path / 'plain.db')
+    monkeypatch.setattr(database, 'FTS5', False)
+    db = Database(path)
+    db.create_schema()
+
+    assert db.schema_version() == SCHEMA_VERSION
+    assert not db.has_table('asset_text') and not db.text_index
+    add_asset(db, 1)
+    db.close()
+
+    # Opened where FTS5 is available, the text index is built then
+    monkeypatch.setattr(database, 'FTS5', True)
+    db = Database(path)
+    assert db.text_index
+    assert db.execute('SELECT rowid, name FROM asset_text').fetchall() == [(1, 'Laptop')]
+    db.close()
+
+
+def test_migrate_refuses_newer_schema(tmp_path):
+    path = str(tmp_path / 'new.db')
+    db = Database(path)
+    db.create_schema()
+    db.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION + 1))
+    db.close()
+
+    with pytest.raises(sqlite3.DatabaseError):
+        Database(path)
+
+    db = Database()
+    with pytest.raises(sqlite3.DatabaseError):
+        db.open(path)
+    assert db.conn is None and db.path is None
+
+
+def test_open_leaves_the_journal_mode_of_other_files(tmp_path):
+    path = str(tmp_path / 'notes.db')
+    other = sqlite3.connect(path)
+    other.execute('CREATE TABLE notes (text TEXT)')
+    other.commit()
+    other.close()
+
+    db = Database(path)
+    assert not db.has_table('assets')
+    db.close()
+
+    other = sqlite3.connect(path)
+    assert other.execute('PRAGMA journal_mode').fetchone()[0] == 'delete'
+    other.close()
+
+
+def test_open_without_migrating_leaves_other_files_alone(tmp_path):
+    path = str(tmp_path / 'other.db')
+    db = Database(path)
+    try:
+        assert not db.has_table('assets')
+        assert db.schema_version() == 0
+    finally:
+        db.close()
+
+
+def test_change_log_versions_every_write(db):
+    add_asset(db, 1)
+    add_asset(db, 2)
+    start, asset_ids = db.changes_since(0)
+    assert sorted(asset_ids) == [1, 2]
+    assert start == db.current_version()
+
+    db.execute("INSERT INTO borrow_list VALUES (2, 'Ann', 'ann@example.com', 'Requested', "
+               "'2017-01-01', '2017-02-01', NULL)")
+    db.commit()
+    version, asset_ids = db.changes_since(start)
+    assert asset_ids == [2] and version > start
+
+    # A renumbered asset logs both numbers, so the old one is seen as deleted
+    db.execute('UPDATE assets SET asset_id = 3 WHERE asset_id = 1')
+    db.commit()
+    latest, asset_ids = db.changes_since(version)
+    assert sorted(asset_ids) == [1, 3]
+
+    db.execute('DELETE FROM assets WHERE asset_id = 3')
+    db.commit()
+    assert db.changes_since(latest)[1] == [3]
+    assert db.changes_since(db.current_version()) == (db.current_version(), [])
+
+
+def test_select_in_chunks(db):
+    count = MAX_QUERY_PARAMETERS * 2 + 10
+    db.executemany('INSERT INTO assets VALUES (?,?,?,?,?)',
+                   ([asset_id, 'Pen', None, None, 'Room 100'] for asset_id in range(count)))
+    db.commit()
+
+    wanted = list(range(0, count, 2)) + [count + 5]
+    found = [row[0] for row in db.select_in('SELECT asset_id FROM assets WHERE asset_id IN ({})', wanted)]
+    assert sorted(found) == list(range(0, count, 2))
+    assert list(db.select_in('SELECT asset_id FROM assets WHERE asset_id IN ({})', [])) == []
+
+
+def test_fetch_pages(db):
+    db.executemany('INSERT INTO assets VALUES (?,?,?,?,?)',
+                   ([asset_id, 'Pen', None, None, 'Room 100'] for asset_id in range(25)))
+    db.commit()
+
+    pages = list(db.fetch_pages('SELECT asset_id FROM assets ORDER BY asset_id', size=10))
+    assert [len(page) for page in pages] == [10, 10, 5]
+    assert [row[0] for page in pages for row in page] == list(range(25))
+
+
+def test_timed_statements_count_their_rows(db):
+    metrics.reset()
+    metrics.configure(True)
+
+    try:
+        db.executemany('INSERT INTO assets VALUES (?,?,?,?,?)',
+                       ([asset_id, 'Pen', None, None, 'Room 100'] for asset_id in range(25)))
+        assert db.execute('UPDATE assets SET name = ? WHERE asset_id < 5', ['Pencil']).rowcount == 5
+
+        result = db.execute('SELECT asset_id FROM assets ORDER BY asset_id')
+        assert result.fetchone() == (0,)
+        assert result.fetchmany(2) == [(1,), (2,)]
+        assert [row[0] for row in result] == list(range(3, 25))
+
+        assert [len(page) for page in db.fetch_pages('SELECT asset_id FROM assets', size=10)] == [10, 10, 5]
+
+        rows = {name: mean_rows for name, count, percentiles, longest, mean_rows in metrics.summary()}
+        assert rows['sql INSERT assets'] == 25
+        assert rows['sql UPDATE assets'] == 5
+        assert rows['sql SELECT assets'] == 25
+        assert rows['sql SELECT assets fetch'] == 25 / 4
+    finally:
+        metrics.configure(False)
+        metrics.reset()
+
+
+def test_transaction_rolls_back_on_error(db):
+    with pytest.raises(ValueError):
+        with db.transaction(immediate=True):
+            db.execute("INSERT INTO assets VALUES (1, 'Pen', NULL, NULL, 'Room 100')")
+            raise ValueError('stop')
+
+    assert db.execute('SELECT COUNT(*) FROM assets').fetchone()[0] == 0
+
+
+def test_immediate_transaction_retries_locked_database(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'LOCK_BACKOFF', 0.001)
+    path = str(tmp_path / 'locked.db')
+    db = Database(path, pragmas=[('journal_mode', 'WAL'), ('busy_timeout', 0)])
+    db.create_schema()
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute('BEGIN IMMEDIATE')
+    metrics.reset()
+
+    try:
+        with pytest.raises(sqlite3.OperationalError) as error:
+            with db.transaction(immediate=True):
+                pass
+
+        assert is_locked(error.value)
+        assert dict(metrics.counts()) == {'write lock retries': database.LOCK_RETRIES,
+                                          'write lock timeouts': 1}
+
+        other.execute('COMMIT')
+        with db.transaction(immediate=True):
+            db.execute("INSERT INTO assets VALUES (1, 'Pen', NULL, NULL, 'Room 100')")
+        assert db.execute('SELECT COUNT(*) FROM assets').fetchone()[0] == 1
+    finally:
+        other.close()
+        db.close()
+        metrics.reset()
+
+
+def test_statement_name():
+    assert statement_name('SELECT asset_id FROM assets WHERE asset_id=?') == 'sql SELECT assets'
+    assert statement_name('INSERT OR REPLACE INTO borrow_list VALUES (?)') == 'sql INSERT borrow_list'
+    assert statement_name('CREATE INDEX IF NOT EXISTS a ON assets (name)') == 'sql CREATE assets'
+    assert statement_name('PRAGMA user_version') == 'sql PRAGMA'
+
+
+def test_worker_runs_jobs_in_order_and_calls_back_on_poll(db):
+    add_asset(db, 1)
+    worker = DatabaseWorker()
+    worker.open(db.path)
+    calls = []
+
+    def add(database):
+        add_asset(database, 2)
+
+    def count(database):
+        return database.execute('SELECT COUNT(*) FROM assets').fetchone()[0]
+
+    worker.submit(add, calls.append)
+    worker.submit(count, calls.append)
+    worker.close()
+    assert calls == [] and worker.pending == 4
+
+    worker.poll()
+    assert calls == [None, 2] and worker.pending == 0
+
+    worker.stop()
+    assert not worker.thread.is_alive()
+
+
+def test_worker_sends_errors_to_the_errback(db):
+    worker = DatabaseWorker()
+    worker.open(db.path)
+    calls = []
+    errors = []
+
+    def fail(database):
+        database.execute('SELECT * FROM missing')
+
+    worker.submit(fail, calls.append, errors.append)
+    worker.submit(lambda database: 'next', calls.append, errors.append)
+    worker.stop()
+    worker.poll()
+
+    assert calls == ['next']
+    assert [type(error) for error in errors] == [sqlite3.OperationalError]
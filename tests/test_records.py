@@ -0,0 +1,38 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from database import NO_VALUE
+from records import field_name, record_type
+
+COLUMNS = ['Asset Number', 'Name', 'State']
+Record = record_type('Record', COLUMNS, interned=['State'])
+
+
+def test_field_name():
+    assert [field_name(column) for column in COLUMNS] == ['asset_number', 'name', 'state']
+
+
+def test_records_read_like_rows():
+    record = Record.from_row((1, 'Laptop', 'Borrowed'))
+
+    assert record == (1, 'Laptop', 'Borrowed')
+    assert record[COLUMNS.index('Name')] == record.name == 'Laptop'
+    assert list(record) == [1, 'Laptop', 'Borrowed']
+    assert not hasattr(record, '__dict__')
+
+
+def test_records_share_interned_values_and_placeholders():
+    first = Record.from_row([1, ''.join(['-', '--']), ''.join(['Borr', 'owed'])])
+    second = Record.from_row([2, ''.join(['--', '-']), ''.join(['Borro', 'wed'])])
+
+    assert first.state is second.state
+    assert first.name is second.name is NO_VALUE
+
+
+def test_replace_keeps_interning():
+    record = Record.from_row([1, 'Laptop', 'Available'])
+    changed = record.replace(name='Tablet', state=''.join(['Avail', 'able']))
+
+    assert changed == (1, 'Tablet', 'Available')
+    assert changed.state is record.state
+    assert type(changed) is Record
+    assert record.name == 'Laptop'
@@ -0,0 +1,104 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import random
+
+import pytest
+
+from search_index import IncrementalSearch, SearchIndex
+
+WORDS = ['laptop', 'Dell', 'latitude', 'cable', 'hdmi', 'ab', 'abc', 'ABCD', '---', '2017-01-05']
+QUERIES = ['', 'a', 'ab', 'abc', 'bcd', 'LAP', 'top', 'dell lat', 'e h', '---', '2017', 'zzz']
+
+
+def random_rows(generator, count):
+    return [[' '.join(generator.choice(WORDS) for _ in range(generator.randint(0, 3))) for _ in range(3)]
+            for _ in range(count)]
+
+
+def brute_force(rows, columns, query):
+    """
+    Row indexes whose searchable columns contain the query, checked one by one
+    """
+
+    query = query.lower()
+    return [ix for ix, values in enumerate(rows)
+            if values is not None and any(query in str(values[column]).lower() for column in columns)]
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_search_matches_a_plain_substring_search(query):
+    rows = random_rows(random.Random(1), 300)
+    index = SearchIndex([0, 2])
+    index.build(rows)
+
+    assert index.search(query) == brute_force(rows, [0, 2], query)
+
+
+def test_search_follows_updates_and_removals():
+    generator = random.Random(2)
+    rows = random_rows(generator, 200)
+    index = SearchIndex([0, 1, 2])
+    index.build(rows)
+
+    for _ in range(300):
+        ix = generator.randrange(len(rows) + 5)
+        if generator.random() < 0.3 and ix < len(rows):
+            index.remove(ix)
+            rows[ix] = None
+        else:
+            values = random_rows(generator, 1)[0]
+            index.update(ix, values)
+            while len(rows) <= ix:
+                rows.append(None)
+            rows[ix] = values
+
+    for query in QUERIES:
+        assert index.search(query) == brute_force(rows, [0, 1, 2], query)
+        assert all(index.matches(ix, query.lower()) for ix in brute_force(rows, [0, 1, 2], query))
+
+
+def test_query_does_not_match_across_columns():
+    index = SearchIndex([0, 1])
+    index.build([['lapt', 'op'], ['laptop', '']])
+
+    assert index.search('laptop') == [1]
+    assert index.search('pt op') == []
+
+
+def test_incremental_search_matches_brute_force_after_edits():
+    generator = random.Random(3)
+    rows = random_rows(generator, 200)
+    index = SearchIndex([0, 1])
+    index.build(rows)
+    search = IncrementalSearch(index, cache_size=4)
+
+    for _ in range(100):
+        # Type a query one letter at a time, then backspace over part of it
+        query = generator.choice(QUERIES)
+        typed = [query[:length] for length in range(len(query) + 1)]
+        typed += typed[::-1][:generator.randint(0, len(typed))]
+        for text in typed:
+            assert search.search(text) == brute_force(rows, [0, 1], text)
+
+        ix = generator.randrange(len(rows))
+        if generator.random() < 0.3:
+            index.remove(ix)
+            rows[ix] = None
+        else:
+            rows[ix] = random_rows(generator, 1)[0]
+            index.update(ix, rows[ix])
+
+
+def test_incremental_search_keeps_a_bounded_cache():
+    index = SearchIndex([0])
+    index.build([['laptop'], ['lamp'], ['cable']])
+    search = IncrementalSearch(index, cache_size=2)
+
+    assert search.search('La') == [0, 1]
+    assert search.search('lap') == [0]
+    assert search.search('c') == [2]
+    assert list(search.cache) == ['lap', 'c']
+
+    result = search.search('c')
+    result.append(0)
+    assert search.search('c') == [2]
@@ -0,0 +1,55 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import random
+
+import pytest
+
+from database import NO_VALUE
+from sorting import INSERT_RATIO, SortEngine, sort_key
+
+
+def test_sort_key_orders_by_type():
+    values = ['b', '10', 'A', '2017-1-5', '9', '2016-12-31', 3]
+    assert sorted(values, key=sort_key) == [3, '9', '10', '2016-12-31', '2017-1-5', 'A', 'b']
+
+
+def test_placeholders_go_last_both_ways():
+    items = [['b'], [NO_VALUE], ['a'], [''], ['c']]
+    sorter = SortEngine(items)
+
+    assert sorter.sort(range(5), [(0, False)]) == [2, 0, 4, 1, 3]
+    assert sorter.sort(range(5), [(0, True)]) == [4, 0, 2, 1, 3]
+
+
+def test_ties_go_by_the_next_column_then_index():
+    items = [['a', 2], ['b', 1], ['a', 1], ['a', 2]]
+    sorter = SortEngine(items)
+
+    assert sorter.sort(range(4), [(0, False), (1, True)]) == [0, 3, 2, 1]
+    assert sorter.sort(range(4), [(1, False), (0, True)]) == [1, 2, 0, 3]
+
+
+@pytest.mark.parametrize('new_count', [3, 400])
+@pytest.mark.parametrize('columns', [[(0, False)], [(1, True), (0, False)]])
+def test_merge_matches_sort(new_count, columns):
+    generator = random.Random(new_count)
+    items = [[generator.choice(['x', 'y', NO_VALUE, str(generator.randint(0, 50))]), generator.randint(0, 9)]
+             for _ in range(1000)]
+    sorter = SortEngine(items)
+    ixs = list(range(1000))
+    generator.shuffle(ixs)
+    new, old = ixs[:new_count], ixs[new_count:]
+
+    merged = sorter.merge(sorter.sort(old, columns), sorter.sort(new, columns), columns)
+    assert merged == sorter.sort(ixs, columns)
+    assert (new_count * INSERT_RATIO < len(old)) == (new_count == 3)
+
+
+def test_invalidate_after_edit():
+    items = [['b'], ['a']]
+    sorter = SortEngine(items)
+    assert sorter.sort([0, 1], [(0, False)]) == [1, 0]
+
+    items[0] = ['0']
+    sorter.invalidate()
+    assert sorter.sort([0, 1], [(0, False)]) == [0, 1]
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+import datetime
+
+import pytest
+
+from benchmarks.generate import populate
+import database
+from database import Database, MAX_QUERY_PARAMETERS, NO_VALUE
+from sorting import SortEngine
+from store import (ASSET_COLUMNS, AssetSearch, InventoryStore, main, parse_asset_numbers, read_rows,
+                   text_query)
+
+ROW = ['Laptop', 'Grey laptop', None, 'Room 100']
+TEXT_INDEX_QUERY = ('SELECT assets.asset_id, name, description, comments FROM assets '
+                    'LEFT JOIN borrow_list ON assets.asset_id=borrow_list.asset_id ORDER BY assets.asset_id')
+
+
+def state_of(store, asset_id):
+    for page in store.find_assets():
+        for row in page:
+            if row[0] == asset_id:
+                return row[ASSET_COLUMNS.index('state')]
+
+
+def assert_text_index_current(db):
+    indexed = db.execute('SELECT rowid, name, description, comments FROM asset_text ORDER BY rowid').fetchall()
+    assert indexed == db.execute(TEXT_INDEX_QUERY).fetchall()
+
+
+@pytest.mark.parametrize('text, numbers', [
+    ('5', [5]),
+    (' 1, 3 - 5 ,9', [1, 3, 4, 5, 9]),
+    ('7-7', [7]),
+])
+def test_parse_asset_numbers(text, numbers):
+    assert parse_asset_numbers(text) == numbers
+
+
+@pytest.mark.parametrize('text', ['', 'a', '1,', '5-3', '1-2-3', '-4'])
+def test_parse_asset_numbers_rejects(text):
+    with pytest.raises(ValueError):
+        parse_asset_numbers(text)
+
+
+def test_parse_asset_numbers_limit():
+    with pytest.raises(ValueError):
+        parse_asset_numbers('1-11', limit=10)
+
+    assert len(parse_asset_numbers('1-11', limit=None)) == 11
+
+
+def test_text_query():
+    assert text_query('lap top') == '"lap"* "top"*'
+    assert text_query('"grey laptop" bag') == '"grey laptop" "bag"*'
+    assert text_query('  -- ') is None
+
+
+def test_add_assets_reports_taken_numbers(store):
+    assert store.add_assets([5, 900000], ROW) == []
+    assert store.add_assets([1, 5, 900000], ROW) == [5, 900000]
+    assert store.db.execute('SELECT COUNT(*) FROM assets').fetchone()[0] == 2
+
+
+def test_add_assets_renumbers_with_borrower(store):
+    store.add_assets([1], ROW)
+    store.checkout([1], 'Ann', 'ann@example.com', 'trip')
+
+    assert store.add_assets([2], ['Tablet', None, None, 'Room 101'], replace=1) == []
+    assert [row[:3] for page in store.find_assets() for row in page] == [(2, 'Tablet', 'Requested')]
+    assert_text_index_current(store.db)
+
+
+def test_checkout_leaves_assets_already_requested(store):
+    store.add_assets([1, 2, 3], ROW)
+    today = datetime.date(2017, 1, 1)
+
+    due_date, borrowed = store.checkout([1, 2], 'Ann', 'ann@example.com', 'trip', today=today)
+    assert due_date == '2017-01-31' and borrowed == {}
+
+    due_date, borrowed = store.checkout([2, 3], 'Bob', 'bob@example.com', 'demo', today=today)
+    assert list(borrowed) == [2]
+    assert borrowed[2][2:4] == ('Ann', 'ann@example.com')
+    assert state_of(store, 3) == 'Requested'
+
+
+def test_state_changes_count_assets_changed(store):
+    store.add_assets([1, 2], ROW)
+    store.checkout([1], 'Ann', 'ann@example.com', 'trip')
+
+    assert store.set_state([1, 2], 'Borrowed') == 1
+    assert state_of(store, 1) in ['Borrowed', 'Overdue']
+    assert store.make_available([1, 2]) == 1
+    assert store.make_available([1]) == 0
+    assert state_of(store, 1) == 'Available'
+
+    with pytest.raises(ValueError):
+        store.set_state([1], 'Lost')
+
+
+def test_extend_due_dates(store):
+    store.add_assets([1, 2], ROW)
+    store.checkout([1], 'Ann', 'ann@example.com', 'trip', today=datetime.date(2017, 1, 1))
+
+    assert store.extend_due_dates([1, 2], days=10) == {1: '2017-02-10'}
+
+
+def test_text_index_follows_writes(store):
+    store.add_assets(list(range(1, 6)), ROW)
+    store.checkout([1, 2], 'Ann', 'ann@example.com', 'conference in Paris')
+    store.add_assets([7], ['Projector', 'HDMI', None, 'Room 102'], replace=2)
+    store.make_available([1])
+    store.delete_assets([3])
+    store.import_batch([{'asset_id': '4', 'name': 'Camera', 'storage_location': 'Room 103',
+                         'state': 'Borrowed', 'borrower_name': 'Bob', 'borrower_email': 'bob@example.com',
+                         'date_requested': '2017-01-01', 'return_date': '2017-02-01',
+                         'comments': 'wildlife shoot'}], replace=True)
+    assert_text_index_current(store.db)
+
+    assert store.search_text('paris') == [7]
+    assert store.search_text('wild') == [4]
+    assert store.search_text('"laptop grey"') == []
+    assert store.search_text('laptop') == [1, 5]
+
+
+def test_search_text_ranks_name_matches_first(store):
+    store.add_assets([1], ['Cable', 'for the laptop', None, 'Room 100'])
+    store.add_assets([2], ['Laptop', None, None, 'Room 100'])
+
+    assert store.search_text('laptop') == [2, 1]
+    assert store.search_text('laptop', asset_ids=[1]) == [1]
+    assert store.search_text('laptop', limit=1) == [2]
+
+
+def test_search_text_ranks_across_chunks_of_asset_numbers(store):
+    count = MAX_QUERY_PARAMETERS + 10
+    store.add_assets(list(range(count)), ['Cable', 'for the laptop', None, 'Room 100'])
+    store.add_assets([count], ['Laptop', None, None, 'Room 100'])
+
+    asset_ids = list(range(count + 1))
+    assert store.search_text('laptop', asset_ids) == [count] + list(range(count))
+    assert store.search_text('laptop', asset_ids, limit=2) == [count, 0]
+
+
+def test_asset_pages_carry_on_after_an_asset(store):
+    store.add_assets([5, 1, 3, 2], ROW)
+
+    assert [row[0] for page in store.asset_pages(size=3) for row in page] == [1, 2, 3, 5]
+    assert [row[0] for page in store.asset_pages(size=3, after=2) for row in page] == [3, 5]
+
+
+def test_find_assets_filters(store):
+    store.add_assets([1, 2, 3], ROW)
+    store.add_assets([4], ['Pen', None, None, 'Room 200'])
+    store.checkout([2], 'Ann', 'ann@example.com', 'trip', today=datetime.date(2017, 1, 1))
+    store.checkout([3], 'Bob', 'bob@example.com', 'conference')
+    store.set_state([2], 'Borrowed')
+
+    def ids(**filters):
+        return [row[0] for page in store.find_assets(**filters) for row in page]
+
+    assert ids() == [1, 2, 3, 4]
+    assert ids(state='Available') == [1, 4]
+    assert ids(state='Requested') == [3]
+    assert ids(state='Overdue') == [2]
+    assert ids(location='Room 200') == [4]
+    assert ids(borrower='ann') == [2]
+    assert ids(due_before='2017-02-01') == [2]
+    assert ids(text='conf') == [3]
+    assert ids(text='--') == []
+
+
+def test_search_without_text_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, 'FTS5', False)
+    store = InventoryStore(Database(str(tmp_path / 'plain.db')))
+    store.db.create_schema()
+    store.add_assets([1], ['Laptop', 'Grey, with charger', None, 'Room 100'])
+    store.add_assets([2], ['Pen', None, None, 'Room 100'])
+
+    assert store.search_text('laptop') == []
+    assert [row[0] for page in store.find_assets(text='grey lap') for row in page] == [1]
+    assert [row[0] for page in store.find_assets(text='"with charger"') for row in page] == [1]
+
+    search = AssetSearch(ASSET_COLUMNS, 'pen', [], [1], store.db.text_index)
+    assert [row[0] for row in search.page(store.db, 0, 10)[0]] == [2]
+    store.db.close()
+
+
+@pytest.fixture
+def generated(store):
+    populate(store.db, 1000, 0.4, seed=1)
+    return store
+
+
+@pytest.mark.parametrize('sort_columns', [
+    [],
+    [(1, False)],
+    [(1, True)],
+    [(2, False), (1, True)],
+    [(7, True), (1, False)],
+])
+@pytest.mark.parametrize('text, terms', [('', []), ('laptop', []), ('42', []), ('', [(2, 'available')])])
+def test_keyset_pages_match_offset_pages(generated, sort_columns, text, terms):
+    search = AssetSearch(ASSET_COLUMNS, text, terms, [0, 1, 3])
+    count = search.count(generated.db)
+    everything = search.page(generated.db, 0, count + 1, sort_columns)[0]
+    assert len(everything) == count
+
+    by_offset = []
+    by_key = []
+    key = None
+
+    for offset in range(0, count, 64):
+        by_offset.extend(search.page(generated.db, offset, 64, sort_columns)[0])
+        rows, key = search.page(generated.db, offset, 64, sort_columns, key)
+        by_key.extend(rows)
+
+    assert by_offset == everything
+    assert by_key == everything
+
+
+def test_asset_search_text_matches_like_the_list_search(generated):
+    searchable = [ASSET_COLUMNS.index(column) for column in ['asset_id', 'name', 'borrower_name',
+                                                              'borrower_email', 'return_date']]
+    rows = AssetSearch(ASSET_COLUMNS).page(generated.db, 0, 1000)[0]
+
+    for text in ['laptop', '42', '@', str(datetime.date.today().year), 'no such asset']:
+        expected = set(row[0] for row in rows
+                       if any(text.lower() in str(row[position]).lower() for position in searchable)
+                       or row[0] in generated.search_text(text))
+        search = AssetSearch(ASSET_COLUMNS, text, [], searchable)
+        found = search.page(generated.db, 0, 1000)[0]
+
+        assert set(row[0] for row in found) == expected
+        assert search.count(generated.db) == len(expected)
+
+    # Full text matches first, best first
+    ranked = generated.search_text('laptop')
+    found = AssetSearch(ASSET_COLUMNS, 'laptop', [], searchable).page(generated.db, 0, 1000)[0]
+    assert [row[0] for row in found[:len(ranked)]] == ranked
+
+
+@pytest.mark.parametrize('descending', [False, True])
+def test_asset_search_sorts_placeholders_last(generated, descending):
+    due = ASSET_COLUMNS.index('return_date')
+    search = AssetSearch(ASSET_COLUMNS)
+    everything = search.page(generated.db, 0, 1000)[0]
+    rows = search.page(generated.db, 0, 1000, [(due, descending)])[0]
+
+    # Ties may go either way
+    engine = SortEngine(everything)
+    assert [row[due] for row in rows] == [everything[ix][due] for ix in engine.sort(range(len(everything)),
+                                                                                 [(due, descending)])]
+    assert rows[-1][due] == NO_VALUE and rows[0][due] != NO_VALUE
+
+
+def test_asset_search_filters(generated):
+    state = ASSET_COLUMNS.index('state')
+    due = ASSET_COLUMNS.index('return_date')
+    search = AssetSearch(ASSET_COLUMNS, 'laptop', [(state, 'available')])
+    rows = search.page(generated.db, 0, 1000)[0]
+
+    assert rows and len(rows) == search.count(generated.db)
+    assert all(row[1] == 'Laptop' and row[state] == 'Available' for row in rows)
+
+    today = str(datetime.date.today())
+    rows = AssetSearch(ASSET_COLUMNS, '', [(due, '..' + today)]).page(generated.db, 0, 1000)[0]
+    assert rows and all(NO_VALUE != row[due] <= today for row in rows)
+
+
+@pytest.mark.parametrize('name', ['assets.csv', 'assets.jsonl'])
+def test_export_then_import(store, tmp_path, name):
+    store.add_assets([1, 2], ['Café table', 'Dünn', '2016-05-01', 'Room 100'])
+    store.checkout([2], 'Zoë', 'zoe@example.com', 'a "quoted", reason')
+    path = str(tmp_path / name)
+
+    assert store.export_assets(path) == 2
+    exported = list(store.find_assets())
+
+    copy = InventoryStore.open(str(tmp_path / 'copy.db'))
+    try:
+        copy.db.create_schema()
+        assert copy.import_assets(read_rows(path), batch_size=1) == 2
+        assert list(copy.find_assets()) == exported
+        assert copy.import_assets(read_rows(path)) == 0
+        assert copy.import_assets(read_rows(path), replace=True) == 2
+    finally:
+        copy.close()
+
+
+def test_import_batch_names_bad_row(store):
+    rows = [{'asset_id': '1', 'name': 'Pen', 'storage_location': 'Room 100'},
+            {'asset_id': 'x', 'name': 'Pen', 'storage_location': 'Room 100'}]
+
+    with pytest.raises(ValueError) as error:
+        store.import_batch(rows, first_row=10)
+
+    assert str(error.value).startswith('Row 11:')
+    assert store.db.execute('SELECT COUNT(*) FROM assets').fetchone()[0] == 0
+
+
+def test_import_batch_replaces_borrow_rows_left_behind(store):
+    store.db.execute("INSERT INTO borrow_list VALUES (1, 'Ann', 'ann@example.com', 'Borrowed', "
+                     "'2017-01-01', '2017-02-01', NULL)")
+    store.db.commit()
+    rows = [{'asset_id': '1', 'name': 'Pen', 'storage_location': 'Room 100', 'state': 'Requested',
+             'borrower_name': 'Bob', 'borrower_email': 'bob@example.com', 'date_requested': '2017-03-01',
+             'return_date': '2017-04-01'},
+            {'asset_id': '2', 'name': 'Pen', 'storage_location': 'Room 100'}]
+
+    assert store.import_batch(rows) == 2
+    assert store.db.execute('SELECT asset_id, borrower_name, state FROM borrow_list').fetchall() == [
+        (1, 'Bob', 'Requested')]
+
+
+@pytest.mark.parametrize('content', [
+    b'asset_id,name,storage_location\n1,"' + b'x' * 200000 + b'",Room 100\n',
+    b'asset_id,name,storage_location\n1,\xff\xfe,Room 100\n',
+])
+def test_command_line_reports_unreadable_import(db, tmp_path, capsys, content):
+    path = tmp_path / 'bad.csv'
+    path.write_bytes(content)
+
+    assert main([db.path, 'import', str(path)]) == 1
+    assert capsys.readouterr().out.strip()
@@ -0,0 +1,261 @@
+from __future__ import absolute_import, division, print_function, unicode_literals
+
+from itertools import combinations, permutations
+import random
+
+import pytest
+
+import listbox
+from listbox import ColumnWidths, ListView, MultiColumnListbox, PagedView, longest_increasing
+from sorting import SortEngine
+
+
+class FakeFont(object):
+    """
+    Stands in for a Tk font, seven pixels a character, counting what it measures
+    """
+
+    def __init__(self):
+        self.measured = []
+
+    def measure(self, text):
+        self.measured.append(text)
+        return 7 * len(text)
+
+
+class FakeTree(object):
+    """
+    Keeps the top level items of a Treeview in a list, counting the items moved
+    """
+
+    def __init__(self):
+        self.iids = []
+        self.values = {}
+        self.moved = 0
+
+    def get_children(self, parent):
+        return tuple(self.iids)
+
+    def insert(self, parent, index, iid, values, tags):
+        self.iids.insert(index, iid)
+        self.values[iid] = list(values)
+
+    def delete(self, *iids):
+        for iid in iids:
+            self.iids.remove(iid)
+            del self.values[iid]
+
+    def detach(self, *iids):
+        for iid in iids:
+            self.iids.remove(iid)
+        self.moved += len(iids)
+
+    def move(self, iid, parent, index):
+        self.iids.insert(index, iid)
+
+    def item(self, iid, values, tags):
+        self.values[iid] = list(values)
+
+
+@pytest.fixture
+def font(monkeypatch):
+    fake = FakeFont()
+    monkeypatch.setattr(listbox, '_font', fake)
+    monkeypatch.setattr(listbox, '_text_widths', listbox.OrderedDict())
+    return fake
+
+
+def make_view(values):
+    items = [[value] for value in values]
+    return items, ListView(SortEngine(items), range(len(items)))
+
+
+def test_list_view_keeps_sort_across_filters():
+    items, view = make_view(['d', 'b', 'a', 'c', 'e'])
+    view.set_sort([(0, False)])
+    assert view.ixs == [2, 1, 3, 0, 4]
+
+    view.set_filter(lambda ixs: [ix for ix in ixs if items[ix][0] in 'abc'])
+    assert view.ixs == [2, 1, 3]
+
+    view.set_filter(lambda ixs: [ix for ix in ixs if items[ix][0] != 'a'])
+    assert view.ixs == [1, 3, 0, 4]
+
+    view.set_sort([])
+    assert view.ixs == [0, 1, 3, 4]
+
+
+def test_list_view_ranked_filter_until_sorted():
+    items, view = make_view(['a', 'b', 'c'])
+    view.set_filter(lambda ixs: list(ixs), [2, 0], ranked=True)
+    assert view.ixs == [2, 0]
+
+    view.set_sort([(0, False)])
+    assert view.ixs == [0, 2]
+
+
+def test_list_view_add_and_remove():
+    items, view = make_view(['b', 'd'])
+    view.set_sort([(0, True)])
+    view.set_filter(lambda ixs: [ix for ix in ixs if items[ix][0] != 'x'])
+
+    items.extend([['c'], ['x'], ['a']])
+    view.sorter.invalidate()
+    view.add([2, 3, 4])
+    assert view.ixs == [1, 2, 0, 4]
+
+    view.remove(2)
+    assert view.ixs == [1, 0, 4]
+    assert view.rows == [0, 1, 3, 4]
+
+
+class Source(object):
+    """
+    Numbered rows for a PagedView, keeping count of the fetches
+    """
+
+    def __init__(self, count):
+        self.total = count
+        self.fetches = []
+        self.failing = False
+
+    def fetch(self, offset, size, sort_columns, after=None):
+        self.fetches.append((offset, after))
+        if self.failing:
+            return [], None
+
+        descending = bool(sort_columns) and sort_columns[0][1]
+        rows = list(range(self.total))[::-1 if descending else 1][offset:offset + size]
+        return rows, rows[-1] if rows else None
+
+    def count(self):
+        return None if self.failing else self.total
+
+
+def test_paged_view_reads_pages_as_shown():
+    source = Source(1050)
+    view = PagedView(source.fetch, source.count, page_size=100, cached_pages=3)
+
+    assert len(view) == 1050
+    assert view[0] == 0 and view[-1] == 1049
+    assert view[95:205] == list(range(95, 205))
+    assert view[1000:] == list(range(1000, 1050))
+    assert view.index(1010) == 1010 and 1010 in view
+
+    # The key of the page before is handed on, only the three latest pages are kept
+    assert (200, 199) in source.fetches
+    assert sorted(view.pages) == [1, 2, 10]
+    assert 0 not in view
+
+    view.set_sort([(0, True)])
+    assert view[0] == 1049 and len(view.pages) == 1
+
+
+def test_paged_view_survives_failed_reads():
+    source = Source(250)
+    view = PagedView(source.fetch, source.count, page_size=100)
+    source.failing = True
+
+    assert len(view) == 0 and view[:] == []
+
+    source.failing = False
+    assert len(view) == 250
+    source.failing = True
+
+    # Rows of a page that could not be read are left out until it reads
+    assert view[95:105] == [] and view[150] is None
+    assert not view.pages
+
+    source.failing = False
+    assert view[95:105] == list(range(95, 105)) and view[150] == 150
+    assert view[249] == 249 and sorted(view.pages) == [0, 1, 2]
+
+
+def test_paged_view_evicts_dropped_rows():
+    source = Source(500)
+    evicted = []
+    view = PagedView(source.fetch, source.count, page_size=100, cached_pages=2, evict=evicted.extend)
+
+    assert view[0] == 0 and view[150] == 150 and not evicted
+    assert view[250] == 250
+    assert sorted(evicted) == list(range(100))
+
+    # A row still on a page kept is not let go of
+    view.pages[2] = ([199] + view.pages[2][0][1:], view.pages[2][1])
+    del evicted[:]
+    assert view[350] == 350
+    assert sorted(evicted) == list(range(100, 199))
+
+    del evicted[:]
+    view.invalidate()
+    assert sorted(evicted) == [199] + list(range(201, 400))
+
+
+def test_measure_caches_the_recent_texts(font, monkeypatch):
+    monkeypatch.setattr(listbox, 'MEASURE_CACHE_SIZE', 2)
+
+    assert [listbox.measure(text) for text in ['ab', 'ab', 'abc', 'ab', 'abcd', 'ab', 'abc']] == \
+        [14, 14, 21, 14, 28, 14, 21]
+    assert font.measured == ['ab', 'abc', 'abcd', 'abc']
+
+
+def test_column_widths_follow_the_widest_row(font):
+    generator = random.Random(4)
+    rows = [[generator.choice(['', 'a', 'bb', 'ccc', 'dddd']) for _ in range(2)] for _ in range(50)]
+    widths = ColumnWidths(2)
+    widths.reset(rows)
+
+    for _ in range(300):
+        position = generator.randrange(len(rows) + 1)
+        values = [generator.choice(['', 'a', 'bb', 'ccc', 'dddd', 'eeeee']) for _ in range(2)]
+        if position == len(rows):
+            rows.append(values)
+            widths.add(values)
+        elif generator.random() < 0.5:
+            widths.remove(rows.pop(position))
+        else:
+            widths.replace(rows[position], values)
+            rows[position] = values
+
+        assert widths.maximums == [max([7 * len(values[column]) for values in rows] or [0])
+                                   for column in range(2)]
+
+
+@pytest.mark.parametrize('size', range(7))
+def test_longest_increasing_on_permutations(size):
+    for sequence in permutations(range(size)):
+        positions = longest_increasing(sequence)
+        values = [sequence[position] for position in positions]
+
+        assert positions == sorted(set(positions))
+        assert values == sorted(set(values))
+
+        longest = max(length for length in range(size + 1)
+                      if any(list(run) == sorted(run) for run in combinations(sequence, length)))
+        assert len(positions) == longest
+
+
+def test_reconcile_moves_only_the_rows_out_of_order():
+    generator = random.Random(5)
+    items = [[str(ix)] for ix in range(30)]
+    widget = MultiColumnListbox.__new__(MultiColumnListbox)
+    widget.items = items
+    widget.view = ListView(SortEngine(items))
+    widget.tree = FakeTree()
+    widget.drawn = {}
+
+    shown = []
+    for _ in range(50):
+        before = shown
+        shown = [ix for ix in range(30) if generator.random() < 0.7]
+        generator.shuffle(shown)
+        items[generator.randrange(30)][0] += '!'
+        widget.filtered_items_ix = shown
+        widget.tree.moved = 0
+        widget._reconcile()
+
+        assert widget.tree.iids == [str(ix) for ix in shown]
+        assert all(widget.tree.values[str(ix)] == items[ix] for ix in shown)
+
+        kept = [shown.index(ix) for ix in before if ix in shown]
+        assert widget.tree.moved == len(kept) - len(longest_increasing(kept))